@@ -0,0 +1,148 @@
+# Compara CPU e memória por 10 mil clientes no caminho que a extração executa:
+# decodificar a resposta, montar a linha da seção e codificá-la como linha
+# NDJSON. A linha de base usa json + dicts montados campo a campo; a atual usa
+# decodificar_json/codificar_linha_json (orjson quando instalado) e as funções
+# linha_* do extrator. As linhas não são retidas, como no destino em disco.
+# Uso: python benchmark_parsers.py [quantidade_de_clientes]
+
+import json
+import sys
+import time
+import tracemalloc
+
+from extrator_icatu import (ORJSON_DISPONIVEL, codificar_linha_json, decodificar_json, join_array, linha_cliente,
+                            linha_produto_previdencia, linha_produto_vida, to_formatted_line_of_business,
+                            to_product_status, to_utc_date)
+
+# --- Parsers anteriores, mantidos aqui apenas como linha de base ---
+def legado_cliente(item, details):
+    return {
+        'id_cliente': details.get('codigoBaseAgrupada'), 'nome': details.get('nome'),
+        'documento': f"{item.get('documento', {}).get('tipo')}: {item.get('documento', {}).get('numeroFormatado')}",
+        'titular_cpf': details.get('titularCPF'), 'sexo': details.get('sexo'),
+        'data_nascimento': details.get('dataNascimentoFormatada'), 'estado_civil': details.get('estadoCivilFormatado'),
+        'tipo_documento': (details.get('identidade') or [{}])[0].get('tipoDocumento'),
+        'numero_documento': (details.get('identidade') or [{}])[0].get('documento'),
+        'orgao_expedidor': (details.get('identidade') or [{}])[0].get('orgaoExpedidor'),
+        'renda_patrimonio': details.get('rendaResumidaFormatada'), 'profissao': details.get('profissao'),
+        'telefone': join_array(details.get('telefone'), ';', 'numeroTelefone'),
+        'email': (details.get('emails') or [{}])[0].get('email'),
+        'endereco': (details.get('endereco') or [{}])[0].get('descricaoEndereco'),
+        'numero': (details.get('endereco') or [{}])[0].get('numero'),
+        'complemento': (details.get('endereco') or [{}])[0].get('complemento'),
+        'bairro': (details.get('endereco') or [{}])[0].get('bairro'),
+        'cidade': (details.get('endereco') or [{}])[0].get('municipio'),
+        'uf': (details.get('endereco') or [{}])[0].get('uf'),
+        'cep': (details.get('endereco') or [{}])[0].get('cepFormatado'),
+    }
+
+def legado_produto_prev(product, id_cliente):
+    prod = {
+        'id_cliente': id_cliente, 'linha_negocio': to_formatted_line_of_business(product.get('linhaNegocio')),
+        'tipo_produto': product.get('nomeProduto'), 'numero_proposta': product.get('proposta'),
+        'numero_certificado': product.get('certificado'), 'valor_contribuicao': product.get('valorPagamento'),
+        'situacao_produto': to_product_status(product), 'numero_processo_susep': product.get('numeroProcessoSusep'),
+        'dia_vencimento': product.get('diaVencimento'), 'ultimo_pagamento': to_utc_date(product.get('dataUltimoPagamento')),
+        'proximo_pagamento': to_utc_date(product.get('dataProximoPagamento')),
+        'quantidade_parcelas_pagas': product.get('quantidadeParcelasPagas'),
+        'quantidade_parcelas_pendentes': product.get('quantidadeParcelasPendentes'),
+        'periodicidade_pagamentos': product.get('periodicidadePagamento'), 'forma_pagamento': product.get('formaPagamento'),
+    }
+    acumulacao = product.get('prev', {}).get('acumulacao')
+    if acumulacao:
+        prod.update({'nome_fundo': acumulacao.get('fundo'), 'cnpj_fundo': acumulacao.get('cnpjFundo'),
+                     'regime_tributario': acumulacao.get('regimeTribCertAcumulacao'),
+                     'indexador_plano': acumulacao.get('indexadorCertificadoAcumulacao')})
+    return prod
+
+def legado_produto_vida(product, benefit, id_cliente):
+    return {
+        'id_cliente': id_cliente, 'linha_negocio': to_formatted_line_of_business(product.get('linhaNegocio')),
+        'tipo_produto': product.get('nomeProduto'), 'numero_proposta': product.get('proposta'),
+        'numero_certificado': product.get('certificado'), 'situacao_produto': to_product_status(product),
+        'nome_cobertura': benefit.get('nomeBeneficio'), 'capital_segurado': benefit.get('capitalBeneficioSegurado'),
+        'periodo_pagamento_cobertura': benefit.get('prazoPagamento'), 'dia_vencimento': product.get('diaVencimento'),
+        'ultimo_pagamento': to_utc_date(product.get('dataUltimoPagamento')),
+        'proximo_pagamento': to_utc_date(product.get('dataProximoPagamento')),
+        'quantidade_parcelas_pagas': product.get('quantidadeParcelasPagas'),
+        'quantidade_parcelas_pendentes': product.get('quantidadeParcelasPendentes'),
+        'periodicidade_pagamentos': product.get('periodicidadePagamento'),
+    }
+
+# --- Massa sintética no formato das respostas do Tombamento ---
+def gerar_massa(quantidade):
+    massa = []
+    for i in range(quantidade):
+        item = {'codigoBaseAgrupada': str(100000 + i), 'cpfCnpj': f"{i:011d}",
+                'documento': {'tipo': 'CPF', 'numeroFormatado': f"{i:011d}"}}
+        detalhes = {'detalhesCliente': {'clientes': [{
+            'codigoBaseAgrupada': str(100000 + i), 'nome': f"CLIENTE {i}", 'titularCPF': f"{i:011d}", 'sexo': 'F',
+            'dataNascimentoFormatada': '01/01/1980', 'estadoCivilFormatado': 'Casado(a)', 'rendaResumidaFormatada': 'R$ 5.000,00',
+            'profissao': 'Analista', 'identidade': [{'tipoDocumento': 'RG', 'documento': '1234567', 'orgaoExpedidor': 'SSP'}],
+            'telefone': [{'numeroTelefone': '11999990000'}, {'numeroTelefone': '1133330000'}],
+            'emails': [{'email': f"cliente{i}@exemplo.com"}],
+            'endereco': [{'descricaoEndereco': 'Rua Exemplo', 'numero': str(i), 'complemento': 'Apto 1', 'bairro': 'Centro',
+                          'municipio': 'São Paulo', 'uf': 'SP', 'cepFormatado': '01000-000'}],
+        }]}}
+        produtos = {'produtosCliente': {'listarProdutos': [
+            {'linhaNegocio': 'PREV', 'nomeProduto': 'PGBL', 'proposta': f"P{i}", 'certificado': f"C{i}", 'valorPagamento': 350.0,
+             'situacaoCertificado': 'A', 'numeroProcessoSusep': '15414.000000/2020-00', 'diaVencimento': 10,
+             'dataUltimoPagamento': '2024-05-10T00:00:00Z', 'dataProximoPagamento': '2024-06-10T00:00:00Z',
+             'quantidadeParcelasPagas': 24, 'quantidadeParcelasPendentes': 0, 'periodicidadePagamento': 'Mensal',
+             'formaPagamento': 'Débito', 'prev': {'acumulacao': {'fundo': 'Fundo RF', 'cnpjFundo': '00.000.000/0001-00',
+                                                                'regimeTribCertAcumulacao': 'Regressivo',
+                                                                'indexadorCertificadoAcumulacao': 'IPCA'}}},
+            {'linhaNegocio': 'VIDA', 'nomeProduto': 'Vida Individual', 'proposta': f"V{i}", 'certificado': f"D{i}",
+             'situacaoTitulo': 'A', 'diaVencimento': 5, 'dataUltimoPagamento': '2024-05-05T00:00:00Z',
+             'dataProximoPagamento': '2024-06-05T00:00:00Z', 'quantidadeParcelasPagas': 12, 'quantidadeParcelasPendentes': 1,
+             'periodicidadePagamento': 'Mensal',
+             'vida': {'beneficios': [{'nomeBeneficio': 'Morte', 'capitalBeneficioSegurado': 100000.0, 'prazoPagamento': 'Vitalício'},
+                                     {'nomeBeneficio': 'Invalidez', 'capitalBeneficioSegurado': 50000.0, 'prazoPagamento': '10 anos'}]}},
+        ]}}
+        massa.append((item, json.dumps(detalhes).encode('utf-8'), json.dumps(produtos).encode('utf-8')))
+    return massa
+
+def codificar_legado(linha):
+    return (json.dumps(linha, ensure_ascii=False, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+def processar(massa, decodificar, codificar, cliente, produto_prev, produto_vida):
+    linhas = bytes_escritos = 0
+    for item, corpo_detalhes, corpo_produtos in massa:
+        details = decodificar(corpo_detalhes)['detalhesCliente']['clientes'][0]
+        bytes_escritos += len(codificar(cliente(item, details)))
+        linhas += 1
+        for product in decodificar(corpo_produtos)['produtosCliente']['listarProdutos']:
+            if product['linhaNegocio'] == 'PREV':
+                bytes_escritos += len(codificar(produto_prev(product, details['codigoBaseAgrupada'])))
+                linhas += 1
+            else:
+                for benefit in product['vida']['beneficios']:
+                    bytes_escritos += len(codificar(produto_vida(product, benefit, details['codigoBaseAgrupada'])))
+                    linhas += 1
+    return linhas, bytes_escritos
+
+def medir(nome, massa, *etapas):
+    processar(massa[:200], *etapas)  # aquecimento
+    inicio = time.process_time()
+    processar(massa, *etapas)
+    cpu = time.process_time() - inicio
+    tracemalloc.start()
+    linhas, bytes_escritos = processar(massa, *etapas)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    por_10k = 10000 / len(massa)
+    print(f"{nome:<36} CPU: {cpu * por_10k:6.3f}s   pico de memória: {pico / 2**10:8.1f} KB   "
+          f"({linhas} linhas, {bytes_escritos * por_10k / 2**20:.2f} MB de NDJSON)")
+    return cpu
+
+if __name__ == "__main__":
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    massa = gerar_massa(quantidade)
+    print(f"{quantidade} clientes sintéticos (orjson: {'sim' if ORJSON_DISPONIVEL else 'não instalado'}), CPU por 10 mil clientes:")
+    antes = medir("antes (json + dicts legados)", massa, json.loads, codificar_legado,
+                  legado_cliente, legado_produto_prev, legado_produto_vida)
+    medir("json + linha_* do extrator", massa, json.loads, codificar_legado,
+          linha_cliente, linha_produto_previdencia, linha_produto_vida)
+    depois = medir("atual (codec do extrator + linha_*)", massa, decodificar_json, codificar_linha_json,
+                   linha_cliente, linha_produto_previdencia, linha_produto_vida)
+    print(f"Ganho de CPU: {antes / depois:.2f}x")
@@ -9,11 +9,22 @@ import os
 import pandas as pd
 import warnings
 from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
 import asyncio
 from dotenv import load_dotenv
 import logging
+import sys
 import random
+import math
+import base64
+import re
+import sqlite3
+import hashlib
+from datetime import timedelta
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from contextlib import contextmanager
+import contextvars
 
 # Configuração do logging
 logging.basicConfig(
@@ -36,15 +47,176 @@ warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 USUARIO = os.getenv("ICATU_USUARIO")
 SENHA = os.getenv("ICATU_SENHA")
 
-if not USUARIO or not SENHA:
-    logging.error("ERRO: As variáveis de ambiente ICATU_USUARIO e ICATU_SENHA devem ser definidas.")
-    exit()
-
 PASTA_DOWNLOAD = "downloads"
+# Excel só sob demanda: gerado depois a partir do backup com
+# python extrator_icatu.py --excel downloads/<arquivo>_backup.ndjson
+# (ICATU_GERAR_EXCEL=1 volta a gerá-lo junto com cada extração).
+GERAR_EXCEL = os.getenv("ICATU_GERAR_EXCEL", "0") == "1"
+
+# Saída colunar (Parquet) por seção, particionada por corretora:
+# downloads/parquet/<dataset>/corretora=<nome>/part-0.parquet (requer pyarrow)
+GERAR_PARQUET = os.getenv("ICATU_GERAR_PARQUET", "1") == "1"
+PASTA_PARQUET = os.path.join(PASTA_DOWNLOAD, "parquet")
+PARQUET_LOTE = 50000
+_COLUNAS_PRODUTO = {
+    'id_cliente': 'string', 'linha_negocio': 'string', 'tipo_produto': 'string', 'numero_proposta': 'string',
+    'numero_certificado': 'string', 'situacao_produto': 'string',
+}
+_COLUNAS_PAGAMENTO_PRODUTO = {
+    'dia_vencimento': 'int64', 'ultimo_pagamento': 'date32', 'proximo_pagamento': 'date32',
+    'quantidade_parcelas_pagas': 'int64', 'quantidade_parcelas_pendentes': 'int64', 'periodicidade_pagamentos': 'string',
+}
+# Esquema explícito de cada seção: (dataset, {coluna: tipo}). Tipos: string, int64, float64, date32.
+SCHEMAS_PARQUET = {
+    'Clientes': ('clientes', {
+        'id_cliente': 'string', 'nome': 'string', 'documento': 'string', 'titular_cpf': 'string', 'sexo': 'string',
+        'data_nascimento': 'string', 'estado_civil': 'string', 'tipo_documento': 'string', 'numero_documento': 'string',
+        'orgao_expedidor': 'string', 'renda_patrimonio': 'string', 'profissao': 'string', 'telefone': 'string', 'email': 'string',
+        'endereco': 'string', 'numero': 'string', 'complemento': 'string', 'bairro': 'string', 'cidade': 'string', 'uf': 'string',
+        'cep': 'string',
+    }),
+    'Produtos Previdencia': ('produtos_previdencia', {
+        **_COLUNAS_PRODUTO, 'valor_contribuicao': 'float64', 'numero_processo_susep': 'string', **_COLUNAS_PAGAMENTO_PRODUTO,
+        'forma_pagamento': 'string', 'nome_fundo': 'string', 'cnpj_fundo': 'string', 'regime_tributario': 'string',
+        'indexador_plano': 'string',
+    }),
+    'Produtos Vida': ('produtos_vida', {
+        **_COLUNAS_PRODUTO, 'nome_cobertura': 'string', 'capital_segurado': 'float64', 'periodo_pagamento_cobertura': 'string',
+        **_COLUNAS_PAGAMENTO_PRODUTO,
+    }),
+    'Pagamentos Pendentes': ('pagamentos_pendentes', {
+        'linha_negocio': 'string', 'produto': 'string', 'numero_proposta': 'string', 'numero_certificado': 'string',
+        'nome_cliente': 'string', 'cpf_cliente': 'string', 'status_pagamento': 'string', 'vencimento_original': 'string',
+        'vencimento_atual': 'string', 'competencia': 'string', 'forma_pagamento': 'string', 'contribuicao': 'float64',
+        'dias_em_atraso': 'int64', 'email_cliente': 'string', 'telefone1': 'string', 'telefone2': 'string',
+    }),
+    'Status Propostas': ('status_propostas', {
+        'nome': 'string', 'cpf': 'string', 'produto': 'string', 'linha_negocio': 'string', 'proposta': 'string',
+        'criada_em': 'string', 'status_proposta': 'string', 'data': 'string', 'forma_pagamento': 'string', 'valor': 'float64',
+        'vencimento': 'string', 'competencia': 'string', 'status_pagamento': 'string', 'motivo_pendencia': 'string',
+    }),
+}
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_DISPONIVEL = True
+except ImportError:
+    PYARROW_DISPONIVEL = False
+URL_PORTAL = "https://portalcorretor.icatuseguros.com.br/casadocorretor"
+URL_LOGIN = f"{URL_PORTAL}/login"
+ARQUIVO_SESSAO = "sessao_icatu.json"
+SELETOR_USUARIO = 'input[placeholder="Usuário"]'
+SELETOR_LISTA_CORRETORAS = 'div.dsi_header-selected-item:has-text("Selecione")'
+SELETOR_CORRETOR_VINCULADO = 'button.dsi-button-link:has-text("Selecionar corretor vinculado a plataforma")'
 NOME_CORRETORA_MAE = "OUTLIER CORRETORA LTDA"
 CNPJ_CORRETORA_MAE = "48.978.010/0001-22" # CNPJ da segunda opção
 CUSTOM_HEADER_NAME = 'customHeader'
-CONCURRENCY_LIMIT = 20
+CONCURRENCY_LIMIT = 20  # limite inicial do LimitadorAdaptativo
+CONCURRENCY_MIN = 4
+CONCURRENCY_MAX = 64
+LIMITADOR_JANELA_AMOSTRAS = 50
+LIMITADOR_TOLERANCIA_LATENCIA = 1.5
+LIMITADOR_FATOR_REDUCAO = 0.7
+
+# Pipeline de clientes: consumidores buscam detalhes/produtos a partir de uma fila limitada
+SECOES_CLIENTES = ['Clientes', 'Produtos Previdencia', 'Produtos Vida']
+CLIENTES_CONSUMIDORES = CONCURRENCY_MAX // 2
+CLIENTES_FILA_MAX = CLIENTES_CONSUMIDORES * 2
+
+# (nome, caminho da página no portal, endpoint cujo postData é capturado, método do IcatuAPIClient)
+SECOES_EXTRACAO = [
+    ("Clientes", "/meus-clientes", '/api/RelacionamentoCliente/Tombamento/clientes', 'get_customers'),
+    ("Pagamentos Pendentes", "/meus-clientes/pendentes-beta", '/api/Relatorio/pendentes/tabela/v2', 'get_pending_payments'),
+    ("Status de Propostas", "/venda/status-proposta", '/api/relatorio/consulta/status/v2', 'get_proposal_status'),
+]
+# Seções do NDJSON/manifesto produzidas por cada seção extraída
+SECOES_SAIDA = {
+    "Clientes": SECOES_CLIENTES,
+    "Pagamentos Pendentes": ['Pagamentos Pendentes'],
+    "Status de Propostas": ['Status Propostas'],
+}
+
+# Tokens das corretoras: renovados antes de expirar e após um 401
+TOKEN_MARGEM_RENOVACAO = 120
+TOKEN_MAX_RENOVACOES_POR_REQUISICAO = 2
+# Após uma renovação que falhou, novas tentativas com o mesmo token só depois deste intervalo (s)
+TOKEN_ESPERA_APOS_FALHA = 300
+
+# Templates de postData reutilizados entre corretoras e execuções
+ARQUIVO_TEMPLATES_POSTDATA = "templates_postdata.json"
+# Chaves do postData que identificam a corretora: se alguma ficar com valor
+# literal (não parametrizado), o corpo não é salvo como template.
+CAMPOS_IDENTIFICACAO_CORRETORA = re.compile(r'corretor|susep|cnpj|produtor|intermediario|agente', re.IGNORECASE)
+
+# Contextualização direta: após aprender a requisição de contextualizar pela
+# interface, os tokens das próximas corretoras são obtidos via HTTP.
+MODO_CONTEXTUALIZACAO = os.getenv("ICATU_CONTEXTUALIZACAO", "api")  # "api" ou "interface"
+ARQUIVO_IDS_CORRETORAS = "corretoras_ids.json"
+
+# Checkpoints da extração em andamento (retomada após uma interrupção)
+ARQUIVO_JOURNAL = "journal_extracao.sqlite"
+JOURNAL_VALIDADE_HORAS = 24
+
+# Extração incremental: detalhes/produtos só são buscados para clientes novos
+# ou cujo item na listagem mudou desde o último snapshot da corretora.
+MODO_INCREMENTAL = os.getenv("ICATU_INCREMENTAL", "1") == "1"
+ARQUIVO_SNAPSHOTS = "snapshots_clientes.sqlite"
+SNAPSHOT_REFRESH_DIAS = int(os.getenv("ICATU_REFRESH_COMPLETO_DIAS", "7"))
+
+# Cache em disco das respostas de detalhe do Tombamento:
+# (nome, padrão da URL, TTL em segundos, resposta depende da corretora do token)
+ARQUIVO_CACHE_HTTP = "cache_http.sqlite"
+CACHE_HTTP_TAMANHO_MAX_MB = int(os.getenv("ICATU_CACHE_HTTP_MB", "512"))
+CACHE_HTTP_ENDPOINTS = [
+    ('produtos_cliente', r'/RelacionamentoCliente/Tombamento/clientes/[^/?]+/produtos', 6 * 3600, True),
+    ('detalhes_cliente', r'/RelacionamentoCliente/Tombamento/clientes/[^/?]+$', 12 * 3600, False),
+]
+
+# Paginação: páginas buscadas em paralelo à frente da página sendo consumida
+PAGINACAO_JANELA = 4
+CAMPOS_TOTAL_PAGINAS = ('totalPaginas', 'quantidadePaginas', 'qtdPaginas', 'totalPages')
+CAMPOS_TOTAL_REGISTROS = ('totalRegistros', 'quantidadeRegistros', 'qtdRegistros', 'totalItens')
+
+# Cliente HTTP compartilhado (keep-alive + HTTP/2 quando o pacote 'h2' está instalado)
+HTTP_TIMEOUT = 45
+HTTP_MAX_CONEXOES = 100
+HTTP_MAX_CONEXOES_KEEPALIVE = 20
+HTTP_KEEPALIVE_EXPIRY = 30
+# Política de retry das chamadas à API
+RETRY_MAX_TENTATIVAS = 5
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 30.0
+RETRY_AFTER_MAX = 120.0
+RETRY_ORCAMENTO_POR_CORRETORA = 500
+try:
+    import orjson
+    ORJSON_DISPONIVEL = True
+except ImportError:
+    ORJSON_DISPONIVEL = False
+try:
+    import h2  # noqa: F401 - apenas habilita o suporte a HTTP/2 do httpx
+    HTTP2_DISPONIVEL = True
+except ImportError:
+    HTTP2_DISPONIVEL = False
+
+# Navegador: headless por padrão e perfil "enxuto", que aborta recursos não
+# essenciais e domínios de terceiros ("completo" carrega o portal inteiro).
+NAVEGADOR_HEADLESS = os.getenv("ICATU_HEADLESS", "1") == "1"
+PERFIL_NAVEGACAO = os.getenv("ICATU_PERFIL_NAVEGACAO", "enxuto")
+TIPOS_RECURSO_BLOQUEADOS = ('image', 'media', 'font')
+# ICATU_DOMINIOS_EXTRAS libera hosts de terceiros (lista separada por vírgulas,
+# subdomínios incluídos). O login não depende deles; o banner de cookies
+# (OneTrust) vem de cdn.cookielaw.org e geolocation.onetrust.com e, bloqueado,
+# não é exibido, então o aceite é pulado. Se o portal passar a exigir captcha,
+# libere google.com, gstatic.com e recaptcha.net.
+DOMINIOS_ESSENCIAIS = ['icatuseguros.com.br'] + [d.strip() for d in os.getenv("ICATU_DOMINIOS_EXTRAS", "").split(',') if d.strip()]
+HOST_BANNER_COOKIES = 'cdn.cookielaw.org'
+
+# Modo pool de workers: cada worker usa um contexto de navegador isolado e
+# consome corretoras de uma fila compartilhada.
+NUM_WORKERS = int(os.getenv("ICATU_WORKERS", "1"))
+PAUSA_MIN_SEGUNDOS = float(os.getenv("ICATU_PAUSA_MIN", "5"))
+PAUSA_MAX_SEGUNDOS = float(os.getenv("ICATU_PAUSA_MAX", "15"))
 
 # === FUNÇÕES HELPERS E CLASSE DA API (sem alterações) ===
 def to_utc_date(string_date):
@@ -70,244 +242,1493 @@ def to_product_status(customer_product):
     if value == 'A': return 'Ativo'
     if value == 'C': return 'Cancelado'
     return value
-class IcatuAPIClient:
-    def __init__(self, token):
+def decodificar_json(dados):
+    """Decodifica um corpo JSON (bytes ou str), com orjson quando instalado."""
+    return orjson.loads(dados) if ORJSON_DISPONIVEL else json.loads(dados)
+def codificar_linha_json(obj):
+    """Serializa `obj` como JSON compacto em UTF-8 terminado em quebra de linha (uma linha NDJSON)."""
+    if ORJSON_DISPONIVEL: return orjson.dumps(obj, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+# === LINHAS DAS SEÇÕES ===
+# Uma função por seção monta a linha de saída (dict) diretamente da resposta
+# da API, lendo apenas os campos usados; a linha segue direto para o destino.
+def linha_cliente(item, details):
+    documento = item.get('documento', {})
+    identidade = (details.get('identidade') or [{}])[0]
+    endereco = (details.get('endereco') or [{}])[0]
+    return {
+        'id_cliente': details.get('codigoBaseAgrupada'), 'nome': details.get('nome'),
+        'documento': f"{documento.get('tipo')}: {documento.get('numeroFormatado')}",
+        'titular_cpf': details.get('titularCPF'), 'sexo': details.get('sexo'),
+        'data_nascimento': details.get('dataNascimentoFormatada'), 'estado_civil': details.get('estadoCivilFormatado'),
+        'tipo_documento': identidade.get('tipoDocumento'), 'numero_documento': identidade.get('documento'),
+        'orgao_expedidor': identidade.get('orgaoExpedidor'),
+        'renda_patrimonio': details.get('rendaResumidaFormatada'), 'profissao': details.get('profissao'),
+        'telefone': join_array(details.get('telefone'), ';', 'numeroTelefone'),
+        'email': (details.get('emails') or [{}])[0].get('email'),
+        'endereco': endereco.get('descricaoEndereco'), 'numero': endereco.get('numero'),
+        'complemento': endereco.get('complemento'), 'bairro': endereco.get('bairro'),
+        'cidade': endereco.get('municipio'), 'uf': endereco.get('uf'), 'cep': endereco.get('cepFormatado'),
+    }
+
+def linha_produto_previdencia(product, id_cliente):
+    acumulacao = (product.get('prev') or {}).get('acumulacao') or {}
+    return {
+        'id_cliente': id_cliente, 'linha_negocio': to_formatted_line_of_business(product.get('linhaNegocio')),
+        'tipo_produto': product.get('nomeProduto'), 'numero_proposta': product.get('proposta'),
+        'numero_certificado': product.get('certificado'), 'valor_contribuicao': product.get('valorPagamento'),
+        'situacao_produto': to_product_status(product), 'numero_processo_susep': product.get('numeroProcessoSusep'),
+        'dia_vencimento': product.get('diaVencimento'),
+        'ultimo_pagamento': to_utc_date(product.get('dataUltimoPagamento')),
+        'proximo_pagamento': to_utc_date(product.get('dataProximoPagamento')),
+        'quantidade_parcelas_pagas': product.get('quantidadeParcelasPagas'),
+        'quantidade_parcelas_pendentes': product.get('quantidadeParcelasPendentes'),
+        'periodicidade_pagamentos': product.get('periodicidadePagamento'), 'forma_pagamento': product.get('formaPagamento'),
+        'nome_fundo': acumulacao.get('fundo'), 'cnpj_fundo': acumulacao.get('cnpjFundo'),
+        'regime_tributario': acumulacao.get('regimeTribCertAcumulacao'),
+        'indexador_plano': acumulacao.get('indexadorCertificadoAcumulacao'),
+    }
+
+def linha_produto_vida(product, benefit, id_cliente):
+    return {
+        'id_cliente': id_cliente, 'linha_negocio': to_formatted_line_of_business(product.get('linhaNegocio')),
+        'tipo_produto': product.get('nomeProduto'), 'numero_proposta': product.get('proposta'),
+        'numero_certificado': product.get('certificado'), 'situacao_produto': to_product_status(product),
+        'nome_cobertura': benefit.get('nomeBeneficio'), 'capital_segurado': benefit.get('capitalBeneficioSegurado'),
+        'periodo_pagamento_cobertura': benefit.get('prazoPagamento'), 'dia_vencimento': product.get('diaVencimento'),
+        'ultimo_pagamento': to_utc_date(product.get('dataUltimoPagamento')),
+        'proximo_pagamento': to_utc_date(product.get('dataProximoPagamento')),
+        'quantidade_parcelas_pagas': product.get('quantidadeParcelasPagas'),
+        'quantidade_parcelas_pendentes': product.get('quantidadeParcelasPendentes'),
+        'periodicidade_pagamentos': product.get('periodicidadePagamento'),
+    }
+
+def linha_pendente(item):
+    return {
+        'linha_negocio': item.get("linhaNegocio"), 'produto': item.get("nomeProdutoComercial"),
+        'numero_proposta': item.get("numeroProposta"), 'numero_certificado': item.get("numeroCertificado"),
+        'nome_cliente': item.get("nomeCliente"), 'cpf_cliente': item.get("cpfCnpjCliente"),
+        'status_pagamento': item.get("statusPagamento"), 'vencimento_original': item.get("diaVencimentoOriginal"),
+        'vencimento_atual': item.get("diaVencimentoAtual"), 'competencia': item.get("competencia"),
+        'forma_pagamento': item.get("formaCobranca"), 'contribuicao': item.get("valorParcela"),
+        'dias_em_atraso': item.get("diasDeAtraso"), 'email_cliente': item.get("email"),
+        'telefone1': item.get("telefone1"), 'telefone2': item.get("telefone2"),
+    }
+
+def linha_status_proposta(item, installment):
+    return {
+        'nome': item.get('nomeProponente'), 'cpf': item.get('cpfProponente'), 'produto': item.get('nomeProduto'),
+        'linha_negocio': item.get('linhaNegocio'), 'proposta': item.get('numeroProposta'),
+        'criada_em': item.get('dataProtocolo'), 'status_proposta': item.get('statusFase'), 'data': item.get('dataStatus'),
+        'forma_pagamento': item.get('formaPagamento'), 'valor': installment.get('valor'),
+        'vencimento': installment.get('agendamentoDebito'), 'competencia': installment.get('competencia'),
+        'status_pagamento': item.get('statusPagamento'), 'motivo_pendencia': item.get('motivoPendencia'),
+    }
+
+def criar_cliente_http():
+    """Cria o httpx.AsyncClient de longa duração usado por todas as chamadas à API."""
+    limites = httpx.Limits(
+        max_connections=HTTP_MAX_CONEXOES,
+        max_keepalive_connections=HTTP_MAX_CONEXOES_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limites, http2=HTTP2_DISPONIVEL)
+
+class MetricasConexao:
+    """
+    Mede o reuso de conexões do pool: cada requisição que não abriu uma
+    conexão TCP nova reaproveitou uma conexão keep-alive (ou um stream HTTP/2).
+    """
+    def __init__(self):
+        self.requisicoes = 0
+        self.conexoes_novas = 0
+        self.requisicoes_http2 = 0
+    async def trace(self, evento, info):
+        if evento == 'connection.connect_tcp.complete':
+            self.conexoes_novas += 1
+    def registrar_resposta(self, response):
+        self.requisicoes += 1
+        if response.http_version == 'HTTP/2':
+            self.requisicoes_http2 += 1
+    def resumo(self):
+        reutilizadas = max(self.requisicoes - self.conexoes_novas, 0)
+        taxa = reutilizadas / self.requisicoes * 100 if self.requisicoes else 0.0
+        return (f"{self.requisicoes} requisições, {self.conexoes_novas} conexões novas, "
+                f"{taxa:.1f}% com conexão reutilizada, {self.requisicoes_http2} via HTTP/2")
+
+class LimitadorAdaptativo:
+    """
+    Controla quantas requisições de uma corretora ficam em voo ao mesmo tempo.
+
+    A cada janela de amostras o limite é ajustado no estilo AIMD: cresce de um
+    em um enquanto não há erros e o p95 da latência se mantém próximo da
+    referência saudável, e é reduzido multiplicativamente quando aparecem
+    erros do gateway (ou levemente quando a latência dispara).
+    """
+    def __init__(self, inicial=CONCURRENCY_LIMIT, minimo=CONCURRENCY_MIN, maximo=CONCURRENCY_MAX,
+                 janela=LIMITADOR_JANELA_AMOSTRAS):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.janela = janela
+        self.em_uso = 0
+        self.latencia_referencia = None
+        self.historico = [(datetime.now(), int(self.limite), 'inicial', None, 0.0)]
+        self._latencias = []
+        self._erros = 0
+        self._condicao = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condicao:
+            await self._condicao.wait_for(lambda: self.em_uso < int(self.limite))
+            self.em_uso += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condicao:
+            self.em_uso -= 1
+            self._condicao.notify_all()
+
+    def registrar(self, latencia, erro):
+        self._latencias.append(latencia)
+        if erro: self._erros += 1
+        if len(self._latencias) >= self.janela:
+            self._ajustar()
+
+    def _ajustar(self):
+        latencias = sorted(self._latencias)
+        p95 = latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)]
+        taxa_erro = self._erros / len(latencias)
+        self._latencias, self._erros = [], 0
+
+        anterior = int(self.limite)
+        if self.latencia_referencia is None: self.latencia_referencia = p95
+        gradiente = p95 / self.latencia_referencia if self.latencia_referencia else 1.0
+
+        if taxa_erro > 0:
+            self.limite = max(self.minimo, self.limite * LIMITADOR_FATOR_REDUCAO)
+            motivo = 'erros'
+        elif gradiente > LIMITADOR_TOLERANCIA_LATENCIA:
+            self.limite = max(self.minimo, self.limite * 0.9)
+            motivo = 'latencia'
+        else:
+            self.limite = min(self.maximo, self.limite + 1)
+            self.latencia_referencia = 0.8 * self.latencia_referencia + 0.2 * p95
+            motivo = 'saudavel'
+
+        if int(self.limite) != anterior:
+            self.historico.append((datetime.now(), int(self.limite), motivo, p95, taxa_erro))
+            if int(self.limite) < anterior:
+                logging.info(f"Limitador: concorrência reduzida {anterior} -> {int(self.limite)} ({motivo}, p95 {p95:.2f}s, erros {taxa_erro:.0%}).")
+
+    def resumo(self):
+        ajustes = ', '.join(f"{momento:%H:%M:%S} {limite} ({motivo})" for momento, limite, motivo, _, _ in self.historico[-20:])
+        return f"limite atual {int(self.limite)} (min {self.minimo}, max {self.maximo}), {len(self.historico) - 1} ajustes: {ajustes}"
+
+class PoliticaRetry:
+    """
+    Classifica as falhas das requisições e decide se elas devem ser repetidas.
+
+    Apenas requisições idempotentes são repetidas, com backoff exponencial e
+    jitter completo, respeitando o cabeçalho Retry-After. Cada corretora tem
+    um orçamento total de retries para não martelar o gateway indefinidamente.
+    """
+    CATEGORIAS_RETENTAVEIS = {'servidor', 'limite_taxa', 'timeout', 'conexao', 'resposta_invalida'}
+    CATEGORIAS_SOBRECARGA = {'servidor', 'limite_taxa', 'timeout', 'conexao'}
+
+    def __init__(self, max_tentativas=RETRY_MAX_TENTATIVAS, backoff_base=RETRY_BACKOFF_BASE,
+                 backoff_max=RETRY_BACKOFF_MAX, orcamento=RETRY_ORCAMENTO_POR_CORRETORA):
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.orcamento_restante = orcamento
+        self.retries_por_categoria = Counter()
+        self.perdas_por_categoria = Counter()
+        self.requisicoes_recuperadas = 0
+        self.registros = {}
+
+    @staticmethod
+    def classificar(erro):
+        if isinstance(erro, httpx.HTTPStatusError):
+            status = erro.response.status_code
+            if status == 401: return 'nao_autorizado'
+            if status == 429: return 'limite_taxa'
+            if status >= 500: return 'servidor'
+            return 'cliente'
+        if isinstance(erro, httpx.TimeoutException): return 'timeout'
+        if isinstance(erro, (httpx.NetworkError, httpx.RemoteProtocolError)): return 'conexao'
+        if isinstance(erro, json.JSONDecodeError): return 'resposta_invalida'
+        return 'desconhecido'
+
+    def pode_repetir(self, categoria, tentativa, idempotente):
+        if not idempotente or categoria not in self.CATEGORIAS_RETENTAVEIS:
+            return False
+        if tentativa + 1 >= self.max_tentativas:
+            return False
+        if self.orcamento_restante <= 0:
+            if self.orcamento_restante == 0:
+                logging.warning("Orçamento de retries da corretora esgotado. Novas falhas não serão repetidas.")
+                self.orcamento_restante -= 1
+            return False
+        self.orcamento_restante -= 1
+        self.retries_por_categoria[categoria] += 1
+        return True
+
+    def tempo_espera(self, tentativa, erro):
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativa))
+        retry_after = self._retry_after(erro)
+        if retry_after is not None:
+            espera = max(espera, min(retry_after, RETRY_AFTER_MAX))
+        return espera
+
+    @staticmethod
+    def _retry_after(erro):
+        if not isinstance(erro, httpx.HTTPStatusError):
+            return None
+        valor = erro.response.headers.get('Retry-After')
+        if not valor:
+            return None
+        try:
+            return max(float(valor), 0.0)
+        except ValueError:
+            pass
+        try:
+            data_liberacao = parsedate_to_datetime(valor)
+            return max((data_liberacao - datetime.now(data_liberacao.tzinfo)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def registrar_registro(self, secao, recuperado=False, perdido=False):
+        contagem = self.registros.setdefault(secao, {'recuperados': 0, 'perdidos': 0})
+        if recuperado: contagem['recuperados'] += 1
+        if perdido: contagem['perdidos'] += 1
+
+    def resumo(self):
+        linhas = [f"Retries: {sum(self.retries_por_categoria.values())} {dict(self.retries_por_categoria)}, "
+                  f"requisições recuperadas: {self.requisicoes_recuperadas}, "
+                  f"requisições perdidas: {sum(self.perdas_por_categoria.values())} {dict(self.perdas_por_categoria)}"]
+        for secao, contagem in self.registros.items():
+            linhas.append(f"{secao}: {contagem['recuperados']} registros recuperados, {contagem['perdidos']} perdidos")
+        return linhas
+
+class ColetorSecoes:
+    """
+    Destino padrão das linhas extraídas: acumula os registros de cada seção em
+    memória, preservando a ordem em que as seções foram declaradas.
+    """
+    def __init__(self):
+        self.secoes = {}
+    def declarar(self, secao):
+        self.secoes.setdefault(secao, [])
+    def adicionar(self, secao, registro):
+        self.secoes.setdefault(secao, []).append(registro)
+    def abas(self, nomes=None):
+        nomes = nomes if nomes is not None else list(self.secoes)
+        return [{'name': nome, 'data': self.secoes.get(nome, [])} for nome in nomes]
+
+class EscritorNDJSON:
+    """
+    Destino que grava cada registro em disco assim que é produzido, uma linha
+    JSON compacta por registro: {"secao": ..., "dados": {...}}. O arquivo é
+    escrito como '.parcial' e só recebe o nome definitivo em `finalizar`,
+    depois do manifesto com contagens, colunas e SHA-256 de cada seção e do
+    arquivo inteiro. Seções que não puderam ser extraídas são listadas à
+    parte no manifesto, em 'secoes_puladas'.
+    """
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.caminho_parcial = f"{caminho}.parcial"
+        self.caminho_manifesto = caminho_manifesto_ndjson(caminho)
+        self.arquivo = open(self.caminho_parcial, 'wb')
+        self.secoes = {}
+        self.puladas = []
+        self.finalizado = False
+        self._hash = hashlib.sha256()
+
+    def declarar(self, secao):
+        if secao not in self.secoes:
+            self.secoes[secao] = {'registros': 0, 'colunas': {}, 'hash': hashlib.sha256()}
+
+    def adicionar(self, secao, registro):
+        self.declarar(secao)
+        info = self.secoes[secao]
+        linha = codificar_linha_json({'secao': secao, 'dados': registro})
+        self.arquivo.write(linha)
+        self._hash.update(linha)
+        info['hash'].update(linha)
+        info['registros'] += 1
+        info['colunas'].update(dict.fromkeys(registro))
+
+    def pular(self, secao):
+        """Registra que a seção não foi extraída: sem registros, ela não vale como seção vazia."""
+        if secao not in self.puladas: self.puladas.append(secao)
+
+    def abas(self, nomes=None):
+        """Resumo das seções gravadas; os registros em si estão no arquivo."""
+        nomes = nomes if nomes is not None else list(self.secoes)
+        return [{'name': nome, 'registros': self.secoes[nome]['registros'] if nome in self.secoes else 0} for nome in nomes]
+
+    def finalizar(self, **metadados):
+        """
+        Fecha o arquivo, grava o manifesto e só então publica o NDJSON com
+        rename atômico, para que o sincronizador nunca encontre o arquivo de
+        dados sem o manifesto ao lado. Retorna o manifesto.
+        """
+        self.arquivo.flush()
+        os.fsync(self.arquivo.fileno())
+        self.arquivo.close()
+        puladas = [secao for secao in self.puladas if not self.secoes.get(secao, {}).get('registros')]
+        manifesto = {
+            'arquivo': os.path.basename(self.caminho), 'gerado_em': datetime.now().isoformat(timespec='seconds'), **metadados,
+            'registros': sum(info['registros'] for info in self.secoes.values()), 'sha256': self._hash.hexdigest(),
+            'secoes': {nome: {'registros': info['registros'], 'colunas': list(info['colunas']), 'sha256': info['hash'].hexdigest()}
+                       for nome, info in self.secoes.items() if nome not in puladas},
+            'secoes_puladas': puladas,
+        }
+        temporario = f"{self.caminho_manifesto}.parcial"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, self.caminho_manifesto)
+        os.replace(self.caminho_parcial, self.caminho)
+        self.finalizado = True
+        return manifesto
+
+    def descartar(self):
+        """Remove o arquivo parcial de uma extração que não chegou ao fim."""
+        if not self.arquivo.closed: self.arquivo.close()
+        if os.path.exists(self.caminho_parcial): os.remove(self.caminho_parcial)
+
+def caminho_manifesto_ndjson(caminho):
+    return re.sub(r'(_backup)?\.ndjson$', '', caminho) + '_manifest.json'
+
+def prefixo_arquivos_corretora(corretora_nome):
+    return f"Extracao_{corretora_nome.replace(' ', '_').replace('/', '-')}_"
+
+def remover_parciais_orfaos(corretora_nome, pasta=PASTA_DOWNLOAD):
+    """
+    Remove os '.parcial' (NDJSON e manifesto) deixados por uma extração da
+    corretora que morreu sem passar por `descartar`. Retorna quantos removeu.
+    """
+    if not os.path.isdir(pasta): return 0
+    padrao = re.compile(re.escape(prefixo_arquivos_corretora(corretora_nome))
+                        + r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_(backup\.ndjson|manifest\.json)\.parcial$')
+    removidos = 0
+    for arquivo in os.listdir(pasta):
+        if padrao.match(arquivo):
+            os.remove(os.path.join(pasta, arquivo))
+            removidos += 1
+    if removidos: logging.info(f"{removidos} arquivo(s) .parcial órfão(s) de {corretora_nome} removido(s) de '{pasta}'.")
+    return removidos
+
+def payload_jwt(token):
+    """Claims de um token JWT ('Bearer ...' ou puro), sem validar a assinatura; None se não for JWT."""
+    try:
+        payload = token.split()[-1].split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+class GerenciadorToken:
+    """
+    Mantém válido o token Bearer de uma corretora durante toda a extração.
+
+    A expiração é lida do claim `exp` do JWT e o token é renovado
+    TOKEN_MARGEM_RENOVACAO segundos antes de vencer. Quando uma requisição
+    recebe 401, as novas requisições ficam pausadas enquanto um novo token é
+    obtido pela função `renovar` (API de contextualização ou navegador); as
+    que falharam com o token antigo são repetidas em seguida. Se a renovação
+    falhar, o mesmo token só é renovado de novo após TOKEN_ESPERA_APOS_FALHA.
+    """
+    def __init__(self, token, renovar=None):
         self.token = token
+        self.expira_em = self._decodificar_expiracao(token)
+        self.renovacoes = 0
+        self._renovar = renovar
+        self._falha = None  # (token, instante) da última renovação que falhou
+        self._lock = asyncio.Lock()
+        self._liberado = asyncio.Event()
+        self._liberado.set()
+
+    @staticmethod
+    def _decodificar_expiracao(token):
+        try:
+            exp = (payload_jwt(token) or {}).get('exp')
+            return float(exp) if exp else None
+        except (ValueError, TypeError):
+            return None
+
+    async def obter(self):
+        await self._liberado.wait()
+        token = self.token
+        if self.expira_em and time.time() >= self.expira_em - TOKEN_MARGEM_RENOVACAO:
+            await self.renovar(token, "expiração próxima")
+        return self.token
+
+    async def renovar(self, token_usado, motivo):
+        """Renova o token, a menos que outra requisição já o tenha renovado. Retorna True se há um token novo."""
+        async with self._lock:
+            if self.token != token_usado:
+                return True
+            if not self._renovar:
+                return False
+            if self._falha and self._falha[0] == token_usado and time.monotonic() - self._falha[1] < TOKEN_ESPERA_APOS_FALHA:
+                return False  # a renovação deste token acabou de falhar; não repete a cada requisição
+            logging.warning(f"Renovando token da corretora ({motivo}). Requisições pausadas...")
+            self._liberado.clear()
+            self._falha = (token_usado, time.monotonic())  # desfeito abaixo se a renovação der certo
+            try:
+                novo_token = await self._renovar()
+            finally:
+                self._liberado.set()
+            if not novo_token or novo_token == token_usado:
+                logging.error(f"Não foi possível renovar o token da corretora. Nova tentativa em {TOKEN_ESPERA_APOS_FALHA}s.")
+                return False
+            self._falha = None
+            self.token = novo_token
+            self.expira_em = self._decodificar_expiracao(novo_token)
+            self.renovacoes += 1
+            validade = f" (válido até {datetime.fromtimestamp(self.expira_em):%H:%M:%S})" if self.expira_em else ""
+            logging.info(f"Token renovado{validade}. Retomando requisições.")
+            return True
+
+class PostDataRejeitado(Exception):
+    """A API recusou (4xx) o corpo enviado na primeira página de uma listagem."""
+
+# Indica, na tarefa de cada seção, se o corpo enviado veio de um template. Só
+# nesse caso um 4xx ou uma primeira página vazia são tratados como rejeição do
+# corpo; com corpo capturado ao vivo o erro é registrado e a seção fica vazia.
+POSTDATA_DE_TEMPLATE = contextvars.ContextVar('postdata_de_template', default=False)
+
+class CacheRespostasHTTP:
+    """
+    Cache em disco das respostas dos endpoints de detalhe do Tombamento,
+    endereçado pelo hash de método, URL e corpo da requisição. Cada endpoint
+    tem seu TTL (CACHE_HTTP_ENDPOINTS) e o total armazenado é limitado a
+    CACHE_HTTP_TAMANHO_MAX_MB, removendo as entradas menos acessadas
+    recentemente. Evita buscar de novo o mesmo cliente em reexecuções; só os
+    endpoints que não dependem da corretora do token (os detalhes cadastrais)
+    são compartilhados entre corretoras, os produtos ficam separados por corretora.
+    """
+    def __init__(self, caminho=ARQUIVO_CACHE_HTTP, tamanho_max=CACHE_HTTP_TAMANHO_MAX_MB * 1024 * 1024, endpoints=CACHE_HTTP_ENDPOINTS):
+        self.caminho = caminho
+        self.tamanho_max = tamanho_max
+        self.endpoints = [(nome, re.compile(padrao), ttl, por_corretora) for nome, padrao, ttl, por_corretora in endpoints]
+        self.estatisticas = {nome: Counter() for nome, _, _, _ in self.endpoints}
+        self.conexao = sqlite3.connect(caminho)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS respostas (chave TEXT PRIMARY KEY, endpoint TEXT NOT NULL, corpo TEXT NOT NULL,
+                                                  tamanho INTEGER NOT NULL, gravado_em REAL NOT NULL, acessado_em REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS respostas_acessado_em ON respostas (acessado_em);
+        """)
+        self.conexao.commit()
+        self.tamanho_total = self.conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+
+    def politica(self, method, url):
+        """
+        Retorna (endpoint, ttl, por_corretora) se a requisição pode ser atendida
+        pelo cache, senão None.
+        """
+        if method != 'GET': return None
+        for nome, padrao, ttl, por_corretora in self.endpoints:
+            if padrao.search(url): return nome, ttl, por_corretora
+        return None
+
+    @staticmethod
+    def chave(method, url, corpo=None, corretora=None):
+        texto = f"{method}\n{url}\n{json.dumps(corpo, sort_keys=True, ensure_ascii=False) if corpo is not None else ''}"
+        if corretora is not None: texto += f"\n{corretora}"
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def obter(self, endpoint, ttl, chave):
+        linha = self.conexao.execute("SELECT corpo, gravado_em FROM respostas WHERE chave = ?", (chave,)).fetchone()
+        agora = time.time()
+        if linha is None or agora - linha[1] > ttl:
+            self.estatisticas[endpoint]['faltas'] += 1
+            if linha is not None: self.estatisticas[endpoint]['expiradas'] += 1
+            return None
+        self.conexao.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?", (agora, chave))
+        self.conexao.commit()
+        self.estatisticas[endpoint]['acertos'] += 1
+        return linha[0]
+
+    def salvar(self, endpoint, chave, corpo):
+        tamanho = len(corpo.encode('utf-8'))
+        if tamanho > self.tamanho_max: return
+        anterior = self.conexao.execute("SELECT tamanho FROM respostas WHERE chave = ?", (chave,)).fetchone()
+        agora = time.time()
+        self.conexao.execute("INSERT OR REPLACE INTO respostas (chave, endpoint, corpo, tamanho, gravado_em, acessado_em) VALUES (?, ?, ?, ?, ?, ?)",
+                             (chave, endpoint, corpo, tamanho, agora, agora))
+        self.tamanho_total += tamanho - (anterior[0] if anterior else 0)
+        if self.tamanho_total > self.tamanho_max:
+            self._remover_menos_usadas()
+        self.conexao.commit()
+
+    def _remover_menos_usadas(self):
+        """Remove as entradas acessadas há mais tempo até o cache ocupar 90% do limite."""
+        alvo = int(self.tamanho_max * 0.9)
+        removidas = []
+        for chave, endpoint, tamanho in self.conexao.execute("SELECT chave, endpoint, tamanho FROM respostas ORDER BY acessado_em"):
+            if self.tamanho_total <= alvo: break
+            removidas.append((chave,))
+            self.tamanho_total -= tamanho
+            if endpoint in self.estatisticas: self.estatisticas[endpoint]['removidas'] += 1
+        self.conexao.executemany("DELETE FROM respostas WHERE chave = ?", removidas)
+
+    def resumo(self):
+        linhas = [f"{nome}: {est['acertos']} acertos, {est['faltas']} faltas ({est['expiradas']} expiradas), {est['removidas']} removidas por LRU"
+                  for nome, est in self.estatisticas.items()]
+        linhas.append(f"ocupação: {self.tamanho_total / (1024 * 1024):.1f} MB de {self.tamanho_max / (1024 * 1024):.0f} MB")
+        return linhas
+
+    def fechar(self):
+        self.conexao.close()
+
+class IcatuAPIClient:
+    def __init__(self, token, http_client=None, renovar_token=None, journal=None, snapshot=None, cache_http=None,
+                 corretora=None):
+        self.gerenciador_token = GerenciadorToken(token, renovar_token)
+        self.journal = journal
+        self.snapshot = snapshot
+        self.cache_http = cache_http
+        self.corretora = corretora
+        self.estatisticas_cache = Counter()
         self.base_url = "https://portalcorretor.icatuseguros.com.br/casadocorretorgateway/api"
         self.headers = {
-            'Authorization': token, 'Content-Type': 'application/json', CUSTOM_HEADER_NAME: ''
+            'Content-Type': 'application/json', CUSTOM_HEADER_NAME: ''
         }
-        self.semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-    async def _make_request(self, method, url, **kwargs):
-        async with self.semaphore:
-            async with httpx.AsyncClient(timeout=45) as client:
+        self.limitador = LimitadorAdaptativo()
+        self.metricas_conexao = MetricasConexao()
+        self.politica_retry = PoliticaRetry()
+        self._client_proprio = http_client is None
+        self.client = http_client or criar_cliente_http()
+    async def aclose(self):
+        if self._client_proprio:
+            await self.client.aclose()
+    async def __aenter__(self):
+        return self
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    async def _make_request(self, method, url, idempotente=None, rastreio=None, levantar_rejeicao=False, **kwargs):
+        """
+        Executa a requisição aplicando a PoliticaRetry. Retorna o JSON da
+        resposta ou None quando a requisição é perdida. Se `rastreio` for um
+        dict, o número de retries feitos é acumulado em rastreio['retries'].
+        Com `levantar_rejeicao`, um erro 4xx do cliente levanta PostDataRejeitado.
+        Endpoints cobertos pelo `cache_http` são respondidos do disco enquanto
+        a resposta guardada estiver dentro do TTL.
+        """
+        if idempotente is None: idempotente = method == 'GET'
+        politica_cache = self.cache_http.politica(method, url) if self.cache_http else None
+        if politica_cache and politica_cache[2] and self.corretora is None:
+            politica_cache = None  # resposta depende da corretora, que não foi informada
+        if politica_cache:
+            endpoint_cache, ttl_cache, por_corretora = politica_cache
+            chave_cache = CacheRespostasHTTP.chave(method, url, kwargs.get('json'), self.corretora if por_corretora else None)
+            corpo = self.cache_http.obter(endpoint_cache, ttl_cache, chave_cache)
+            if corpo is not None:
+                self.estatisticas_cache['acertos'] += 1
+                return decodificar_json(corpo)
+            self.estatisticas_cache['faltas'] += 1
+        tentativa, renovacoes = 0, 0
+        while True:
+            token = await self.gerenciador_token.obter()
+            async with self.limitador:
+                inicio = time.monotonic()
                 try:
-                    response = await client.request(method, url, headers=self.headers, **kwargs)
+                    response = await self.client.request(method, url, headers={**self.headers, 'Authorization': token},
+                                                         extensions={'trace': self.metricas_conexao.trace}, **kwargs)
+                    self.metricas_conexao.registrar_resposta(response)
                     response.raise_for_status()
-                    return response.json() if response.text else None
-                except httpx.HTTPStatusError as e:
-                    logging.error(f"Erro HTTP {e.response.status_code} em {method} {url}: {e.response.text}")
-                    if e.response.status_code == 401: logging.warning("Token pode ter expirado.")
-                    return None
-                except (httpx.RequestError, json.JSONDecodeError, Exception) as e:
-                    logging.error(f"Erro em {method} {url}: {e}")
-                    await asyncio.sleep(2)
-                    return None
-    def _parse_cliente_unico(self, item, details):
-        return {
-            'id_cliente': details.get('codigoBaseAgrupada'), 'nome': details.get('nome'),
-            'documento': f"{item.get('documento', {}).get('tipo')}: {item.get('documento', {}).get('numeroFormatado')}",
-            'titular_cpf': details.get('titularCPF'), 'sexo': details.get('sexo'),
-            'data_nascimento': details.get('dataNascimentoFormatada'), 'estado_civil': details.get('estadoCivilFormatado'),
-            'tipo_documento': (details.get('identidade') or [{}])[0].get('tipoDocumento'),
-            'numero_documento': (details.get('identidade') or [{}])[0].get('documento'),
-            'orgao_expedidor': (details.get('identidade') or [{}])[0].get('orgaoExpedidor'),
-            'renda_patrimonio': details.get('rendaResumidaFormatada'), 'profissao': details.get('profissao'),
-            'telefone': join_array(details.get('telefone'), ';', 'numeroTelefone'),
-            'email': (details.get('emails') or [{}])[0].get('email'),
-            'endereco': (details.get('endereco') or [{}])[0].get('descricaoEndereco'),
-            'numero': (details.get('endereco') or [{}])[0].get('numero'),
-            'complemento': (details.get('endereco') or [{}])[0].get('complemento'),
-            'bairro': (details.get('endereco') or [{}])[0].get('bairro'),
-            'cidade': (details.get('endereco') or [{}])[0].get('municipio'),
-            'uf': (details.get('endereco') or [{}])[0].get('uf'),
-            'cep': (details.get('endereco') or [{}])[0].get('cepFormatado'),
-        }
-    def _parse_produto_prev(self, product, id_cliente):
-        prod = {
-            'id_cliente': id_cliente,
-            'linha_negocio': to_formatted_line_of_business(product.get('linhaNegocio')),
-            'tipo_produto': product.get('nomeProduto'),
-            'numero_proposta': product.get('proposta'),
-            'numero_certificado': product.get('certificado'),
-            'valor_contribuicao': product.get('valorPagamento'),
-            'situacao_produto': to_product_status(product),
-            'numero_processo_susep': product.get('numeroProcessoSusep'),
-            'dia_vencimento': product.get('diaVencimento'),
-            'ultimo_pagamento': to_utc_date(product.get('dataUltimoPagamento')),
-            'proximo_pagamento': to_utc_date(product.get('dataProximoPagamento')),
-            'quantidade_parcelas_pagas': product.get('quantidadeParcelasPagas'),
-            'quantidade_parcelas_pendentes': product.get('quantidadeParcelasPendentes'),
-            'periodicidade_pagamentos': product.get('periodicidadePagamento'),
-            'forma_pagamento': product.get('formaPagamento'),
-        }
-        acumulacao = product.get('prev', {}).get('acumulacao')
-        if acumulacao:
-            prod.update({
-                'nome_fundo': acumulacao.get('fundo'),
-                'cnpj_fundo': acumulacao.get('cnpjFundo'),
-                'regime_tributario': acumulacao.get('regimeTribCertAcumulacao'),
-                'indexador_plano': acumulacao.get('indexadorCertificadoAcumulacao'),
-            })
-        return prod
-    def _parse_produto_vida(self, product, benefit, id_cliente):
-        return {
-            'id_cliente': id_cliente,
-            'linha_negocio': to_formatted_line_of_business(product.get('linhaNegocio')),
-            'tipo_produto': product.get('nomeProduto'),
-            'numero_proposta': product.get('proposta'),
-            'numero_certificado': product.get('certificado'),
-            'situacao_produto': to_product_status(product),
-            'nome_cobertura': benefit.get('nomeBeneficio'),
-            'capital_segurado': benefit.get('capitalBeneficioSegurado'),
-            'periodo_pagamento_cobertura': benefit.get('prazoPagamento'),
-            'dia_vencimento': product.get('diaVencimento'),
-            'ultimo_pagamento': to_utc_date(product.get('dataUltimoPagamento')),
-            'proximo_pagamento': to_utc_date(product.get('dataProximoPagamento')),
-            'quantidade_parcelas_pagas': product.get('quantidadeParcelasPagas'),
-            'quantidade_parcelas_pendentes': product.get('quantidadeParcelasPendentes'),
-            'periodicidade_pagamentos': product.get('periodicidadePagamento'),
-        }
-    async def get_customers(self, original_post_data, update_status_func=None):
+                    dados = decodificar_json(response.content) if response.content else None
+                    if politica_cache and dados is not None: self.cache_http.salvar(endpoint_cache, chave_cache, response.text)
+                    self.limitador.registrar(time.monotonic() - inicio, erro=False)
+                    if tentativa: self.politica_retry.requisicoes_recuperadas += 1
+                    return dados
+                except Exception as e:
+                    erro = e
+
+            categoria = PoliticaRetry.classificar(erro)
+            self.limitador.registrar(time.monotonic() - inicio, erro=categoria in PoliticaRetry.CATEGORIAS_SOBRECARGA)
+            if categoria == 'nao_autorizado' and renovacoes < TOKEN_MAX_RENOVACOES_POR_REQUISICAO:
+                renovacoes += 1
+                if await self.gerenciador_token.renovar(token, f"HTTP 401 em {method} {url}"):
+                    if rastreio is not None: rastreio['retries'] = rastreio.get('retries', 0) + 1
+                    tentativa += 1
+                    continue
+            if not self.politica_retry.pode_repetir(categoria, tentativa, idempotente):
+                if isinstance(erro, httpx.HTTPStatusError):
+                    logging.error(f"Erro HTTP {erro.response.status_code} em {method} {url}: {erro.response.text}")
+                    if erro.response.status_code == 401: logging.warning("Token pode ter expirado.")
+                else:
+                    logging.error(f"Erro em {method} {url}: {erro}")
+                self.politica_retry.perdas_por_categoria[categoria] += 1
+                if levantar_rejeicao and categoria == 'cliente':
+                    raise PostDataRejeitado(f"HTTP {erro.response.status_code} em {url}")
+                return None
+
+            espera = self.politica_retry.tempo_espera(tentativa, erro)
+            tentativa += 1
+            if rastreio is not None: rastreio['retries'] = rastreio.get('retries', 0) + 1
+            logging.warning(f"Falha ({categoria}) em {method} {url}. Tentativa {tentativa + 1}/{self.politica_retry.max_tentativas} em {espera:.1f}s...")
+            await asyncio.sleep(espera)
+    @staticmethod
+    def _total_paginas(response_data, tamanho_pagina):
+        """
+        Lê o total de páginas (ou de registros) informado pela API, se houver.
+        Só o nível superior da resposta é consultado: blocos aninhados costumam
+        trazer totais de outra natureza (valores, somatórios do relatório).
+        """
+        for campo in CAMPOS_TOTAL_PAGINAS:
+            if isinstance(response_data.get(campo), int) and response_data[campo] > 0: return response_data[campo]
+        for campo in CAMPOS_TOTAL_REGISTROS:
+            if isinstance(response_data.get(campo), int) and response_data[campo] >= 0 and tamanho_pagina:
+                return math.ceil(response_data[campo] / tamanho_pagina)
+        return None
+    async def _paginar(self, url, original_post_data, campo_lista, definir_pagina, pagina_inicial=1, pagina_maxima=None,
+                       rotulo='registros', update_status_func=None):
+        """
+        Percorre um endpoint paginado e entrega a lista de itens de cada página,
+        em ordem. Se a primeira resposta trouxer o total de páginas/registros,
+        busca as páginas restantes; só quando a última delas vem cheia (com
+        tantos itens quanto a primeira) confere uma página além do total, que
+        pode estar subestimado. Caso contrário mantém uma janela especulativa de
+        PAGINACAO_JANELA páginas em voo e cancela as que passarem do fim.
+        Páginas já registradas no journal não são buscadas de novo.
+        """
+        corpo_journal = JournalCorretora.hash_corpo(original_post_data) if self.journal else None
+        async def buscar(pagina, levantar_rejeicao=False):
+            """Retorna (itens, total de páginas informado) ou None se a página não pôde ser obtida."""
+            salva = self.journal.obter_pagina(rotulo, pagina, corpo_journal) if self.journal else None
+            if salva is not None: return salva
+            if update_status_func: update_status_func(f"Buscando página de {rotulo} {pagina}...")
+            post_data = json.loads(original_post_data); definir_pagina(post_data, pagina)
+            response_data = await self._make_request('POST', url, json=post_data, idempotente=True, levantar_rejeicao=levantar_rejeicao)
+            if response_data is None: return None
+            itens = response_data.get(campo_lista) or []
+            total = self._total_paginas(response_data, len(itens)) if itens and pagina == pagina_inicial else None
+            if itens and self.journal: self.journal.salvar_pagina(rotulo, pagina, itens, total, corpo_journal)
+            return itens, total
+
+        # Só um corpo vindo de template pode ser recusado e recapturado; com corpo ao vivo o erro apenas encerra a seção
+        primeira = await buscar(pagina_inicial, levantar_rejeicao=POSTDATA_DE_TEMPLATE.get())
+        itens, total_paginas = primeira if primeira else (None, None)
+        if primeira is not None and not itens and POSTDATA_DE_TEMPLATE.get():
+            raise PostDataRejeitado(f"primeira página de {rotulo} veio vazia com o corpo do template")
+        if not itens: return
+        tamanho_pagina = len(itens)
+        yield itens
+
+        ultima_pagina = pagina_maxima
+        if total_paginas is not None:
+            ultima_pagina = pagina_inicial + total_paginas - 1
+            if pagina_maxima is not None: ultima_pagina = min(ultima_pagina, pagina_maxima)
+            logging.info(f"API informou {total_paginas} página(s) de {rotulo}.")
+
+        # Com a última página informada cheia, o total só é aceito depois de confirmar que a seguinte vem vazia
+        ultima_informada = ultima_pagina if total_paginas is not None else None
+        conferir_alem = False
+        pendentes, proxima = deque(), pagina_inicial + 1
+        try:
+            while True:
+                while len(pendentes) < PAGINACAO_JANELA and (ultima_pagina is None or proxima <= ultima_pagina):
+                    pendentes.append((proxima, asyncio.create_task(buscar(proxima))))
+                    proxima += 1
+                if not pendentes and conferir_alem and proxima == ultima_informada + 1 \
+                        and (pagina_maxima is None or proxima <= pagina_maxima):
+                    pendentes.append((proxima, asyncio.create_task(buscar(proxima))))
+                    proxima += 1
+                if not pendentes: break
+                pagina, tarefa = pendentes.popleft()
+                resultado = await tarefa
+                itens = resultado[0] if resultado else None
+                if not itens:
+                    if resultado is None: logging.warning(f"Página {pagina} de {rotulo} não pôde ser obtida. Encerrando a paginação.")
+                    break
+                if ultima_informada is not None and pagina > ultima_informada:
+                    logging.warning(f"A página {pagina} de {rotulo} trouxe registros além do total informado pela API "
+                                    f"({total_paginas} página(s)). Seguindo sem o total.")
+                    ultima_pagina, ultima_informada = pagina_maxima, None
+                elif pagina == ultima_informada:
+                    conferir_alem = len(itens) >= tamanho_pagina
+                yield itens
+        finally:
+            for _, tarefa in pendentes: tarefa.cancel()
+    async def get_customers(self, original_post_data, update_status_func=None, destino=None):
+        """
+        Pipeline produtor/consumidor: as páginas da listagem alimentam uma fila
+        limitada, os consumidores buscam detalhes e produtos de cada cliente e
+        as linhas já processadas seguem direto para o `destino`. As respostas
+        brutas são descartadas assim que o cliente é processado.
+
+        Com um `snapshot` incremental, clientes inalterados desde a última
+        extração são montados a partir dele, sem chamadas de detalhe.
+        """
         logging.info("Iniciando download de Clientes...")
-        customers_list, page_count = [], 1
-        while True:
-            if update_status_func: update_status_func(f"Buscando página de clientes {page_count}...")
-            post_data = json.loads(original_post_data); post_data['Pagina'] = page_count
-            response_data = await self._make_request('POST', f"{self.base_url}/RelacionamentoCliente/Tombamento/clientes", json=post_data)
-            if not response_data or not response_data.get('clientes'): break
-            customers_list.extend(response_data['clientes'])
-            page_count += 1
-        logging.info(f"Total de {len(customers_list)} clientes encontrados...")
-        async def get_customer_details(customer):
-            details_url = f"{self.base_url}/RelacionamentoCliente/Tombamento/clientes/{customer['codigoBaseAgrupada']}"
-            products_url = f"{self.base_url}/RelacionamentoCliente/Tombamento/clientes/{customer['codigoBaseAgrupada']}/produtos?documento={customer['cpfCnpj']}"
-            details_data, products_data = await asyncio.gather(self._make_request('GET', details_url), self._make_request('GET', products_url))
-            return customer, details_data, products_data
-        results = await asyncio.gather(*[get_customer_details(c) for c in customers_list])
-        clientes_unicos, produtos_prev, produtos_vida = {}, [], []
-        for i, (item, details_res, products_res) in enumerate(results):
-            if update_status_func: update_status_func(f"Processando cliente {i+1}/{len(results)}...")
-            if not details_res or not products_res: continue
-            details = details_res.get('detalhesCliente', {}).get('clientes', [{}])[0]
-            id_cliente = details.get('codigoBaseAgrupada')
-            if not id_cliente: continue
-            if id_cliente not in clientes_unicos: clientes_unicos[id_cliente] = self._parse_cliente_unico(item, details)
-            products = products_res.get('produtosCliente', {}).get('listarProdutos', [])
-            for product in products:
-                if product.get('linhaNegocio') == 'PREV': produtos_prev.append(self._parse_produto_prev(product, id_cliente))
-                elif product.get('linhaNegocio') == 'VIDA':
-                    for benefit in product.get('vida', {}).get('beneficios', []): produtos_vida.append(self._parse_produto_vida(product, benefit, id_cliente))
-        return [{'name': 'Clientes', 'data': list(clientes_unicos.values())}, {'name': 'Produtos Previdencia', 'data': produtos_prev}, {'name': 'Produtos Vida', 'data': produtos_vida}]
-    def _parse_pending_data(self, item):
-        return {
-            'linha_negocio': item.get("linhaNegocio"), 'produto': item.get("nomeProdutoComercial"), 'numero_proposta': item.get("numeroProposta"),
-            'numero_certificado': item.get("numeroCertificado"), 'nome_cliente': item.get("nomeCliente"), 'cpf_cliente': item.get("cpfCnpjCliente"),
-            'status_pagamento': item.get("statusPagamento"), 'vencimento_original': item.get("diaVencimentoOriginal"), 'vencimento_atual': item.get("diaVencimentoAtual"),
-            'competencia': item.get("competencia"), 'forma_pagamento': item.get("formaCobranca"), 'contribuicao': item.get("valorParcela"),
-            'dias_em_atraso': item.get("diasDeAtraso"), 'email_cliente': item.get("email"), 'telefone1': item.get("telefone1"), 'telefone2': item.get("telefone2"),
-        }
-    async def get_pending_payments(self, original_post_data, update_status_func=None):
+        destino = destino if destino is not None else ColetorSecoes()
+        for nome in SECOES_CLIENTES: destino.declarar(nome)
+        fila = asyncio.Queue(maxsize=CLIENTES_FILA_MAX)
+        ids_emitidos = set()
+        contagem = {'listados': 0, 'processados': 0}
+
+        async def produtor():
+            paginas = self._paginar(f"{self.base_url}/RelacionamentoCliente/Tombamento/clientes", original_post_data, 'clientes',
+                                    lambda post_data, pagina: post_data.update({'Pagina': pagina}),
+                                    rotulo='clientes', update_status_func=update_status_func)
+            async for clientes in paginas:
+                for customer in clientes:
+                    contagem['listados'] += 1
+                    await fila.put(customer)
+            for _ in range(CLIENTES_CONSUMIDORES): await fila.put(None)
+
+        async def consumidor():
+            while True:
+                customer = await fila.get()
+                if customer is None: return
+                chave = f"{customer['codigoBaseAgrupada']}|{customer['cpfCnpj']}"
+                salvo = self.journal.obter_item('Clientes', chave) if self.journal else None
+                if salvo is not None:
+                    contagem['processados'] += 1
+                    if self.snapshot: self.snapshot.salvar(chave, customer, salvo['detalhes'], salvo['produtos'])
+                    self._emitir_cliente(customer, salvo['detalhes'], salvo['produtos'], ids_emitidos, destino)
+                    continue
+                anterior = self.snapshot.obter(chave, customer) if self.snapshot else None
+                if anterior is not None:
+                    contagem['processados'] += 1
+                    self._emitir_cliente(customer, anterior[0], anterior[1], ids_emitidos, destino)
+                    continue
+                details_url = f"{self.base_url}/RelacionamentoCliente/Tombamento/clientes/{customer['codigoBaseAgrupada']}"
+                products_url = f"{self.base_url}/RelacionamentoCliente/Tombamento/clientes/{customer['codigoBaseAgrupada']}/produtos?documento={customer['cpfCnpj']}"
+                rastreio = {'retries': 0}
+                details_res, products_res = await asyncio.gather(self._make_request('GET', details_url, rastreio=rastreio), self._make_request('GET', products_url, rastreio=rastreio))
+                contagem['processados'] += 1
+                if update_status_func: update_status_func(f"Processando cliente {contagem['processados']}/{contagem['listados']}...")
+                if not details_res or not products_res:
+                    self.politica_retry.registrar_registro('Clientes', perdido=True)
+                    continue
+                self.politica_retry.registrar_registro('Clientes', recuperado=rastreio['retries'] > 0)
+                if self.journal: self.journal.salvar_item('Clientes', chave, {'detalhes': details_res, 'produtos': products_res})
+                if self.snapshot: self.snapshot.salvar(chave, customer, details_res, products_res)
+                self._emitir_cliente(customer, details_res, products_res, ids_emitidos, destino)
+
+        tarefas = [asyncio.create_task(produtor())] + [asyncio.create_task(consumidor()) for _ in range(CLIENTES_CONSUMIDORES)]
+        try:
+            await asyncio.gather(*tarefas)
+        except BaseException:
+            for tarefa in tarefas: tarefa.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+            raise
+        logging.info(f"Total de {contagem['listados']} clientes encontrados, {contagem['processados']} processados.")
+        if self.snapshot: self.snapshot.concluir()
+        return destino.abas(SECOES_CLIENTES)
+    def _emitir_cliente(self, item, details_res, products_res, ids_emitidos, destino):
+        details = details_res.get('detalhesCliente', {}).get('clientes', [{}])[0]
+        id_cliente = details.get('codigoBaseAgrupada')
+        if not id_cliente: return
+        if id_cliente not in ids_emitidos:
+            ids_emitidos.add(id_cliente)
+            destino.adicionar('Clientes', linha_cliente(item, details))
+        products = products_res.get('produtosCliente', {}).get('listarProdutos', [])
+        for product in products:
+            if product.get('linhaNegocio') == 'PREV': destino.adicionar('Produtos Previdencia', linha_produto_previdencia(product, id_cliente))
+            elif product.get('linhaNegocio') == 'VIDA':
+                for benefit in product.get('vida', {}).get('beneficios', []): destino.adicionar('Produtos Vida', linha_produto_vida(product, benefit, id_cliente))
+    async def get_pending_payments(self, original_post_data, update_status_func=None, destino=None):
         logging.info("Iniciando download de pagamentos pendentes...")
-        final_data_list, page_count = [], 0
-        while page_count < 1000:
-            post_data = json.loads(original_post_data); post_data.update({'paginaAtual': page_count, 'tamanhoPagina': 100})
-            if update_status_func: update_status_func(f"Buscando página de pendentes {page_count}...")
-            response_data = await self._make_request('POST', f"{self.base_url}/Relatorio/pendentes/tabela/v2", json=post_data)
-            client_list = response_data.get('pendentes', []) if response_data else []
-            if not client_list: break
-            final_data_list.extend([self._parse_pending_data(item) for item in client_list])
-            page_count += 1
-        logging.info(f"Total de {len(final_data_list)} registros pendentes encontrados.")
-        return [{'name': 'Pagamentos Pendentes', 'data': final_data_list}]
-    def _parse_proposal_status(self, item, installment):
-        return {
-            'nome': item.get('nomeProponente'), 'cpf': item.get('cpfProponente'), 'produto': item.get('nomeProduto'), 'linha_negocio': item.get('linhaNegocio'),
-            'proposta': item.get('numeroProposta'), 'criada_em': item.get('dataProtocolo'), 'status_proposta': item.get('statusFase'), 'data': item.get('dataStatus'),
-            'forma_pagamento': item.get('formaPagamento'), 'valor': installment.get('valor'), 'vencimento': installment.get('agendamentoDebito'),
-            'competencia': installment.get('competencia'), 'status_pagamento': item.get('statusPagamento'), 'motivo_pendencia': item.get('motivoPendencia'),
-        }
-    async def get_proposal_status(self, original_post_data, update_status_func=None):
+        destino = destino if destino is not None else ColetorSecoes()
+        destino.declarar('Pagamentos Pendentes')
+        total_registros = 0
+        paginas = self._paginar(f"{self.base_url}/Relatorio/pendentes/tabela/v2", original_post_data, 'pendentes',
+                                lambda post_data, pagina: post_data.update({'paginaAtual': pagina, 'tamanhoPagina': 100}),
+                                pagina_inicial=0, pagina_maxima=999, rotulo='pendentes', update_status_func=update_status_func)
+        async for client_list in paginas:
+            for item in client_list: destino.adicionar('Pagamentos Pendentes', linha_pendente(item))
+            total_registros += len(client_list)
+        logging.info(f"Total de {total_registros} registros pendentes encontrados.")
+        return destino.abas(['Pagamentos Pendentes'])
+    async def get_proposal_status(self, original_post_data, update_status_func=None, destino=None):
         logging.info("Iniciando download de Status de Propostas...")
-        proposal_list, page_count = [], 1
-        while True:
-            if update_status_func: update_status_func(f"Buscando página de propostas {page_count}...")
-            post_data = json.loads(original_post_data); post_data['Pagina'] = page_count
-            response_data = await self._make_request('POST', f"{self.base_url}/relatorio/consulta/status/v2", json=post_data)
-            if not response_data or not response_data.get('listaPropostas'): break
-            proposal_list.extend(response_data['listaPropostas'])
-            page_count += 1
+        destino = destino if destino is not None else ColetorSecoes()
+        destino.declarar('Status Propostas')
+        proposal_list = []
+        paginas = self._paginar(f"{self.base_url}/relatorio/consulta/status/v2", original_post_data, 'listaPropostas',
+                                lambda post_data, pagina: post_data.update({'Pagina': pagina}),
+                                rotulo='propostas', update_status_func=update_status_func)
+        async for propostas in paginas: proposal_list.extend(propostas)
         logging.info(f"Total de {len(proposal_list)} propostas encontradas...")
         async def get_proposal_details(proposal):
+            chave = f"{proposal['cpfProponente']}|{proposal['numeroProposta']}"
+            salvo = self.journal.obter_item('Status Propostas', chave) if self.journal else None
+            if salvo is not None: return proposal, salvo
             url = f"{self.base_url}/Clientes/{proposal['cpfProponente']}/primeira-parcela/{proposal['numeroProposta']}/0"
-            return proposal, await self._make_request('GET', url)
+            rastreio = {'retries': 0}
+            details = await self._make_request('GET', url, rastreio=rastreio)
+            if details is not None and self.journal: self.journal.salvar_item('Status Propostas', chave, details)
+            self.politica_retry.registrar_registro('Status Propostas', recuperado=bool(details) and rastreio['retries'] > 0, perdido=details is None)
+            return proposal, details
         results = await asyncio.gather(*[get_proposal_details(p) for p in proposal_list])
-        final_data = [self._parse_proposal_status(item, details['resultado']) for item, details in results if details and details.get('resultado')]
-        return [{'name': 'Status Propostas', 'data': final_data}]
-
-def export_to_excel(filename, all_sheets_data):
-    wb = Workbook()
-    if 'Sheet' in wb.sheetnames: wb.remove(wb['Sheet'])
-    for sheet_info in all_sheets_data:
-        if not sheet_info['data']:
-            logging.warning(f"Aviso: A aba '{sheet_info['name']}' está vazia, pulando...")
+        for item, details in results:
+            if details and details.get('resultado'): destino.adicionar('Status Propostas', linha_status_proposta(item, details['resultado']))
+        return destino.abas(['Status Propostas'])
+
+def export_to_excel(filename, caminho_ndjson, manifesto):
+    """
+    Gera o .xlsx a partir do backup NDJSON em modo write-only: as linhas vão
+    do arquivo direto para as abas, sem montar DataFrame nem manter a planilha
+    em memória. Os cabeçalhos vêm das colunas registradas no manifesto.
+    """
+    secoes = {}
+    for nome, info in manifesto['secoes'].items():
+        if not info['registros']:
+            logging.warning(f"Aviso: A aba '{nome}' está vazia, pulando...")
             continue
-        try:
-            ws = wb.create_sheet(title=sheet_info['name'])
-            df = pd.DataFrame(sheet_info['data'])
-            for r in dataframe_to_rows(df, index=False, header=True): ws.append(r)
-            logging.info(f"Aba '{sheet_info['name']}' criada com sucesso.")
-        except Exception as e: logging.error(f"Erro ao criar aba '{sheet_info['name']}': {e}")
-    if not wb.sheetnames:
+        secoes[nome] = info['colunas']
+    if not secoes:
         logging.warning("Aviso: Nenhum dado foi retornado. O arquivo Excel não será gerado.")
         return
     try:
+        wb = Workbook(write_only=True)
+        abas = {}
+        for nome, colunas in secoes.items():
+            ws = wb.create_sheet(title=nome)
+            ws.append(colunas)
+            abas[nome] = (ws, colunas)
+        with open(caminho_ndjson, 'rb') as f:
+            for linha in f:
+                registro = decodificar_json(linha)
+                aba = abas.get(registro['secao'])
+                if aba is None: continue
+                ws, colunas = aba
+                dados = registro['dados']
+                ws.append([dados.get(coluna) for coluna in colunas])
         wb.save(filename)
-        logging.info(f"Arquivo Excel salvo: {filename}")
+        logging.info(f"Arquivo Excel salvo: {filename} (abas: {', '.join(secoes)})")
     except Exception as e: logging.error(f"Erro ao salvar arquivo Excel: {e}")
 
+def _valor_parquet(valor, tipo):
+    """Converte um valor do registro para o tipo da coluna; levanta ValueError se não for possível."""
+    if valor is None or valor == '': return None
+    if tipo == 'string': return str(valor)
+    try:
+        if tipo == 'int64': return int(float(valor))
+        if tipo == 'float64':
+            if isinstance(valor, str) and ',' in valor: valor = valor.replace('.', '').replace(',', '.')
+            return float(valor)
+        if tipo == 'date32': return datetime.strptime(str(valor)[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        pass
+    raise ValueError(valor)
+
+def export_to_parquet(caminho_ndjson, manifesto, corretora_nome):
+    """
+    Gera um arquivo Parquet por seção a partir do backup NDJSON, com o esquema
+    explícito de SCHEMAS_PARQUET, em lotes de PARQUET_LOTE linhas. Cada seção
+    forma um dataset particionado por corretora (estilo hive), que substitui
+    a partição da extração anterior dessa corretora. A partição de uma seção
+    pulada é removida, para que a anterior não passe por atual.
+    """
+    particao = f"corretora={corretora_nome.replace(' ', '_').replace('/', '-')}"
+    escritores, invalidos = {}, Counter()
+    try:
+        for nome in manifesto.get('secoes_puladas', []):
+            if nome not in SCHEMAS_PARQUET: continue
+            caminho = os.path.join(PASTA_PARQUET, SCHEMAS_PARQUET[nome][0], particao, 'part-0.parquet')
+            if os.path.exists(caminho):
+                os.remove(caminho)
+                logging.warning(f"Parquet: {nome} não foi extraída; partição anterior removida ({caminho}).")
+        for nome, info in manifesto['secoes'].items():
+            # Seções vazias também geram o arquivo (só com o esquema), substituindo a partição anterior
+            if nome not in SCHEMAS_PARQUET: continue
+            dataset, colunas = SCHEMAS_PARQUET[nome]
+            pasta = os.path.join(PASTA_PARQUET, dataset, particao)
+            os.makedirs(pasta, exist_ok=True)
+            caminho = os.path.join(pasta, 'part-0.parquet')
+            schema = pa.schema([(coluna, getattr(pa, tipo)()) for coluna, tipo in colunas.items()])
+            escritores[nome] = {'caminho': caminho, 'writer': pq.ParquetWriter(f"{caminho}.parcial", schema), 'schema': schema,
+                                'colunas': colunas, 'lote': {coluna: [] for coluna in colunas}, 'linhas': 0}
+
+        def gravar_lote(escritor):
+            if not escritor['linhas']: return
+            escritor['writer'].write_table(pa.Table.from_pydict(escritor['lote'], schema=escritor['schema']))
+            escritor['lote'] = {coluna: [] for coluna in escritor['colunas']}
+            escritor['linhas'] = 0
+
+        with open(caminho_ndjson, 'rb') as f:
+            for linha in f:
+                registro = decodificar_json(linha)
+                escritor = escritores.get(registro['secao'])
+                if escritor is None: continue
+                dados = registro['dados']
+                for coluna, tipo in escritor['colunas'].items():
+                    try:
+                        valor = _valor_parquet(dados.get(coluna), tipo)
+                    except ValueError:
+                        invalidos[(registro['secao'], coluna)] += 1
+                        valor = None
+                    escritor['lote'][coluna].append(valor)
+                escritor['linhas'] += 1
+                if escritor['linhas'] >= PARQUET_LOTE: gravar_lote(escritor)
+
+        for nome, escritor in escritores.items():
+            gravar_lote(escritor)
+            escritor['writer'].close()
+            os.replace(f"{escritor['caminho']}.parcial", escritor['caminho'])
+        logging.info(f"Parquet salvo para {len(escritores)} seção(ões) em '{PASTA_PARQUET}' ({particao}).")
+        for (secao, coluna), quantidade in invalidos.items():
+            logging.warning(f"Parquet: {quantidade} valor(es) de '{coluna}' em {secao} não correspondem ao tipo do esquema e foram gravados como nulos.")
+    except Exception as e:
+        logging.error(f"Erro ao salvar arquivos Parquet: {e}")
+        for escritor in escritores.values():
+            if escritor['writer'].is_open: escritor['writer'].close()
+            if os.path.exists(f"{escritor['caminho']}.parcial"): os.remove(f"{escritor['caminho']}.parcial")
+
+def exportar_excel_do_backup(caminho_ndjson):
+    """Gera sob demanda o .xlsx de um backup NDJSON já salvo."""
+    with open(caminho_manifesto_ndjson(caminho_ndjson), 'r', encoding='utf-8') as f:
+        manifesto = json.load(f)
+    caminho_excel = re.sub(r'_backup\.ndjson$', '', caminho_ndjson) + '.xlsx'
+    export_to_excel(caminho_excel, caminho_ndjson, manifesto)
+    return caminho_excel
+
+ESPERA_CORRETORA = contextvars.ContextVar('espera_corretora', default=None)
+
+class ContabilidadeEspera:
+    """Tempo que uma corretora passou esperando a interface do portal, por motivo."""
+    def __init__(self):
+        self.por_motivo = Counter()
+    def total(self):
+        return sum(self.por_motivo.values())
+    def resumo(self):
+        return ", ".join(f"{motivo}: {segundos:.2f}s" for motivo, segundos in self.por_motivo.most_common()) or "nenhuma"
+
+@contextmanager
+def medindo_espera(motivo):
+    """Contabiliza o bloco como espera da corretora em andamento (ESPERA_CORRETORA), se houver uma."""
+    inicio = time.monotonic()
+    try:
+        yield
+    finally:
+        contabilidade = ESPERA_CORRETORA.get()
+        if contabilidade is not None: contabilidade.por_motivo[motivo] += time.monotonic() - inicio
+
 async def capture_post_data(page, target_url_part):
-    request_log = []
-    def handle_request(request):
-        if target_url_part in request.url and request.method == 'POST' and request.post_data:
-            if request.post_data not in request_log:
-                request_log.append(request.post_data)
+    """
+    Aciona a busca da página e devolve o postData da primeira requisição POST
+    para `target_url_part`, aguardando essa requisição em vez de um tempo fixo.
+    """
+    def corresponde(request):
+        return target_url_part in request.url and request.method == 'POST' and bool(request.post_data)
 
-    page.on('request', handle_request)
-    
     logging.info("Tentando acionar a busca de dados para capturar a comunicação...")
+    post_data = None
     try:
-        await page.click('button:has-text("Buscar")', timeout=6000)
-        await page.wait_for_load_state("networkidle", timeout=40000)
+        with medindo_espera('postData'):
+            async with page.expect_request(corresponde, timeout=40000) as requisicao:
+                await page.click('button:has-text("Buscar")', timeout=6000)
+            post_data = (await requisicao.value).post_data
     except Exception:
-        logging.warning("Botão 'Buscar' não encontrado, tentando recarregar a página como alternativa...")
+        logging.warning("Botão 'Buscar' não encontrado ou busca sem requisição, tentando recarregar a página como alternativa...")
         try:
-            await page.reload(wait_until="networkidle")
+            with medindo_espera('postData'):
+                async with page.expect_request(corresponde, timeout=40000) as requisicao:
+                    await page.reload(wait_until="domcontentloaded")
+                post_data = (await requisicao.value).post_data
         except Exception as e:
             logging.error(f"Falha ao recarregar a página: {e}")
-    
-    await asyncio.sleep(3) 
-            
-    page.remove_listener('request', handle_request)
 
-    if request_log:
+    if post_data:
         logging.info("postData capturado com sucesso!")
-        return request_log[0]
+        return post_data
     
     logging.warning(f"Não foi possível capturar o postData para {target_url_part}")
     return None
 
+class CacheTemplatesPostData:
+    """
+    Guarda em disco o postData capturado de cada seção como template, para que
+    as próximas corretoras (e execuções) chamem a API sem abrir as páginas.
+
+    Valores iguais aos dados da corretora na planilha (nome, cnpj, ...) viram
+    marcadores {{campo}} e datas viram deslocamentos em dias relativos à data
+    da captura; ambos são preenchidos novamente ao gerar o corpo de outra
+    corretora. Corpos com campos de identificação da corretora que não puderam
+    ser parametrizados (CAMPOS_IDENTIFICACAO_CORRETORA) não viram template.
+    """
+    FORMATOS_DATA = ((re.compile(r'^\d{4}-\d{2}-\d{2}'), '%Y-%m-%d'), (re.compile(r'^\d{2}/\d{2}/\d{4}'), '%d/%m/%Y'))
+
+    def __init__(self, caminho=ARQUIVO_TEMPLATES_POSTDATA):
+        self.caminho = caminho
+        self.templates = {}
+        if os.path.exists(caminho):
+            try:
+                with open(caminho, 'r', encoding='utf-8') as f:
+                    self.templates = json.load(f)
+                logging.info(f"{len(self.templates)} template(s) de postData carregados de '{caminho}'.")
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Não foi possível ler os templates de postData em '{caminho}': {e}")
+
+    @staticmethod
+    def _valores_corretora(corretora_info):
+        valores = {}
+        for campo, valor in corretora_info.items():
+            if valor is None or valor != valor: continue  # ignora NaN vindos do pandas
+            texto = str(valor).strip()
+            if len(texto) >= 3: valores[str(campo)] = texto
+        if 'cnpj' in valores:
+            valores['cnpj_digitos'] = re.sub(r'\D', '', valores['cnpj'])
+        return valores
+
+    def _parametrizar(self, valor, valores, hoje):
+        if isinstance(valor, dict):
+            return {chave: self._parametrizar(v, valores, hoje) for chave, v in valor.items()}
+        if isinstance(valor, list):
+            return [self._parametrizar(v, valores, hoje) for v in valor]
+        if isinstance(valor, bool) or valor is None:
+            return valor
+        texto = str(valor)
+        for campo, valor_corretora in valores.items():
+            if texto == valor_corretora:
+                return f"{{{{{campo}:{'int' if isinstance(valor, int) else 'str'}}}}}"
+        if isinstance(valor, str):
+            for padrao, formato in self.FORMATOS_DATA:
+                encontrado = padrao.match(valor)
+                if not encontrado: continue
+                try:
+                    data = datetime.strptime(encontrado.group(0), formato).date()
+                except ValueError:
+                    continue
+                return f"{{{{data:{(data - hoje).days}:{formato}:{valor[encontrado.end():]}}}}}"
+        return valor
+
+    def _preencher(self, valor, valores, hoje):
+        if isinstance(valor, dict):
+            return {chave: self._preencher(v, valores, hoje) for chave, v in valor.items()}
+        if isinstance(valor, list):
+            return [self._preencher(v, valores, hoje) for v in valor]
+        if not (isinstance(valor, str) and valor.startswith('{{') and valor.endswith('}}')):
+            return valor
+        marcador = valor[2:-2]
+        if marcador.startswith('data:'):
+            _, deslocamento, formato, resto = marcador.split(':', 3)
+            return (hoje + timedelta(days=int(deslocamento))).strftime(formato) + resto
+        campo, tipo = marcador.rsplit(':', 1)
+        if campo not in valores:
+            raise KeyError(campo)
+        return int(float(valores[campo])) if tipo == 'int' else valores[campo]
+
+    def obter(self, secao, corretora_info):
+        template = self.templates.get(secao)
+        if not template:
+            return None
+        try:
+            corpo = self._preencher(template['corpo'], self._valores_corretora(corretora_info), datetime.now().date())
+        except (KeyError, ValueError) as e:
+            logging.warning(f"Template de postData de {secao} não pôde ser preenchido para esta corretora (campo {e}).")
+            return None
+        return json.dumps(corpo, ensure_ascii=False)
+
+    def salvar(self, secao, post_data, corretora_info):
+        try:
+            corpo = json.loads(post_data)
+        except json.JSONDecodeError:
+            logging.warning(f"postData de {secao} não é JSON; template não será salvo.")
+            return
+        hoje = datetime.now().date()
+        parametrizado = self._parametrizar(corpo, self._valores_corretora(corretora_info), hoje)
+        literais = self._campos_literais(parametrizado)
+        if literais:
+            logging.info(f"Template de {secao}: campos mantidos literais: {', '.join(f'{c}={v!r}' for c, v in literais)}")
+        identificadores = [c for c, v in literais if v not in ('', 0) and CAMPOS_IDENTIFICACAO_CORRETORA.search(c.rsplit('.', 1)[-1])]
+        if identificadores:
+            logging.warning(f"postData de {secao} tem campos da corretora que não batem com a planilha "
+                            f"({', '.join(identificadores)}); template não será salvo.")
+            self.invalidar(secao)
+            return
+        self.templates[secao] = {'corpo': parametrizado, 'capturado_em': hoje.isoformat()}
+        self._gravar()
+
+    @classmethod
+    def _campos_literais(cls, valor, caminho=''):
+        """Lista (caminho, valor) das folhas do corpo que não viraram marcador."""
+        if isinstance(valor, dict):
+            return [c for chave, v in valor.items() for c in cls._campos_literais(v, f"{caminho}.{chave}" if caminho else str(chave))]
+        if isinstance(valor, list):
+            return [c for i, v in enumerate(valor) for c in cls._campos_literais(v, f"{caminho}[{i}]")]
+        if valor is None or (isinstance(valor, str) and valor.startswith('{{') and valor.endswith('}}')):
+            return []
+        return [(caminho, valor)]
+
+    def invalidar(self, secao):
+        if self.templates.pop(secao, None) is not None:
+            logging.warning(f"Template de postData de {secao} invalidado.")
+            self._gravar()
+
+    def _gravar(self):
+        caminho_tmp = f"{self.caminho}.tmp"
+        with open(caminho_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.templates, f, ensure_ascii=False, indent=2)
+        os.replace(caminho_tmp, self.caminho)
+
+class ContextualizadorAPI:
+    """
+    Obtém o token de cada corretora chamando diretamente o endpoint
+    /api/usuarios/corretoras/{id}/contextualizar, sem cliques na interface.
+
+    O modelo da requisição (método, cabeçalhos de autenticação e corpo) é
+    aprendido na primeira contextualização feita pelo navegador na execução.
+    O id de cada corretora vem da coluna 'id_corretora' da planilha ou do que
+    já foi observado pela interface em execuções anteriores, salvo em
+    ARQUIVO_IDS_CORRETORAS. O token só é usado se o CNPJ/nome presentes na
+    resposta (ou no próprio token) não apontarem para outra corretora.
+    """
+    PADRAO_URL = re.compile(r'/api/usuarios/corretoras/([^/?]+)/contextualizar')
+    CABECALHOS_IGNORADOS = {'host', 'content-length', 'accept-encoding', 'connection'}
+    COLUNAS_ID = ('id_corretora',)
+
+    def __init__(self, caminho_ids=ARQUIVO_IDS_CORRETORAS):
+        self.caminho_ids = caminho_ids
+        self.modelo = None
+        self.ids = {}
+        if os.path.exists(caminho_ids):
+            try:
+                with open(caminho_ids, 'r', encoding='utf-8') as f:
+                    self.ids = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Não foi possível ler os ids de corretoras em '{caminho_ids}': {e}")
+
+    def disponivel(self):
+        return MODO_CONTEXTUALIZACAO == 'api' and self.modelo is not None
+
+    def id_corretora(self, corretora_info):
+        for coluna in self.COLUNAS_ID:
+            valor = corretora_info.get(coluna)
+            if valor is not None and valor == valor and str(valor).strip():
+                return str(int(valor)) if isinstance(valor, float) else str(valor).strip()
+        return self.ids.get(corretora_info["nome"])
+
+    async def registrar_requisicao(self, request, corretora_nome=None):
+        """Aprende o modelo (e o id da corretora) a partir de uma contextualização feita pelo navegador."""
+        encontrado = self.PADRAO_URL.search(request.url)
+        if not encontrado:
+            return
+        id_corretora = encontrado.group(1)
+        try:
+            cabecalhos = await request.all_headers()
+        except Exception as e:
+            logging.warning(f"Não foi possível ler os cabeçalhos da contextualização: {e}")
+            return
+        corpo = request.post_data
+        self.modelo = {
+            'method': request.method,
+            'url': request.url[:encontrado.start(1)] + '{id}' + request.url[encontrado.end(1):],
+            'headers': {k: v for k, v in cabecalhos.items() if not k.startswith(':') and k.lower() not in self.CABECALHOS_IGNORADOS},
+            'corpo': corpo.replace(id_corretora, '{id}') if corpo else None,
+        }
+        if corretora_nome and self.ids.get(corretora_nome) != id_corretora:
+            self.ids[corretora_nome] = id_corretora
+            self._gravar_ids()
+
+    def _gravar_ids(self):
+        caminho_tmp = f"{self.caminho_ids}.tmp"
+        with open(caminho_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.ids, f, ensure_ascii=False, indent=2)
+        os.replace(caminho_tmp, self.caminho_ids)
+
+    @staticmethod
+    def _valores_identificacao(resultado, token):
+        """Valores escalares da resposta da contextualização e das claims do token."""
+        valores = []
+        def coletar(valor):
+            if isinstance(valor, dict):
+                for v in valor.values(): coletar(v)
+            elif isinstance(valor, list):
+                for v in valor: coletar(v)
+            elif isinstance(valor, (str, int)) and not isinstance(valor, bool):
+                valores.append(str(valor))
+        coletar({k: v for k, v in resultado.items() if k != 'token'})
+        coletar(payload_jwt(token) or {})
+        return valores
+
+    def conferir_corretora(self, resultado, token, corretora_info):
+        """
+        True se a resposta identifica a corretora esperada, False se identifica
+        outra (CNPJ diferente) e None se não traz como conferir.
+        """
+        cnpj = re.sub(r'\D', '', str(corretora_info.get('cnpj') or ''))
+        nome = str(corretora_info.get('nome') or '').strip().upper()
+        outro_cnpj = False
+        for valor in self._valores_identificacao(resultado, token):
+            digitos = re.sub(r'\D', '', valor)
+            if cnpj and digitos == cnpj: return True
+            if nome and valor.strip().upper() == nome: return True
+            if len(digitos) == 14 and re.fullmatch(r'[\d./-]+', valor.strip()): outro_cnpj = True
+        return False if outro_cnpj else None
+
+    async def obter_token(self, cliente_http, id_corretora, corretora_info):
+        corretora_nome = corretora_info["nome"]
+        modelo = self.modelo
+        if not modelo:
+            return None
+        url = modelo['url'].replace('{id}', str(id_corretora))
+        corpo = modelo['corpo'].replace('{id}', str(id_corretora)) if modelo['corpo'] else None
+        politica = PoliticaRetry(max_tentativas=3)
+        tentativa = 0
+        while True:
+            inicio = time.monotonic()
+            try:
+                response = await cliente_http.request(modelo['method'], url, headers=modelo['headers'], content=corpo)
+                response.raise_for_status()
+                resultado = response.json().get("resultado") or {}
+                token = resultado.get("token")
+                if not token:
+                    logging.warning(f"Contextualização direta de {corretora_nome} não retornou token.")
+                    return None
+                conferida = self.conferir_corretora(resultado, token, corretora_info)
+                if conferida is False:
+                    logging.error(f"Contextualização direta com o id {id_corretora} retornou outra corretora, não {corretora_nome}. "
+                                  f"Token descartado; o id será reaprendido pela interface.")
+                    if self.ids.pop(corretora_nome, None) is not None: self._gravar_ids()
+                    return None
+                if conferida is None:
+                    logging.debug(f"Resposta da contextualização de {corretora_nome} não traz CNPJ/nome para conferência.")
+                logging.info(f"TOKEN OBTIDO VIA API PARA {corretora_nome} em {time.monotonic() - inicio:.2f}s: ...{token[-10:]}")
+                return f"Bearer {token}"
+            except Exception as erro:
+                categoria = PoliticaRetry.classificar(erro)
+                if categoria == 'nao_autorizado' or (isinstance(erro, httpx.HTTPStatusError) and erro.response.status_code == 403):
+                    logging.warning("Autenticação da contextualização direta expirou. Voltando à seleção pela interface.")
+                    self.modelo = None
+                    return None
+                if not politica.pode_repetir(categoria, tentativa, idempotente=True):
+                    logging.error(f"Falha na contextualização direta de {corretora_nome} ({categoria}): {erro}")
+                    return None
+                await asyncio.sleep(politica.tempo_espera(tentativa, erro))
+                tentativa += 1
+
+class JournalExtracao:
+    """
+    Checkpoints duráveis (SQLite) da extração de cada corretora: páginas de
+    listagem já baixadas e respostas de detalhe já obtidas (clientes e
+    primeira parcela das propostas). Se o processo morrer no meio de uma
+    corretora, a próxima execução reaproveita esse trabalho e só busca o que
+    falta. O journal de uma corretora é apagado quando seus arquivos são
+    salvos, e descartado se for mais antigo que JOURNAL_VALIDADE_HORAS.
+    """
+    def __init__(self, caminho=ARQUIVO_JOURNAL):
+        self.caminho = caminho
+        self.conexao = sqlite3.connect(caminho)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        colunas_paginas = [linha[1] for linha in self.conexao.execute("PRAGMA table_info(paginas)")]
+        if colunas_paginas and 'corpo' not in colunas_paginas:
+            # Journal de uma versão sem o hash do corpo: as páginas salvas não podem ser atribuídas a um corpo
+            self.conexao.execute("DROP TABLE paginas")
+        self.conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS corretoras (corretora TEXT PRIMARY KEY, iniciada_em REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS paginas (corretora TEXT, secao TEXT, corpo TEXT, pagina INTEGER, itens TEXT NOT NULL,
+                                                total_paginas INTEGER, PRIMARY KEY (corretora, secao, corpo, pagina));
+            CREATE TABLE IF NOT EXISTS itens (corretora TEXT, secao TEXT, chave TEXT, resposta TEXT NOT NULL,
+                                              PRIMARY KEY (corretora, secao, chave));
+        """)
+        self.conexao.commit()
+
+    def corretora(self, nome):
+        """Abre (ou retoma) o journal de uma corretora e remove os .parcial órfãos dela."""
+        remover_parciais_orfaos(nome)
+        linha = self.conexao.execute("SELECT iniciada_em FROM corretoras WHERE corretora = ?", (nome,)).fetchone()
+        if linha and time.time() - linha[0] > JOURNAL_VALIDADE_HORAS * 3600:
+            logging.info(f"Journal de {nome} expirado; a extração recomeça do zero.")
+            self.limpar(nome)
+            linha = None
+        if linha is None:
+            self.conexao.execute("INSERT INTO corretoras (corretora, iniciada_em) VALUES (?, ?)", (nome, time.time()))
+            self.conexao.commit()
+        else:
+            paginas = self.conexao.execute("SELECT COUNT(*) FROM paginas WHERE corretora = ?", (nome,)).fetchone()[0]
+            itens = self.conexao.execute("SELECT COUNT(*) FROM itens WHERE corretora = ?", (nome,)).fetchone()[0]
+            if paginas or itens:
+                logging.info(f"Retomando extração de {nome}: {paginas} página(s) e {itens} detalhe(s) já concluídos no journal.")
+        return JournalCorretora(self, nome)
+
+    def limpar(self, nome):
+        for tabela in ('paginas', 'itens', 'corretoras'):
+            self.conexao.execute(f"DELETE FROM {tabela} WHERE corretora = ?", (nome,))
+        self.conexao.commit()
+
+    def fechar(self):
+        self.conexao.close()
+
+class JournalCorretora:
+    """Visão do journal restrita a uma corretora, usada pelo IcatuAPIClient."""
+    def __init__(self, journal, nome):
+        self.journal = journal
+        self.nome = nome
+        self.retomados = Counter()
+
+    @staticmethod
+    def hash_corpo(corpo):
+        """Identifica o corpo da listagem: páginas obtidas com outro corpo (ex.: outro período) não são reaproveitadas."""
+        return hashlib.sha256(corpo if isinstance(corpo, bytes) else str(corpo).encode('utf-8')).hexdigest()
+
+    def obter_pagina(self, secao, pagina, corpo=''):
+        linha = self.journal.conexao.execute("SELECT itens, total_paginas FROM paginas WHERE corretora = ? AND secao = ? AND corpo = ? AND pagina = ?",
+                                             (self.nome, secao, corpo, pagina)).fetchone()
+        if linha is None: return None
+        self.retomados[f"páginas de {secao}"] += 1
+        return decodificar_json(linha[0]), linha[1]
+
+    def salvar_pagina(self, secao, pagina, itens, total_paginas=None, corpo=''):
+        self.journal.conexao.execute("INSERT OR REPLACE INTO paginas (corretora, secao, corpo, pagina, itens, total_paginas) VALUES (?, ?, ?, ?, ?, ?)",
+                                     (self.nome, secao, corpo, pagina, json.dumps(itens, ensure_ascii=False), total_paginas))
+        self.journal.conexao.commit()
+
+    def obter_item(self, secao, chave):
+        linha = self.journal.conexao.execute("SELECT resposta FROM itens WHERE corretora = ? AND secao = ? AND chave = ?",
+                                             (self.nome, secao, chave)).fetchone()
+        if linha is None: return None
+        self.retomados[secao] += 1
+        return decodificar_json(linha[0])
+
+    def salvar_item(self, secao, chave, resposta):
+        self.journal.conexao.execute("INSERT OR REPLACE INTO itens (corretora, secao, chave, resposta) VALUES (?, ?, ?, ?)",
+                                     (self.nome, secao, chave, json.dumps(resposta, ensure_ascii=False)))
+        self.journal.conexao.commit()
+
+    def concluir(self):
+        """Chamado depois que os arquivos da corretora foram salvos: o checkpoint não é mais necessário."""
+        self.journal.limpar(self.nome)
+
+    def resumo(self):
+        if not self.retomados: return "nada retomado"
+        return ", ".join(f"{quantidade} {tipo}" for tipo, quantidade in self.retomados.items()) + " reaproveitados"
+
+class SnapshotClientes:
+    """
+    Snapshot, por corretora, do item de listagem de cada cliente (guardado como
+    hash) e das respostas de detalhe e produtos obtidas na última busca. No
+    modo incremental, clientes cujo item de listagem não mudou são montados a
+    partir do snapshot, sem chamar os endpoints de detalhe. Como a listagem
+    não reflete toda mudança de produtos, a cada SNAPSHOT_REFRESH_DIAS a
+    corretora passa por uma extração completa que renova o snapshot.
+    """
+    def __init__(self, caminho=ARQUIVO_SNAPSHOTS):
+        self.caminho = caminho
+        self.conexao = sqlite3.connect(caminho)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshot_corretoras (corretora TEXT PRIMARY KEY, refresh_completo_em REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS snapshot_clientes (corretora TEXT, chave TEXT, hash_item TEXT NOT NULL, detalhes TEXT NOT NULL,
+                                                          produtos TEXT NOT NULL, visto_em REAL NOT NULL, PRIMARY KEY (corretora, chave));
+        """)
+        self.conexao.commit()
+
+    def corretora(self, nome, incremental=None):
+        incremental = MODO_INCREMENTAL if incremental is None else incremental
+        linha = self.conexao.execute("SELECT refresh_completo_em FROM snapshot_corretoras WHERE corretora = ?", (nome,)).fetchone()
+        completo = not incremental or linha is None or time.time() - linha[0] > SNAPSHOT_REFRESH_DIAS * 86400
+        if incremental and completo:
+            motivo = "sem snapshot anterior" if linha is None else f"último refresh completo há mais de {SNAPSHOT_REFRESH_DIAS} dia(s)"
+            logging.info(f"Extração completa de clientes para {nome} ({motivo}).")
+        elif incremental:
+            logging.info(f"Extração incremental de clientes para {nome}: apenas clientes novos ou alterados terão detalhes buscados.")
+        return SnapshotCorretora(self, nome, completo)
+
+    def fechar(self):
+        self.conexao.close()
+
+class SnapshotCorretora:
+    """Visão do snapshot restrita a uma corretora, usada pelo pipeline de clientes."""
+    def __init__(self, snapshots, nome, completo):
+        self.snapshots = snapshots
+        self.nome = nome
+        self.completo = completo
+        self.inicio = time.time()
+        self.reaproveitados = []
+        self.buscados = 0
+
+    @staticmethod
+    def hash_item(item):
+        return hashlib.sha256(json.dumps(item, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def obter(self, chave, item):
+        """Retorna (detalhes, produtos) do snapshot se o item de listagem não mudou, senão None."""
+        if self.completo: return None
+        linha = self.snapshots.conexao.execute("SELECT hash_item, detalhes, produtos FROM snapshot_clientes WHERE corretora = ? AND chave = ?",
+                                               (self.nome, chave)).fetchone()
+        if linha is None or linha[0] != self.hash_item(item): return None
+        self.reaproveitados.append(chave)
+        return decodificar_json(linha[1]), decodificar_json(linha[2])
+
+    def salvar(self, chave, item, detalhes, produtos):
+        self.buscados += 1
+        self.snapshots.conexao.execute("INSERT OR REPLACE INTO snapshot_clientes (corretora, chave, hash_item, detalhes, produtos, visto_em) VALUES (?, ?, ?, ?, ?, ?)",
+                                       (self.nome, chave, self.hash_item(item), json.dumps(detalhes, ensure_ascii=False),
+                                        json.dumps(produtos, ensure_ascii=False), time.time()))
+        self.snapshots.conexao.commit()
+
+    def concluir(self):
+        """Marca os clientes reaproveitados como vistos, remove os que saíram da listagem e registra o refresh completo."""
+        conexao = self.snapshots.conexao
+        agora = time.time()
+        conexao.executemany("UPDATE snapshot_clientes SET visto_em = ? WHERE corretora = ? AND chave = ?",
+                            [(agora, self.nome, chave) for chave in self.reaproveitados])
+        conexao.execute("DELETE FROM snapshot_clientes WHERE corretora = ? AND visto_em < ?", (self.nome, self.inicio))
+        if self.completo:
+            conexao.execute("INSERT OR REPLACE INTO snapshot_corretoras (corretora, refresh_completo_em) VALUES (?, ?)", (self.nome, agora))
+        conexao.commit()
+
+    def resumo(self):
+        modo = "completo" if self.completo else "incremental"
+        return f"modo {modo}, {len(self.reaproveitados)} clientes reaproveitados, {self.buscados} buscados na API"
+
+class RecursosExecucao:
+    """Objetos compartilhados por todos os workers durante uma execução."""
+    def __init__(self, cliente_http=None, cache_templates=None, contextualizador=None, journal=None, snapshots=None, cache_http=None):
+        self.cliente_http = cliente_http
+        self.cache_http = cache_http if cache_http is not None else CacheRespostasHTTP()
+        self.journal = journal if journal is not None else JournalExtracao()
+        self.snapshots = snapshots if snapshots is not None else SnapshotClientes()
+        self.cache_templates = cache_templates if cache_templates is not None else CacheTemplatesPostData()
+        self.contextualizador = contextualizador if contextualizador is not None else ContextualizadorAPI()
+
+async def aguardar_pagina_carregada(page, timeout=15000):
+    """Entre tentativas: espera a página terminar de carregar (retorna na hora se já carregou)."""
+    try:
+        with medindo_espera('navegação'):
+            await page.wait_for_load_state("load", timeout=timeout)
+    except Exception:
+        pass
+
 async def aguardar_elemento_com_retry(page, selector, timeout=40000, max_attempts=4):
     for attempt in range(max_attempts):
         try:
-            await page.wait_for_selector(selector, timeout=timeout)
+            with medindo_espera('elemento'):
+                await page.wait_for_selector(selector, timeout=timeout)
             return True
         except Exception as e:
             logging.warning(f"Tentativa {attempt + 1} falhou para aguardar '{selector}': {e}")
-            if attempt < max_attempts - 1: await asyncio.sleep(2)
+            if attempt < max_attempts - 1: await aguardar_pagina_carregada(page)
     logging.error(f"ERRO: Elemento '{selector}' não encontrado após {max_attempts} tentativas.")
     return False
 
 async def clicar_elemento_com_retry(page, selector, timeout=40000, max_attempts=4):
     for attempt in range(max_attempts):
         try:
-            await page.wait_for_selector(selector, state='visible', timeout=timeout)
+            with medindo_espera('elemento'):
+                await page.wait_for_selector(selector, state='visible', timeout=timeout)
             await page.click(selector, timeout=timeout)
             logging.info(f"Clicou em: {selector}")
             return True
         except Exception as e:
             logging.warning(f"Tentativa {attempt + 1} de clique falhou para '{selector}': {e}")
-            if attempt < max_attempts - 1: await asyncio.sleep(2)
+            if attempt < max_attempts - 1: await aguardar_pagina_carregada(page)
     logging.error(f"ERRO: Não foi possível clicar em '{selector}' após {max_attempts} tentativas.")
     return False
 
@@ -320,16 +1741,20 @@ async def selecionar_corretora_por_cnpj(page, cnpj_desejado):
     correto derivado do console.
     """
     # 1. Clica no elemento que abre a lista de corretoras
-    seletor_dropdown = 'div.dsi_header-selected-item:has-text("Selecione")'
+    seletor_dropdown = SELETOR_LISTA_CORRETORAS
     logging.info(f"Abrindo a lista de corretoras clicando em: {seletor_dropdown}")
     if not await clicar_elemento_com_retry(page, seletor_dropdown):
         logging.error("Não foi possível abrir a lista de corretoras.")
         await page.screenshot(path="debug_falha_abrir_dropdown.png", full_page=True)
         return False
 
-    # 2. Pausa para aguardar a animação do menu e o carregamento dos itens
-    logging.info("Aguardando 2 segundos para a animação do menu...")
-    await asyncio.sleep(2)
+    # 2. Aguarda os itens do menu ficarem visíveis (fim da animação e do carregamento)
+    logging.info("Aguardando os itens da lista de corretoras...")
+    try:
+        with medindo_espera('elemento'):
+            await page.wait_for_selector('div.dsi_header-select-item-wrapper', state='visible', timeout=20000)
+    except Exception:
+        logging.warning("Os itens da lista de corretoras não ficaram visíveis a tempo, continuando...")
 
     # 3. TIRA A FOTO DA TELA PARA DEBUG
     screenshot_path = "debug_selecao_corretora.png"
@@ -343,140 +1768,617 @@ async def selecionar_corretora_por_cnpj(page, cnpj_desejado):
     # 5. Tenta clicar diretamente na opção correta
     if await clicar_elemento_com_retry(page, seletor_corretora):
         logging.info(f"Corretora com CNPJ {cnpj_desejado} selecionada com sucesso.")
-        await asyncio.sleep(1)  # Pausa para a UI atualizar após o clique
-        return True
+        return True  # quem chama aguarda o elemento que indica a UI atualizada
     else:
         logging.error(f"Não foi possível encontrar ou clicar na corretora com CNPJ {cnpj_desejado} usando o seletor preciso.")
         return False
 
-async def processar_corretora(browser, corretora_info, corretora_index, total_corretoras):
-    corretora_nome = corretora_info["nome"]
-    logging.info(f"\n{'='*80}\nPROCESSANDO CORRETORA {corretora_index}/{total_corretoras}: {corretora_nome}\n{'='*80}")
-    
-    context = {"token": None, "token_captured": asyncio.Event()}
+class SessaoExpirada(Exception):
+    """A página foi redirecionada para o login: a sessão salva não é mais válida."""
+
+async def realizar_login(page, banner_cookies=True):
+    """
+    Faz o login completo no portal: banner de cookies, usuário/senha e
+    seleção da corretora mãe. Executado uma vez por execução (ou quando a
+    sessão expira). Com `banner_cookies` falso (CDN do banner bloqueada pelo
+    perfil de navegação) o aceite do banner é pulado.
+    """
+    logging.info("Navegando para a página de login...")
+    await page.goto(URL_LOGIN, wait_until="domcontentloaded", timeout=70000)
+
+    if banner_cookies:
+        try:
+            await page.click('button#onetrust-accept-btn-handler', timeout=30000)
+            logging.info("Banner de cookies aceito.")
+        except Exception:
+            logging.info("Banner de cookies não foi encontrado no tempo limite, continuando...")
+    else:
+        logging.info(f"Perfil de navegação bloqueia {HOST_BANNER_COOKIES}: banner de cookies não será exibido, continuando...")
+
+    await aguardar_elemento_com_retry(page, SELETOR_USUARIO)
+    logging.info("Preenchendo usuário e senha...")
+    await page.fill(SELETOR_USUARIO, USUARIO)
+    await page.fill('input[placeholder="Senha"]', SENHA)
+    await clicar_elemento_com_retry(page, 'button.dsi-button-primary')
+
+    logging.info("Aguardando o carregamento do portal após o login...")
+    if not await aguardar_elemento_com_retry(page, SELETOR_LISTA_CORRETORAS, timeout=65000):
+        logging.error("A página do portal não carregou o seletor de corretora a tempo.")
+        return False
+
+    logging.info(f"Selecionando corretora mãe com CNPJ: {CNPJ_CORRETORA_MAE}...")
+    if not await selecionar_corretora_por_cnpj(page, CNPJ_CORRETORA_MAE):
+        logging.error(f"Falha ao selecionar corretora mãe com CNPJ {CNPJ_CORRETORA_MAE}")
+        return False
+
+    return await aguardar_elemento_com_retry(page, SELETOR_CORRETOR_VINCULADO)
+
+async def abrir_portal_autenticado(page):
+    """
+    Abre o portal com a sessão já autenticada do contexto e deixa a página
+    pronta para o passo "Selecionar corretor vinculado". Levanta
+    SessaoExpirada se o portal redirecionar para o login.
+    """
+    with medindo_espera('navegação'):
+        await page.goto(URL_PORTAL, wait_until="domcontentloaded", timeout=70000)
+    try:
+        with medindo_espera('elemento'):
+            await page.wait_for_selector(f'{SELETOR_CORRETOR_VINCULADO}, {SELETOR_USUARIO}, {SELETOR_LISTA_CORRETORAS}', timeout=65000)
+    except Exception:
+        logging.error("O portal não carregou a tempo com a sessão salva.")
+        return False
+
+    if await page.is_visible(SELETOR_USUARIO):
+        raise SessaoExpirada()
+    if await page.is_visible(SELETOR_CORRETOR_VINCULADO):
+        return True
+
+    # A seleção da corretora mãe pode não ter sido preservada no estado salvo.
+    try:
+        await page.wait_for_selector(SELETOR_CORRETOR_VINCULADO, state='visible', timeout=5000)
+        return True
+    except Exception:
+        pass
+    logging.info(f"Corretora mãe não está selecionada na sessão. Selecionando CNPJ {CNPJ_CORRETORA_MAE}...")
+    if not await selecionar_corretora_por_cnpj(page, CNPJ_CORRETORA_MAE):
+        logging.error(f"Falha ao selecionar corretora mãe com CNPJ {CNPJ_CORRETORA_MAE}")
+        return False
+    return await aguardar_elemento_com_retry(page, SELETOR_CORRETOR_VINCULADO)
+
+class PerfilNavegacao:
+    """
+    Interceptação de rotas aplicada a todos os contextos do navegador. No
+    perfil "enxuto", requisições de tipos não essenciais (imagens, fontes,
+    mídia) e de domínios fora de DOMINIOS_ESSENCIAIS (analytics, chat, etc.)
+    são abortadas, para que as páginas do portal carreguem e fiquem ociosas
+    mais cedo. O perfil "completo" não intercepta nada.
+    """
+    def __init__(self, nome=PERFIL_NAVEGACAO, tipos_bloqueados=TIPOS_RECURSO_BLOQUEADOS, dominios_essenciais=DOMINIOS_ESSENCIAIS):
+        self.nome = nome
+        self.tipos_bloqueados = set(tipos_bloqueados)
+        self.dominios_essenciais = tuple(dominios_essenciais)
+        self.bloqueadas = Counter()
+        self.liberadas = 0
+
+    def libera_host(self, host):
+        """Indica se requisições a `host` chegam à rede neste perfil."""
+        if self.nome != "enxuto": return True
+        return any(host == dominio or host.endswith(f".{dominio}") for dominio in self.dominios_essenciais)
+
+    def _essencial(self, request):
+        partes = urlparse(request.url)
+        if partes.scheme not in ('http', 'https'): return True
+        if request.resource_type in self.tipos_bloqueados: return False
+        return self.libera_host(partes.hostname or '')
+
+    async def _rotear(self, route):
+        if self._essencial(route.request):
+            self.liberadas += 1
+            await route.continue_()
+        else:
+            self.bloqueadas[route.request.resource_type] += 1
+            await route.abort()
+
+    async def aplicar(self, contexto_navegador):
+        if self.nome == "enxuto":
+            await contexto_navegador.route("**/*", self._rotear)
+        return contexto_navegador
+
+    def resumo(self):
+        if self.nome != "enxuto": return "perfil completo (sem bloqueio de requisições)"
+        detalhes = ", ".join(f"{tipo}: {quantidade}" for tipo, quantidade in self.bloqueadas.most_common()) or "nenhuma"
+        return f"perfil enxuto: {sum(self.bloqueadas.values())} requisições bloqueadas ({detalhes}), {self.liberadas} liberadas"
+
+class SessaoPortal:
+    """
+    Sessão autenticada compartilhada por todos os workers da execução.
+
+    O login é feito uma única vez e o storage state do Playwright é salvo em
+    ARQUIVO_SESSAO; os contextos dos workers são criados a partir dele. Um
+    novo login só acontece quando algum worker encontra a sessão expirada.
+    """
+    def __init__(self, browser, caminho_estado=ARQUIVO_SESSAO, perfil=None):
+        self.browser = browser
+        self.caminho_estado = caminho_estado
+        self.perfil = perfil if perfil is not None else PerfilNavegacao()
+        self.versao = 0
+        self._lock = asyncio.Lock()
 
-    async def intercept_token_response(response):
-        if "/api/usuarios/corretoras" in response.url and "/contextualizar" in response.url:
+    async def iniciar(self):
+        if os.path.exists(self.caminho_estado):
+            logging.info(f"Sessão salva encontrada em '{self.caminho_estado}'. O login será refeito apenas se ela tiver expirado.")
+            return True
+        return await self._login()
+
+    async def _login(self):
+        contexto_navegador = await self.perfil.aplicar(await self.browser.new_context())
+        page = await contexto_navegador.new_page()
+        try:
+            if not await realizar_login(page, banner_cookies=self.perfil.libera_host(HOST_BANNER_COOKIES)):
+                return False
+            await contexto_navegador.storage_state(path=self.caminho_estado)
+            self.versao += 1
+            logging.info(f"Login realizado. Estado da sessão salvo em '{self.caminho_estado}'.")
+            return True
+        except Exception as e:
+            logging.exception(f"ERRO CRÍTICO durante o login: {e}")
+            await page.screenshot(path='debug_screenshot_login.png')
+            return False
+        finally:
+            await contexto_navegador.close()
+
+    async def renovar(self, versao_observada):
+        """Refaz o login, a menos que outro worker já tenha renovado a sessão."""
+        async with self._lock:
+            if self.versao != versao_observada:
+                return True
+            logging.warning("Sessão expirada. Realizando novo login...")
+            return await self._login()
+
+    async def novo_contexto(self):
+        estado = self.caminho_estado if os.path.exists(self.caminho_estado) else None
+        return await self.perfil.aplicar(await self.browser.new_context(storage_state=estado)), self.versao
+
+class InterfaceWorker:
+    """
+    Serializa o uso da interface do portal entre as páginas de um mesmo worker.
+    Como o estágio de navegador prepara a próxima corretora enquanto a atual
+    ainda pode precisar da interface (renovação de token ou recaptura de
+    postData), guarda também qual corretora foi selecionada por último, para
+    que uma página só reaproveite a seleção se ninguém a trocou depois.
+    """
+    def __init__(self):
+        self.trava = asyncio.Lock()
+        self.corretora_selecionada = None
+
+class PreparacaoCorretora:
+    """
+    Estado de uma corretora entre o estágio de navegador (token e postData) e o
+    estágio HTTP (extração e gravação). A página fica aberta até o fim da
+    extração para os fallbacks pela interface.
+    """
+    def __init__(self, contexto_navegador, corretora_info, recursos, interface):
+        self.contexto_navegador = contexto_navegador
+        self.corretora_info = corretora_info
+        self.nome = corretora_info["nome"]
+        self.recursos = recursos
+        self.interface = interface
+        self.page = None
+        self.token = None
+        self.capturas = []
+        self.versao_sessao = None
+        self.duracao_preparo = 0.0
+        self.tempo_ate_token = None
+        self.origem_token = None
+        self.espera = ContabilidadeEspera()
+        self._reiniciar_contextualizacao()
+
+    def _reiniciar_contextualizacao(self):
+        self.token = None
+        self._token_capturado = asyncio.Event()
+        self._selecao_enviada = False
+        self._pagina_contextualizada = False
+
+    async def abrir(self):
+        self.page = await self.contexto_navegador.new_page()
+        self.page.on("request", self._interceptar_requisicao)
+        self.page.on("response", self._interceptar_resposta)
+
+    async def fechar(self):
+        if self.page and not self.page.is_closed():
+            await self.page.close()
+
+    async def _interceptar_requisicao(self, request):
+        if "/api/usuarios/corretoras" in request.url and "/contextualizar" in request.url:
+            await self.recursos.contextualizador.registrar_requisicao(request, self.nome if self._selecao_enviada else None)
+
+    async def _interceptar_resposta(self, response):
+        if "/api/usuarios/corretoras" in response.url and "/contextualizar" in response.url and self._selecao_enviada:
             try:
                 if response.ok:
                     json_body = await response.json()
                     token = json_body.get("resultado", {}).get("token")
                     if token:
-                        context["token"] = f"Bearer {token}"
-                        logging.info(f"\nTOKEN CAPTURADO PARA {corretora_nome}: ...{context['token'][-10:]}\n")
-                        context["token_captured"].set()
+                        self.token = f"Bearer {token}"
+                        logging.info(f"\nTOKEN CAPTURADO PARA {self.nome}: ...{self.token[-10:]}\n")
+                        self._token_capturado.set()
                 else:
                     response_text = await response.text()
-                    logging.error(f"Erro na API de token para {corretora_nome}. Status: {response.status}. Resposta: {response_text}")
+                    logging.error(f"Erro na API de token para {self.nome}. Status: {response.status}. Resposta: {response_text}")
 
             except json.JSONDecodeError:
                 response_text = await response.text()
-                logging.error(f"Erro ao decodificar JSON da resposta de token para {corretora_nome}. Resposta recebida: {response_text}")
+                logging.error(f"Erro ao decodificar JSON da resposta de token para {self.nome}. Resposta recebida: {response_text}")
             except Exception as e:
                 logging.error(f"Erro inesperado ao processar resposta para token: {e}")
-                
-    page = await browser.new_page()
-    page.on("response", intercept_token_response)
-    try:
-        logging.info("Fase 1: Realizando login e selecionando corretora...")
-        logging.info("Navegando para a página de login...")
-        await page.goto("https://portalcorretor.icatuseguros.com.br/casadocorretor/login", wait_until="domcontentloaded", timeout=70000)
-        
-        try:
-            await page.click('button#onetrust-accept-btn-handler', timeout=30000)
-            logging.info("Banner de cookies aceito.")
-        except Exception:
-            logging.info("Banner de cookies não foi encontrado no tempo limite, continuando...")
 
-        await aguardar_elemento_com_retry(page, 'input[placeholder="Usuário"]')
-        logging.info("Preenchendo usuário e senha...")
-        await page.fill('input[placeholder="Usuário"]', USUARIO)
-        await page.fill('input[placeholder="Senha"]', SENHA)
-        await clicar_elemento_com_retry(page, 'button.dsi-button-primary')
+    async def contextualizar_pela_interface(self):
+        """Seleciona a corretora no menu do portal e aguarda o token interceptado. Exige a trava da interface."""
+        if self._pagina_contextualizada and self.interface.corretora_selecionada == self.nome:
+            return True
+        self._reiniciar_contextualizacao()
+        page = self.page
+        if not await abrir_portal_autenticado(page):
+            return False
 
-        logging.info("Aguardando o carregamento do portal após o login...")
-        if not await aguardar_elemento_com_retry(page, 'div.dsi_header-selected-item:has-text("Selecione")', timeout=65000):
-             logging.error("A página do portal não carregou o seletor de corretora a tempo.")
-             return False
+        if not await clicar_elemento_com_retry(page, SELETOR_CORRETOR_VINCULADO): return False
 
-        logging.info(f"Selecionando corretora mãe com CNPJ: {CNPJ_CORRETORA_MAE}...")
-        if not await selecionar_corretora_por_cnpj(page, CNPJ_CORRETORA_MAE):
-            logging.error(f"Falha ao selecionar corretora mãe com CNPJ {CNPJ_CORRETORA_MAE}")
+        logging.info(f"Selecionando a corretora específica: {self.nome}...")
+        if not await clicar_elemento_com_retry(page, SELETOR_LISTA_CORRETORAS): return False
+        if not await clicar_elemento_com_retry(page, f'text="{self.nome}"'):
+            logging.critical(f"ERRO CRÍTICO: Não foi possível encontrar/clicar na corretora '{self.nome}' na lista.")
             return False
-        
-        await asyncio.sleep(2)
 
-        if not await clicar_elemento_com_retry(page, 'button.dsi-button-link:has-text("Selecionar corretor vinculado a plataforma")'): return False
-        
-        logging.info(f"Selecionando a corretora específica: {corretora_nome}...")
-        if not await clicar_elemento_com_retry(page, 'div.dsi_header-selected-item:has-text("Selecione")'): return False
-        if not await clicar_elemento_com_retry(page, f'text="{corretora_nome}"'):
-            logging.critical(f"ERRO CRÍTICO: Não foi possível encontrar/clicar na corretora '{corretora_nome}' na lista.")
-            return False
-        
+        self._selecao_enviada = True
+        self.interface.corretora_selecionada = self.nome
         if not await clicar_elemento_com_retry(page, 'button:has-text("Selecionar")'): return False
-        
-        logging.info(f"Seleção para '{corretora_nome}' concluída. Aguardando captura do token...")
+
+        logging.info(f"Seleção para '{self.nome}' concluída. Aguardando captura do token...")
         try:
-            await asyncio.wait_for(context["token_captured"].wait(), timeout=40.0)
+            with medindo_espera('token'):
+                await asyncio.wait_for(self._token_capturado.wait(), timeout=40.0)
         except asyncio.TimeoutError:
-            logging.error(f"ERRO: Tempo esgotado esperando pelo token da corretora '{corretora_nome}'.")
-            await page.reload(wait_until="networkidle")
-            await asyncio.sleep(5)
+            logging.error(f"ERRO: Tempo esgotado esperando pelo token da corretora '{self.nome}'. Recarregando a página...")
+            with medindo_espera('token'):
+                await page.reload(wait_until="networkidle")
+                try:
+                    await asyncio.wait_for(self._token_capturado.wait(), timeout=5.0)
+                except asyncio.TimeoutError:
+                    pass
 
-        if not context["token"]:
-            logging.error(f"Token não foi capturado para {corretora_nome}. Encerrando esta corretora.")
-            await page.screenshot(path=f'debug_screenshot_{corretora_nome.replace(" ", "_")}_no_token.png')
+        if not self.token:
+            logging.error(f"Token não foi capturado para {self.nome}. Encerrando esta corretora.")
+            await page.screenshot(path=f'debug_screenshot_{self.nome.replace(" ", "_")}_no_token.png')
             return False
-            
-        logging.info("Token obtido, iniciando extração de dados.")
-        await page.wait_for_load_state("networkidle", timeout=60000)
-
-        all_sheets_data = []
-        api_client = IcatuAPIClient(context["token"])
-        secoes = [
-            ("Clientes", "/meus-clientes", '/api/RelacionamentoCliente/Tombamento/clientes', api_client.get_customers),
-            ("Pagamentos Pendentes", "/meus-clientes/pendentes-beta", '/api/Relatorio/pendentes/tabela/v2', api_client.get_pending_payments),
-            ("Status de Propostas", "/venda/status-proposta", '/api/relatorio/consulta/status/v2', api_client.get_proposal_status)
-        ]
-        logging.info("\nFase 2: Iniciando extração dos dados...")
-        for nome, url_path, api_part, extract_func in secoes:
-            logging.info(f"\n--- Extraindo {nome} para {corretora_nome} ---")
-            await page.goto(f"https://portalcorretor.icatuseguros.com.br/casadocorretor{url_path}", wait_until="networkidle")
-            post_data = await capture_post_data(page, api_part)
+
+        with medindo_espera('navegação'):
+            await page.wait_for_load_state("networkidle", timeout=60000)
+        self._pagina_contextualizada = True
+        return True
+
+    async def renovar_token(self):
+        contextualizador = self.recursos.contextualizador
+        id_atual = contextualizador.id_corretora(self.corretora_info)
+        if contextualizador.disponivel() and id_atual:
+            token = await contextualizador.obter_token(self.recursos.cliente_http, id_atual, self.corretora_info)
+            if token: return token
+        async with self.interface.trava:
+            self._pagina_contextualizada = False
+            if await self.contextualizar_pela_interface(): return self.token
+        return None
+
+    async def capturar_ao_vivo(self, nome, url_path, api_part):
+        async with self.interface.trava:
+            if not await self.contextualizar_pela_interface(): return None
+            logging.info(f"\n--- Capturando postData de {nome} para {self.nome} ---")
+            with medindo_espera('navegação'):
+                await self.page.goto(f"{URL_PORTAL}{url_path}", wait_until="networkidle")
+            post_data = await capture_post_data(self.page, api_part)
+        if post_data: self.recursos.cache_templates.salvar(nome, post_data, self.corretora_info)
+        return post_data
+
+    async def preparar(self):
+        """Fases 1 e 2: obtém o token e o postData de cada seção. Retorna False se a corretora não puder ser extraída."""
+        logging.info("Fase 1: Obtendo o token da corretora...")
+        inicio = time.time()
+        cache_templates = self.recursos.cache_templates
+        contextualizador = self.recursos.contextualizador
+        id_corretora = contextualizador.id_corretora(self.corretora_info)
+        templates_completos = all(cache_templates.obter(nome, self.corretora_info) for nome, _, _, _ in SECOES_EXTRACAO)
+        token = None
+        if contextualizador.disponivel() and id_corretora and templates_completos:
+            token = await contextualizador.obter_token(self.recursos.cliente_http, id_corretora, self.corretora_info)
+
+        if token:
+            self.token = token
+            self.origem_token = "api"
+        else:
+            logging.info("Reutilizando sessão autenticada e selecionando corretora pela interface...")
+            async with self.interface.trava:
+                if not await self.contextualizar_pela_interface():
+                    return False
+            self.origem_token = "interface"
+        self.tempo_ate_token = time.time() - inicio
+        logging.info(f"Token obtido em {self.tempo_ate_token:.2f}s (via {self.origem_token}).")
+
+        logging.info("\nFase 2: Obtendo o postData de cada seção...")
+        for nome, url_path, api_part, metodo in SECOES_EXTRACAO:
+            post_data = cache_templates.obter(nome, self.corretora_info)
+            if post_data:
+                logging.info(f"postData de {nome} gerado a partir do template salvo.")
+                self.capturas.append((nome, url_path, api_part, metodo, post_data, True))
+                continue
+            post_data = await self.capturar_ao_vivo(nome, url_path, api_part)
             if post_data:
-                sheets = await extract_func(post_data, lambda s: logging.info(f"  Status: {s}"))
-                all_sheets_data.extend(sheets)
+                self.capturas.append((nome, url_path, api_part, metodo, post_data, False))
             else:
                 logging.warning(f"Não foi possível obter o postData para {nome}. Pulando seção.")
-        
-        logging.info("\nFase 3: Salvando arquivos locais...")
+        return True
+
+async def preparar_corretora(contexto_navegador, corretora_info, corretora_index, total_corretoras, worker_id=1, recursos=None, interface=None):
+    """Estágio de navegador: devolve a PreparacaoCorretora pronta para extração, ou None em caso de falha."""
+    corretora_nome = corretora_info["nome"]
+    recursos = recursos if recursos is not None else RecursosExecucao()
+    interface = interface if interface is not None else InterfaceWorker()
+    logging.info(f"\n{'='*80}\n[Worker {worker_id}] PROCESSANDO CORRETORA {corretora_index}/{total_corretoras}: {corretora_nome}\n{'='*80}")
+
+    inicio = time.time()
+    preparacao = PreparacaoCorretora(contexto_navegador, corretora_info, recursos, interface)
+    marca_espera = ESPERA_CORRETORA.set(preparacao.espera)
+    try:
+        await preparacao.abrir()
+        if not await preparacao.preparar():
+            await preparacao.fechar()
+            return None
+        preparacao.duracao_preparo = time.time() - inicio
+        logging.info(f"[Worker {worker_id}] {corretora_nome} preparada em {preparacao.duracao_preparo:.2f}s "
+                     f"({len(preparacao.capturas)} seções prontas para extração).")
+        return preparacao
+    except SessaoExpirada:
+        await preparacao.fechar()
+        raise
+    except Exception as e:
+        logging.exception(f"ERRO CRÍTICO ao preparar {corretora_nome}: {e}")
+        if preparacao.page and not preparacao.page.is_closed():
+            await preparacao.page.screenshot(path=f'debug_screenshot_{corretora_nome.replace(" ", "_")}.png')
+        await preparacao.fechar()
+        return None
+    finally:
+        ESPERA_CORRETORA.reset(marca_espera)
+
+async def extrair_corretora(preparacao, worker_id=1):
+    """Estágio HTTP: extrai as seções com o token e os postData preparados e salva os arquivos locais."""
+    corretora_nome = preparacao.nome
+    recursos = preparacao.recursos
+    api_client = None
+    destino = None
+    inicio = time.time()
+    marca_espera = ESPERA_CORRETORA.set(preparacao.espera)
+    try:
+        logging.info(f"[Worker {worker_id}] Iniciando extração de dados de {corretora_nome}.")
         if not os.path.exists(PASTA_DOWNLOAD): os.makedirs(PASTA_DOWNLOAD, exist_ok=True)
         timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        nome_base = f"Extracao_{corretora_nome.replace(' ', '_').replace('/', '-')}_{timestamp}"
-        path_excel = os.path.join(PASTA_DOWNLOAD, f"{nome_base}.xlsx")
-        export_to_excel(path_excel, all_sheets_data)
-        path_json = os.path.join(PASTA_DOWNLOAD, f"{nome_base}_backup.json")
+        nome_base = f"{prefixo_arquivos_corretora(corretora_nome)}{timestamp}"
+        path_ndjson = os.path.join(PASTA_DOWNLOAD, f"{nome_base}_backup.ndjson")
+        journal = recursos.journal.corretora(corretora_nome)  # antes do destino: limpa os .parcial órfãos
+        destino = EscritorNDJSON(path_ndjson)
+        snapshot = recursos.snapshots.corretora(corretora_nome)
+        api_client = IcatuAPIClient(preparacao.token, recursos.cliente_http, preparacao.renovar_token, journal, snapshot,
+                                    recursos.cache_http, corretora_nome)
+
+        def pular_secao(nome):
+            for secao in SECOES_SAIDA[nome]: destino.pular(secao)
+
+        async def extrair_secao(nome, url_path, api_part, metodo, post_data, do_template):
+            extract_func = getattr(api_client, metodo)
+            inicio_secao = time.time()
+            POSTDATA_DE_TEMPLATE.set(do_template)
+            try:
+                await extract_func(post_data, lambda s: logging.info(f"  Status [{nome}]: {s}"), destino)
+            except PostDataRejeitado as e:
+                if not do_template:
+                    logging.error(f"API rejeitou o postData capturado de {nome} ({e}). Pulando seção.")
+                    pular_secao(nome)
+                    return time.time() - inicio_secao
+                logging.warning(f"API rejeitou o template de postData de {nome} ({e}). Recapturando pela interface...")
+                recursos.cache_templates.invalidar(nome)
+                post_data = await preparacao.capturar_ao_vivo(nome, url_path, api_part)
+                if not post_data:
+                    logging.warning(f"Não foi possível obter o postData para {nome}. Pulando seção.")
+                    pular_secao(nome)
+                    return time.time() - inicio_secao
+                POSTDATA_DE_TEMPLATE.set(False)
+                await extract_func(post_data, lambda s: logging.info(f"  Status [{nome}]: {s}"), destino)
+            duracao = time.time() - inicio_secao
+            logging.info(f"--- {nome} extraído em {duracao:.2f}s ---")
+            return duracao
+
+        capturadas = {captura[0] for captura in preparacao.capturas}
+        for nome, *_ in SECOES_EXTRACAO:
+            if nome not in capturadas: pular_secao(nome)  # postData não obtido no preparo
+        logging.info(f"\nExtraindo {len(preparacao.capturas)} seções em paralelo para {corretora_nome}...")
+        inicio_extracao = time.time()
+        tarefas = [asyncio.create_task(extrair_secao(*captura)) for captura in preparacao.capturas]
         try:
-            with open(path_json, 'w', encoding='utf-8') as f:
-                json.dump(all_sheets_data, f, ensure_ascii=False, indent=2, default=str)
-            logging.info(f"Backup JSON salvo: {path_json}")
-        except Exception as e: logging.error(f"Erro ao salvar backup JSON: {e}")
+            duracoes = await asyncio.gather(*tarefas)
+        except BaseException:
+            # Uma seção falhou: as demais não podem seguir escrevendo num destino que será descartado
+            for tarefa in tarefas: tarefa.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+            raise
+        duracao_total = time.time() - inicio_extracao
+        logging.info(f"Seções extraídas em {duracao_total:.2f}s (soma das seções: {sum(duracoes):.2f}s, "
+                     f"ganho pela sobreposição: {sum(duracoes) - duracao_total:.2f}s).")
+
+        logging.info("\nFase 3: Salvando arquivos locais...")
+        manifesto = destino.finalizar(corretora=corretora_nome)
+        logging.info(f"Backup NDJSON salvo: {path_ndjson} ({manifesto['registros']} registros, sha256 {manifesto['sha256'][:12]}...)")
+        journal.concluir()
+        if GERAR_EXCEL:
+            path_excel = os.path.join(PASTA_DOWNLOAD, f"{nome_base}.xlsx")
+            await asyncio.to_thread(export_to_excel, path_excel, path_ndjson, manifesto)
+        if GERAR_PARQUET and PYARROW_DISPONIVEL:
+            await asyncio.to_thread(export_to_parquet, path_ndjson, manifesto, corretora_nome)
         
         logging.info(f"\nExtração concluída para {corretora_nome}!")
-        for sheet in all_sheets_data: logging.info(f"  - {sheet['name']}: {len(sheet['data'])} registros")
+        for nome, info in manifesto['secoes'].items(): logging.info(f"  - {nome}: {info['registros']} registros")
+        for nome in manifesto['secoes_puladas']: logging.info(f"  - {nome}: pulada (postData não obtido ou recusado)")
+        logging.info(f"  - Conexões HTTP: {api_client.metricas_conexao.resumo()}")
+        for linha in api_client.politica_retry.resumo(): logging.info(f"  - {linha}")
+        logging.info(f"  - Limitador de concorrência: {api_client.limitador.resumo()}")
+        logging.info(f"  - Renovações de token: {api_client.gerenciador_token.renovacoes}")
+        logging.info(f"  - Journal: {journal.resumo()}")
+        logging.info(f"  - Snapshot de clientes: {snapshot.resumo()}")
+        logging.info(f"  - Cache HTTP: {api_client.estatisticas_cache['acertos']} acertos, {api_client.estatisticas_cache['faltas']} faltas")
+        duracao = preparacao.duracao_preparo + time.time() - inicio
+        espera = preparacao.espera.total()
+        logging.info(f"  - Tempo: {duracao:.2f}s, sendo {espera:.2f}s esperando a interface ({preparacao.espera.resumo()}) "
+                     f"e {duracao - espera:.2f}s de trabalho")
         return True
+    except SessaoExpirada:
+        raise
     except Exception as e:
         logging.exception(f"ERRO CRÍTICO ao processar {corretora_nome}: {e}")
-        await page.screenshot(path=f'debug_screenshot_{corretora_nome.replace(" ", "_")}.png')
+        if preparacao.page and not preparacao.page.is_closed():
+            await preparacao.page.screenshot(path=f'debug_screenshot_{corretora_nome.replace(" ", "_")}.png')
         return False
     finally:
-        if not page.is_closed():
-            await page.close()
+        ESPERA_CORRETORA.reset(marca_espera)
+        if destino is not None and not destino.finalizado:
+            destino.descartar()
+        if api_client:
+            await api_client.aclose()
+        await preparacao.fechar()
         logging.info(f"Sessão encerrada para {corretora_nome}")
 
+async def worker_corretoras(worker_id, sessao, fila, total_corretoras, recursos):
+    """
+    Consome corretoras da fila compartilhada usando um contexto de navegador
+    próprio (cookies e armazenamento isolados dos demais workers), criado a
+    partir da sessão autenticada compartilhada.
+
+    O worker roda em dois estágios: o de navegador obtém token e postData da
+    próxima corretora enquanto o estágio HTTP extrai a atual. No máximo uma
+    corretora fica preparada à espera, para que o token não envelheça na fila.
+    """
+    estatisticas = {'worker_id': worker_id, 'processadas': 0, 'sucessos': 0, 'tempo_ativo': 0.0,
+                    'tempo_preparo': 0.0, 'tempo_extracao': 0.0, 'tempo_espera': 0.0, 'tempos_token': []}
+    inicio_worker = time.time()
+    interface = InterfaceWorker()
+    estado = {}
+    estado['contexto'], estado['versao'] = await sessao.novo_contexto()
+    contextos = [estado['contexto']]
+    trava_sessao = asyncio.Lock()
+    preparadas = asyncio.Queue()
+    vagas = asyncio.Semaphore(2)  # uma corretora em extração e uma em preparo
+
+    async def renovar_contexto(versao_observada):
+        async with trava_sessao:
+            if estado['versao'] != versao_observada:
+                return True
+            if not await sessao.renovar(versao_observada):
+                return False
+            # O contexto antigo só é fechado no fim do worker: a página da corretora em extração ainda pode pertencer a ele.
+            estado['contexto'], estado['versao'] = await sessao.novo_contexto()
+            contextos.append(estado['contexto'])
+            return True
+
+    async def preparar(corretora_index, corretora):
+        for tentativa in range(2):
+            versao = estado['versao']
+            try:
+                preparacao = await preparar_corretora(estado['contexto'], corretora, corretora_index, total_corretoras, worker_id, recursos, interface)
+                if preparacao:
+                    preparacao.versao_sessao = versao
+                return preparacao
+            except SessaoExpirada:
+                logging.warning(f"[Worker {worker_id}] Sessão expirada ao preparar {corretora['nome']}.")
+                if tentativa > 0 or not await renovar_contexto(versao):
+                    logging.error(f"[Worker {worker_id}] Não foi possível renovar a sessão para {corretora['nome']}.")
+                    return None
+        return None
+
+    async def estagio_navegador():
+        try:
+            while True:
+                await vagas.acquire()
+                try:
+                    corretora_index, corretora = fila.get_nowait()
+                except asyncio.QueueEmpty:
+                    vagas.release()
+                    break
+                inicio = time.time()
+                try:
+                    preparacao = await preparar(corretora_index, corretora)
+                except BaseException:
+                    fila.task_done()  # a corretora não chegará ao estágio HTTP
+                    raise
+                estatisticas['tempo_preparo'] += time.time() - inicio
+                if preparacao and preparacao.tempo_ate_token is not None:
+                    estatisticas['tempos_token'].append((preparacao.origem_token, preparacao.tempo_ate_token))
+                await preparadas.put((corretora_index, corretora, preparacao))
+
+                if not fila.empty():
+                    delay = random.uniform(PAUSA_MIN_SEGUNDOS, PAUSA_MAX_SEGUNDOS)
+                    logging.info(f"\n[Worker {worker_id}] Pausa de {delay:.2f} segundos antes de preparar a próxima corretora...")
+                    await asyncio.sleep(delay)
+        finally:
+            await preparadas.put(None)
+
+    async def estagio_http():
+        while True:
+            item = await preparadas.get()
+            if item is None:
+                break
+            corretora_index, corretora, preparacao = item
+            inicio = time.time()
+            try:
+                sucesso = False
+                for tentativa in range(2):
+                    if preparacao is None:
+                        break
+                    try:
+                        sucesso = await extrair_corretora(preparacao, worker_id)
+                        break
+                    except SessaoExpirada:
+                        logging.warning(f"[Worker {worker_id}] Sessão expirada durante a extração de {corretora['nome']}.")
+                        if tentativa > 0 or not await renovar_contexto(preparacao.versao_sessao):
+                            logging.error(f"[Worker {worker_id}] Não foi possível renovar a sessão para {corretora['nome']}.")
+                            break
+                        preparacao = await preparar(corretora_index, corretora)
+                if sucesso:
+                    estatisticas['sucessos'] += 1
+            finally:
+                estatisticas['processadas'] += 1
+                estatisticas['tempo_extracao'] += time.time() - inicio
+                if preparacao is not None: estatisticas['tempo_espera'] += preparacao.espera.total()
+                vagas.release()
+                fila.task_done()
+
+    estagios = [asyncio.create_task(estagio_navegador()), asyncio.create_task(estagio_http())]
+    try:
+        await asyncio.gather(*estagios)
+    except BaseException:
+        # Um estágio falhou: o outro é interrompido antes de os contextos que ele usa serem fechados
+        for estagio in estagios: estagio.cancel()
+        await asyncio.gather(*estagios, return_exceptions=True)
+        while not preparadas.empty():
+            item = preparadas.get_nowait()
+            if item is None: continue
+            if item[2] is not None: await item[2].fechar()
+            fila.task_done()
+        raise
+    finally:
+        for contexto in contextos:
+            await contexto.close()
+        estatisticas['tempo_ativo'] = time.time() - inicio_worker
+    return estatisticas
+
 async def main():
     start_time = time.time()
+    if not USUARIO or not SENHA:
+        logging.error("ERRO: As variáveis de ambiente ICATU_USUARIO e ICATU_SENHA devem ser definidas.")
+        return
     
     arquivo_corretoras = 'corretoras_para_rerodar.xlsx'
     try:
@@ -510,28 +2412,64 @@ async def main():
         os.makedirs(PASTA_DOWNLOAD)
         logging.info(f"Pasta de downloads criada em: {os.path.abspath(PASTA_DOWNLOAD)}")
     
-    sucessos = 0
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
-        for i, corretora in enumerate(CORRETORAS, 1):
-            if await processar_corretora(browser, corretora, i, len(CORRETORAS)):
-                sucessos += 1
-            
-            if i < len(CORRETORAS):
-                delay = random.uniform(5, 15)
-                logging.info(f"\nPausa de {delay:.2f} segundos antes da próxima corretora...")
-                await asyncio.sleep(delay)
+    fila = asyncio.Queue()
+    for i, corretora in enumerate(CORRETORAS, 1):
+        fila.put_nowait((i, corretora))
+
+    num_workers = max(1, min(NUM_WORKERS, len(CORRETORAS)))
+    logging.info(f"Iniciando pool com {num_workers} worker(s). Pausa entre corretoras: {PAUSA_MIN_SEGUNDOS}-{PAUSA_MAX_SEGUNDOS}s por worker.")
 
+    async with criar_cliente_http() as cliente_http, async_playwright() as p:
+        logging.info(f"Cliente HTTP compartilhado criado (HTTP/2: {'sim' if HTTP2_DISPONIVEL else 'não, instale o pacote h2'}).")
+        if GERAR_PARQUET and not PYARROW_DISPONIVEL:
+            logging.warning("Pacote 'pyarrow' não instalado: os arquivos Parquet não serão gerados.")
+        recursos = RecursosExecucao(cliente_http)
+        browser = await p.chromium.launch(headless=NAVEGADOR_HEADLESS)
+        sessao = SessaoPortal(browser)
+        if not await sessao.iniciar():
+            logging.error("ERRO CRÍTICO: Não foi possível realizar o login no portal. Encerrando.")
+            await browser.close()
+            return
+        estatisticas_workers = await asyncio.gather(*[
+            worker_corretoras(worker_id, sessao, fila, len(CORRETORAS), recursos)
+            for worker_id in range(1, num_workers + 1)
+        ])
         await browser.close()
-    
+        logging.info(f"Navegador ({'headless' if NAVEGADOR_HEADLESS else 'com janela'}): {sessao.perfil.resumo()}")
+        recursos.journal.fechar()
+        recursos.snapshots.fechar()
+        logging.info("Cache HTTP de detalhes:")
+        for linha in recursos.cache_http.resumo(): logging.info(f"  - {linha}")
+        recursos.cache_http.fechar()
+
+    sucessos = sum(est['sucessos'] for est in estatisticas_workers)
+    logging.info(f"\n{'='*80}\nTHROUGHPUT POR WORKER:")
+    for est in estatisticas_workers:
+        por_hora = est['processadas'] / est['tempo_ativo'] * 3600 if est['tempo_ativo'] else 0.0
+        media = est['tempo_ativo'] / est['processadas'] if est['processadas'] else 0.0
+        logging.info(f"  - Worker {est['worker_id']}: {est['sucessos']}/{est['processadas']} corretoras com sucesso, "
+                     f"{media:.2f}s por corretora, {por_hora:.2f} corretoras/hora")
+        sobreposicao = est['tempo_preparo'] + est['tempo_extracao'] - est['tempo_ativo']
+        logging.info(f"    preparo (navegador): {est['tempo_preparo']:.2f}s, extração (HTTP): {est['tempo_extracao']:.2f}s, "
+                     f"sobreposição entre os estágios: {max(sobreposicao, 0.0):.2f}s, esperando a interface: {est['tempo_espera']:.2f}s")
+        for origem in ('api', 'interface'):
+            tempos = sorted(t for o, t in est['tempos_token'] if o == origem)
+            if tempos:
+                logging.info(f"    tempo até o token via {origem}: média {sum(tempos) / len(tempos):.2f}s, "
+                             f"mediana {tempos[len(tempos) // 2]:.2f}s, máximo {tempos[-1]:.2f}s ({len(tempos)} corretoras)")
+
     end_time = time.time()
     logging.info(f"\n{'='*80}")
     logging.info(f"EXTRAÇÃO CONCLUÍDA PARA {sucessos}/{len(CORRETORAS)} CORRETORAS.")
     logging.info(f"TEMPO TOTAL: {end_time - start_time:.2f} SEGUNDOS.")
-    logging.info(f"Os arquivos .xlsx e .json estão prontos na pasta '{PASTA_DOWNLOAD}'.")
+    logging.info(f"Os arquivos {'.xlsx e ' if GERAR_EXCEL else ''}.ndjson estão prontos na pasta '{PASTA_DOWNLOAD}'.")
     logging.info(f"{'='*80}")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--excel":
+        for caminho in sys.argv[2:]:
+            exportar_excel_do_backup(caminho)
+        sys.exit()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
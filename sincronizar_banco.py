@@ -1,8 +1,12 @@
 import os
 import json
+import hashlib
+import io
 import psycopg2
+import psycopg2.pool
 import re
 import logging
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -36,6 +40,9 @@ PASTA_PROCESSADOS = os.path.join(PASTA_DOWNLOAD, "processados")
 DB_URL = os.getenv('DB_URL')
 TENANT_ID = 20
 INSURANCE_COMPANY_ID = 44
+# Pool de conexões único para a execução inteira. Cada conexão nova pelo pooler
+# custa alguns segundos, então as funções salvar_* reaproveitam as já abertas.
+POOL_MAX_CONEXOES = int(os.getenv('DB_POOL_MAX_CONEXOES', '2'))
 
 # --- FUNÇÕES AUXILIARES ---
 def clean_cpf(cpf):
@@ -69,30 +76,10 @@ def format_db_date(date_str):
     except Exception:
         return None
 
-def calculate_delay_days(vencimento_original, vencimento_atual=None):
-    """Calcula o número de dias em atraso com base na data de vencimento."""
-    try:
-        data_vencimento_str = vencimento_atual if vencimento_atual else vencimento_original
-        if not data_vencimento_str:
-            return 0
-        
-        data_formatada = format_db_date(data_vencimento_str)
-        if not data_formatada:
-            return 0
-
-        data_venc = datetime.strptime(data_formatada, '%Y-%m-%d')
-        data_hoje = datetime.now()
-        if data_hoje > data_venc:
-            delay = (data_hoje - data_venc).days
-            return delay
-        return 0
-    except (ValueError, TypeError):
-        return 0
-        
 def extrair_nome_corretora_do_arquivo(filename):
     """Extrai o nome da corretora a partir do nome do arquivo JSON."""
     try:
-        nome_parcial = filename.replace("Extracao_", "").replace("_backup.json", "")
+        nome_parcial = filename.replace("Extracao_", "").replace("_backup.json", "").replace("_backup.ndjson", "")
         parts = nome_parcial.split('_')
         nome_parts = parts[:-2]
         nome_em_maiusculo = ' '.join(nome_parts)
@@ -100,6 +87,41 @@ def extrair_nome_corretora_do_arquivo(filename):
     except Exception:
         return "NOME_DESCONHECIDO"
 
+def caminho_manifesto_ndjson(caminho_arquivo):
+    """Caminho do manifesto gravado pelo extrator ao lado de um backup NDJSON."""
+    return re.sub(r'(_backup)?\.ndjson$', '', caminho_arquivo) + '_manifest.json'
+
+def ler_backup_ndjson(caminho_arquivo):
+    """
+    Lê um backup NDJSON (uma linha {"secao", "dados"} por registro) e o devolve
+    no mesmo formato do backup JSON: lista de {'name': secao, 'data': [...]}.
+    Se o manifesto existir, confere o SHA-256 do arquivo e as contagens.
+    """
+    secoes = {}
+    sha256 = hashlib.sha256()
+    with open(caminho_arquivo, 'rb') as f:
+        for linha in f:
+            sha256.update(linha)
+            if not linha.strip():
+                continue
+            registro = json.loads(linha)
+            secoes.setdefault(registro['secao'], []).append(registro['dados'])
+
+    caminho_manifesto = caminho_manifesto_ndjson(caminho_arquivo)
+    if os.path.exists(caminho_manifesto):
+        with open(caminho_manifesto, 'r', encoding='utf-8') as f:
+            manifesto = json.load(f)
+        if manifesto.get('sha256') != sha256.hexdigest():
+            raise ValueError(f"Checksum de '{caminho_arquivo}' não confere com o manifesto.")
+        for nome, info in manifesto.get('secoes', {}).items():
+            secoes.setdefault(nome, [])
+            if info.get('registros') != len(secoes[nome]):
+                raise ValueError(f"Seção '{nome}' tem {len(secoes[nome])} registros, o manifesto indica {info.get('registros')}.")
+        logging.info(f"Manifesto conferido: {manifesto.get('registros')} registros, checksum OK.")
+    else:
+        logging.warning(f"Manifesto não encontrado para '{caminho_arquivo}'. Lendo sem validação.")
+    return [{'name': nome, 'data': dados} for nome, dados in secoes.items()]
+
 def identificar_tipo_dados(elemento):
     """Identifica o tipo de dados contido em uma seção do JSON (clientes, propostas, etc.)."""
     if isinstance(elemento, dict) and 'name' in elemento:
@@ -123,23 +145,93 @@ def extrair_dados(elemento):
     return []
 
 # --- FUNÇÕES DE BANCO DE DADOS ---
+class PoolConexoes:
+    """
+    Pool de conexões criado uma vez por execução. Toda conexão entregue passa por
+    um SELECT 1; se o servidor a derrubou, ela é descartada e outra é aberta.
+    Mede separadamente o tempo gasto conectando e o tempo de trabalho em cada conexão.
+    """
+    def __init__(self, db_url, max_conexoes=POOL_MAX_CONEXOES):
+        # minconn=1: a primeira conexão é aberta aqui e fica ociosa no pool entre
+        # uma tabela e outra, em vez de ser fechada a cada devolução.
+        inicio = time.perf_counter()
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, max_conexoes, db_url)
+        self.tempo_conexao = time.perf_counter() - inicio
+        logging.info(f"Pool de conexões criado em {self.tempo_conexao:.2f}s.")
+        self.conhecidas = set()
+        self.emprestadas = {}
+        self.conexoes_abertas = 0
+        self.conexoes_descartadas = 0
+        self.tempo_trabalho = 0.0
+
+    def _conexao_valida(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        inicio = time.perf_counter()
+        for _ in range(2):
+            conn = self.pool.getconn()
+            if id(conn) not in self.conhecidas:
+                conn.set_client_encoding('UTF8')
+                self.conhecidas.add(id(conn))
+                self.conexoes_abertas += 1
+            if self._conexao_valida(conn):
+                break
+            logging.warning("Conexão do pool não respondeu ao health-check. Descartando e abrindo outra.")
+            self.conhecidas.discard(id(conn))
+            self.conexoes_descartadas += 1
+            self.pool.putconn(conn, close=True)
+        else:
+            raise psycopg2.OperationalError("Nenhuma conexão válida disponível no pool.")
+        agora = time.perf_counter()
+        self.tempo_conexao += agora - inicio
+        self.emprestadas[id(conn)] = agora
+        logging.info(f"Conexão obtida do pool em {agora - inicio:.2f}s.")
+        return conn
+
+    def devolver(self, conn):
+        inicio = self.emprestadas.pop(id(conn), None)
+        if inicio is not None:
+            duracao = time.perf_counter() - inicio
+            self.tempo_trabalho += duracao
+            logging.info(f"Conexão devolvida ao pool após {duracao:.2f}s de trabalho.")
+        if conn.closed:
+            self.conhecidas.discard(id(conn))
+        self.pool.putconn(conn, close=bool(conn.closed))
+
+    def fechar(self):
+        self.pool.closeall()
+        logging.info(
+            f"Pool de conexões encerrado. Conexões abertas: {self.conexoes_abertas}, "
+            f"descartadas no health-check: {self.conexoes_descartadas}, "
+            f"tempo conectando: {self.tempo_conexao:.2f}s, tempo de trabalho: {self.tempo_trabalho:.2f}s."
+        )
+
+_pool_conexoes = None
+
 def get_db_connection():
-    """Estabelece e retorna uma conexão com o banco de dados."""
+    """Retorna uma conexão do pool da execução, criando o pool na primeira chamada."""
+    global _pool_conexoes
     try:
         if not DB_URL:
             logging.error("A variável de ambiente DB_URL não foi definida.")
             return None
-        
-        # LOG para debug - mostra primeiros caracteres da URL (sem senha)
-        url_parts = DB_URL.split('@')
-        if len(url_parts) > 1:
-            logging.info(f"Tentando conectar ao servidor: {url_parts[-1][:30]}...")
-        
-        # Conecta diretamente sem conversão de encoding
-        conn = psycopg2.connect(DB_URL)
-        conn.set_client_encoding('UTF8')
-        logging.info("Conexão com banco estabelecida com sucesso.")
-        return conn
+
+        if _pool_conexoes is None:
+            # LOG para debug - mostra primeiros caracteres da URL (sem senha)
+            url_parts = DB_URL.split('@')
+            if len(url_parts) > 1:
+                logging.info(f"Criando pool de conexões para o servidor: {url_parts[-1][:30]}...")
+            _pool_conexoes = PoolConexoes(DB_URL)
+
+        return _pool_conexoes.obter()
     except psycopg2.OperationalError as e:
         logging.error(f"Erro ao conectar ao banco de dados: {e}")
         return None
@@ -147,6 +239,20 @@ def get_db_connection():
         logging.error(f"Erro inesperado ao conectar: {e}")
         return None
 
+def release_db_connection(conn):
+    """Devolve ao pool uma conexão obtida com get_db_connection()."""
+    if _pool_conexoes is not None:
+        _pool_conexoes.devolver(conn)
+    else:
+        conn.close()
+
+def close_db_pool():
+    """Fecha todas as conexões do pool ao fim da execução."""
+    global _pool_conexoes
+    if _pool_conexoes is not None:
+        _pool_conexoes.fechar()
+        _pool_conexoes = None
+
 def get_client_id(cursor, cpf, tenant_id):
     """Busca e retorna o ID de um cliente pelo CPF e tenant_id."""
     try:
@@ -157,23 +263,95 @@ def get_client_id(cursor, cpf, tenant_id):
         logging.error(f"Erro ao buscar client ID para CPF {cpf}: {e}")
         return None
 
-def get_or_create_client_id(cur, cpf, nome, broker_id, tenant_id):
-    """Busca um cliente pelo CPF. Se não encontrar, cria um novo cliente simplificado."""
-    client_id = get_client_id(cur, cpf, tenant_id)
-    if client_id:
-        return client_id
-    try:
-        logging.info(f"CPF {cpf} não encontrado. Criando novo cliente simplificado: {nome}")
-        sql = "INSERT INTO public.clients (tenant_id, nome, tipo_documento, documento, broker_id) VALUES (%s, %s, %s, %s, %s) RETURNING id;"
-        params = (tenant_id, safe_str(nome), 'CPF', cpf, broker_id)
-        cur.execute(sql, params)
-        new_client_id = cur.fetchone()[0]
-        logging.info(f"Novo cliente criado com ID: {new_client_id}")
-        return new_client_id
-    except Exception as e:
-        logging.error(f"Erro ao criar cliente simplificado para CPF {cpf}: {e}")
-        cur.connection.rollback()
-        return None
+# --- SINCRONIZAÇÃO EM LOTE (STAGING) ---
+# Cada seção é carregada numa tabela temporária com COPY e aplicada com poucas
+# instruções set-based, em vez de um SELECT + UPDATE/INSERT por linha.
+def _campo_copy(valor):
+    """Formata um valor para o COPY em formato texto (None vira NULL)."""
+    if valor is None:
+        return '\\N'
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def criar_tabela_staging(cur, staging, destino, colunas, extras=()):
+    """
+    Cria uma tabela temporária com as colunas (e os tipos) da tabela de destino,
+    mais linha/cpf/nome_cliente para rastrear a origem. É descartada no commit.
+    """
+    cur.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {', '.join(colunas)} FROM {destino} WITH NO DATA")
+    colunas_extras = ['linha integer', 'cpf text', 'nome_cliente text', *extras]
+    cur.execute(f"ALTER TABLE {staging} " + ', '.join(f"ADD COLUMN {c}" for c in colunas_extras))
+
+def copiar_para_staging(cur, staging, colunas, linhas):
+    """Carrega a lista de dicts na tabela temporária com um único COPY."""
+    buffer = io.StringIO()
+    for linha in linhas:
+        buffer.write('\t'.join(_campo_copy(linha.get(c)) for c in colunas) + '\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {staging} ({', '.join(colunas)}) FROM STDIN", buffer)
+
+def resolver_clientes_staging(cur, staging, broker_id=None):
+    """
+    Preenche client_id na staging a partir do CPF. Com broker_id, cria antes os
+    clientes simplificados que faltam (tipo_documento 'CPF', nome da linha). Linhas
+    que continuam sem cliente são removidas. Retorna (clientes_criados, linhas_sem_cliente).
+    """
+    clientes_criados = 0
+    if broker_id is not None:
+        cur.execute(f"""
+            INSERT INTO public.clients (tenant_id, nome, tipo_documento, documento, broker_id)
+            SELECT DISTINCT ON (s.cpf) %s, s.nome_cliente, 'CPF', s.cpf, %s
+            FROM {staging} s
+            WHERE s.cpf IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM public.clients c WHERE c.documento = s.cpf AND c.tenant_id = %s)
+            ORDER BY s.cpf, s.linha
+        """, (TENANT_ID, broker_id, TENANT_ID))
+        clientes_criados = cur.rowcount
+        if clientes_criados:
+            logging.info(f"{clientes_criados} clientes simplificados criados para CPFs não encontrados.")
+    cur.execute(f"""
+        UPDATE {staging} s SET client_id = c.id
+        FROM (
+            SELECT documento, MIN(id) AS id FROM public.clients
+            WHERE tenant_id = %s AND documento IN (SELECT cpf FROM {staging})
+            GROUP BY documento
+        ) c
+        WHERE c.documento = s.cpf
+    """, (TENANT_ID,))
+    cur.execute(f"DELETE FROM {staging} WHERE client_id IS NULL")
+    return clientes_criados, cur.rowcount
+
+def remover_duplicados_staging(cur, staging, chave):
+    """Mantém só a última ocorrência de cada chave no arquivo, como acontecia linha a linha."""
+    condicao = ' AND '.join(f"d.{c} = s.{c}" for c in chave)
+    cur.execute(f"DELETE FROM {staging} s USING {staging} d WHERE {condicao} AND d.linha > s.linha")
+    return cur.rowcount
+
+def aplicar_upsert_staging(cur, staging, destino, colunas, chave, comparadas, atualizadas):
+    """
+    Atualiza as linhas existentes em que algum campo comparado mudou e insere as
+    novas, numa só instrução. Não depende de constraint única na chave (sem ON
+    CONFLICT). Retorna (inseridos, atualizados, sem_mudanca) a partir do RETURNING.
+    """
+    condicao = ' AND '.join(f"t.{c} = s.{c}" for c in chave)
+    mudou = f"({', '.join('t.' + c for c in comparadas)}) IS DISTINCT FROM ({', '.join('s.' + c for c in comparadas)})"
+    cur.execute(f"""
+        WITH atualizados AS (
+            UPDATE {destino} t SET {', '.join(f'{c} = s.{c}' for c in atualizadas)}
+            FROM {staging} s
+            WHERE {condicao} AND {mudou}
+            RETURNING s.linha
+        ), inseridos AS (
+            INSERT INTO {destino} ({', '.join(colunas)})
+            SELECT {', '.join('s.' + c for c in colunas)} FROM {staging} s
+            WHERE NOT EXISTS (SELECT 1 FROM {destino} t WHERE {condicao})
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM {staging}),
+               (SELECT COUNT(*) FROM inseridos),
+               (SELECT COUNT(DISTINCT linha) FROM atualizados)
+    """)
+    total, inseridos, atualizados = cur.fetchone()
+    return inseridos, atualizados, total - inseridos - atualizados
 
 def salvar_clientes_no_banco(clientes, corretora_nome, db_url):
     """Salva uma lista de novos clientes no banco de dados."""
@@ -231,306 +409,262 @@ def salvar_clientes_no_banco(clientes, corretora_nome, db_url):
         if conn: conn.rollback()
         return None
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
+
+PROPOSTAS_COLUNAS = [
+    'client_id', 'broker_id', 'tenant_id', 'insurance_company_id', 'produto',
+    'linha_negocio', 'proposta', 'criada_em', 'status_proposta', 'forma_pagamento',
+    'valor', 'vencimento', 'competencia', 'status_pagamento', 'motivo_pendencia', 'data'
+]
+PROPOSTAS_CHAVE = ['tenant_id', 'proposta']
+PROPOSTAS_COMPARADAS = ['status_proposta', 'forma_pagamento', 'valor', 'vencimento',
+                        'competencia', 'status_pagamento', 'motivo_pendencia']
+PROPOSTAS_ATUALIZADAS = [c for c in PROPOSTAS_COLUNAS if c not in ('tenant_id', 'proposta')]
 
 def salvar_propostas_no_banco(propostas, broker_id, id_cpf_map, db_url):
-    """Salva ou atualiza propostas no banco de dados."""
+    """Salva ou atualiza propostas no banco de dados, em lote, pela chave (tenant_id, proposta)."""
     logging.info("Iniciando sincronização de Status Propostas...")
     if not propostas:
         logging.info("Nenhuma proposta para sincronizar.")
         return
+
+    linhas = []
+    propostas_puladas = 0
+
+    for i, prop in enumerate(propostas):
+        if not isinstance(prop, dict): continue
+        num_proposta = prop.get('proposta', '')
+        if not num_proposta:
+            propostas_puladas += 1
+            continue
+
+        cpf_cliente = None
+        source_client_id = prop.get('id_cliente')
+        if source_client_id and id_cpf_map:
+            cpf_cliente = id_cpf_map.get(source_client_id)
+
+        if not cpf_cliente:
+            cpf_cliente = clean_cpf(prop.get('cpf'))
+
+        if not cpf_cliente:
+            logging.warning(f"(Propostas) Linha {i+1}: Não foi possível encontrar CPF para a proposta '{num_proposta}'. Pulando.")
+            propostas_puladas += 1
+            continue
+
+        data_vencimento = format_db_date(prop.get('vencimento'))
+        if not data_vencimento:
+            logging.warning(f"Proposta {num_proposta} pulada por não ter data de vencimento válida.")
+            propostas_puladas += 1
+            continue
+
+        try:
+            valor = float(prop.get('valor', 0.0) or 0.0)
+        except (ValueError, TypeError):
+            logging.warning(f"Proposta {num_proposta} pulada por ter valor inválido '{prop.get('valor')}'.")
+            propostas_puladas += 1
+            continue
+
+        linhas.append({
+            'linha': i + 1,
+            'cpf': cpf_cliente,
+            'nome_cliente': safe_str(prop.get('nome', 'Cliente não informado')),
+            'broker_id': broker_id,
+            'tenant_id': TENANT_ID,
+            'insurance_company_id': INSURANCE_COMPANY_ID,
+            'produto': safe_str(prop.get('produto')),
+            'linha_negocio': safe_str(prop.get('linha_negocio')),
+            'proposta': str(num_proposta),
+            'criada_em': format_db_date(prop.get('criada_em')),
+            'status_proposta': safe_str(prop.get('status_proposta')),
+            'forma_pagamento': safe_str(prop.get('forma_pagamento')),
+            'valor': valor,
+            'vencimento': data_vencimento,
+            'competencia': safe_str(prop.get('competencia')),
+            'status_pagamento': safe_str(prop.get('status_pagamento')),
+            'motivo_pendencia': safe_str(prop.get('motivo_pendencia')),
+            'data': format_db_date(prop.get('data'))
+        })
+
+    if not linhas:
+        logging.info(f"Sincronização de Propostas concluída. Nenhuma proposta válida. Puladas: {propostas_puladas}.")
+        return
+
     conn = get_db_connection()
     if not conn: return
+    staging = "staging_proposals"
     try:
         cur = conn.cursor()
-        propostas_inseridas = 0
-        propostas_atualizadas = 0
-        propostas_puladas = 0
-        propostas_existentes = 0
-
-        for i, prop in enumerate(propostas):
-            try:
-                if not isinstance(prop, dict): continue
-                num_proposta = prop.get('proposta', '')
-                if not num_proposta: 
-                    propostas_puladas += 1
-                    continue
-                
-                cpf_cliente = None
-                source_client_id = prop.get('id_cliente') 
-                if source_client_id and id_cpf_map:
-                     cpf_cliente = id_cpf_map.get(source_client_id)
-                
-                if not cpf_cliente:
-                    cpf_cliente = clean_cpf(prop.get('cpf'))
-
-                if not cpf_cliente:
-                    logging.warning(f"(Propostas) Linha {i+1}: Não foi possível encontrar CPF para a proposta '{num_proposta}'. Pulando.")
-                    propostas_puladas +=1
-                    continue
-                
-                data_vencimento = format_db_date(prop.get('vencimento'))
-                if not data_vencimento:
-                    logging.warning(f"Proposta {num_proposta} pulada por não ter data de vencimento válida.")
-                    propostas_puladas +=1
-                    continue
-
-                nome_cliente = safe_str(prop.get('nome', 'Cliente não informado'))
-                client_id = get_or_create_client_id(cur, cpf_cliente, nome_cliente, broker_id, TENANT_ID)
-                if not client_id:
-                    logging.error(f"(Propostas) Linha {i+1}: Não foi possível obter/criar um client_id para a proposta {num_proposta}. Pulando.")
-                    continue
-                
-                sql_check = """
-                    SELECT id, status_proposta, forma_pagamento, valor, vencimento, 
-                           competencia, status_pagamento, motivo_pendencia
-                    FROM public.proposals 
-                    WHERE proposta = %s AND tenant_id = %s
-                """
-                cur.execute(sql_check, (str(num_proposta), TENANT_ID))
-                existing_record = cur.fetchone()
-                
-                if existing_record:
-                    existing_id = existing_record[0]
-                    existing_status_proposta = existing_record[1]
-                    existing_forma_pagamento = existing_record[2]
-                    existing_valor = existing_record[3]
-                    existing_vencimento = existing_record[4]
-                    existing_competencia = existing_record[5]
-                    existing_status_pagamento = existing_record[6]
-                    existing_motivo_pendencia = existing_record[7]
-                    
-                    has_changes = (
-                        existing_status_proposta != safe_str(prop.get('status_proposta')) or
-                        existing_forma_pagamento != safe_str(prop.get('forma_pagamento')) or
-                        existing_valor != prop.get('valor', 0.0) or
-                        existing_vencimento != data_vencimento or
-                        existing_competencia != safe_str(prop.get('competencia')) or
-                        existing_status_pagamento != safe_str(prop.get('status_pagamento')) or
-                        existing_motivo_pendencia != safe_str(prop.get('motivo_pendencia'))
-                    )
-                    
-                    if has_changes:
-                        sql_update = """
-                            UPDATE public.proposals SET
-                                client_id = %s,
-                                broker_id = %s,
-                                insurance_company_id = %s,
-                                produto = %s,
-                                linha_negocio = %s,
-                                criada_em = %s,
-                                status_proposta = %s,
-                                forma_pagamento = %s,
-                                valor = %s,
-                                vencimento = %s,
-                                competencia = %s,
-                                status_pagamento = %s,
-                                motivo_pendencia = %s,
-                                "data" = %s
-                            WHERE id = %s
-                        """
-                        cur.execute(sql_update, (
-                            client_id,
-                            broker_id,
-                            INSURANCE_COMPANY_ID,
-                            safe_str(prop.get('produto')),
-                            safe_str(prop.get('linha_negocio')),
-                            format_db_date(prop.get('criada_em')),
-                            safe_str(prop.get('status_proposta')),
-                            safe_str(prop.get('forma_pagamento')),
-                            prop.get('valor', 0.0),
-                            data_vencimento,
-                            safe_str(prop.get('competencia')),
-                            safe_str(prop.get('status_pagamento')),
-                            safe_str(prop.get('motivo_pendencia')),
-                            format_db_date(prop.get('data')),
-                            existing_id
-                        ))
-                        propostas_atualizadas += 1
-                    else:
-                        propostas_existentes += 1
-                    continue
-                
-                sql = """
-                    INSERT INTO public.proposals (
-                        client_id, broker_id, tenant_id, insurance_company_id, produto, 
-                        linha_negocio, proposta, criada_em, status_proposta, forma_pagamento, 
-                        valor, vencimento, competencia, status_pagamento, motivo_pendencia, "data"
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                params = (
-                    client_id, broker_id, TENANT_ID, INSURANCE_COMPANY_ID, 
-                    safe_str(prop.get('produto')), safe_str(prop.get('linha_negocio')), 
-                    str(num_proposta), format_db_date(prop.get('criada_em')), 
-                    safe_str(prop.get('status_proposta')), safe_str(prop.get('forma_pagamento')), 
-                    prop.get('valor', 0.0), data_vencimento, safe_str(prop.get('competencia')),
-                    safe_str(prop.get('status_pagamento')), safe_str(prop.get('motivo_pendencia')),
-                    format_db_date(prop.get('data'))
-                )
-                cur.execute(sql, params)
-                propostas_inseridas += 1
-            except Exception as e:
-                logging.error(f"Erro ao processar proposta na linha {i+1}: {e}")
-                conn.rollback()
-        
+        criar_tabela_staging(cur, staging, "public.proposals", PROPOSTAS_COLUNAS)
+        copiar_para_staging(cur, staging, ['linha', 'cpf', 'nome_cliente'] + [c for c in PROPOSTAS_COLUNAS if c != 'client_id'], linhas)
+        _, sem_cliente = resolver_clientes_staging(cur, staging, broker_id)
+        if sem_cliente:
+            logging.error(f"(Propostas) {sem_cliente} propostas sem client_id após a criação dos clientes. Puladas.")
+        duplicadas = remover_duplicados_staging(cur, staging, PROPOSTAS_CHAVE)
+        if duplicadas:
+            logging.info(f"(Propostas) {duplicadas} propostas repetidas no arquivo; mantida a última ocorrência.")
+        propostas_inseridas, propostas_atualizadas, propostas_existentes = aplicar_upsert_staging(
+            cur, staging, "public.proposals", PROPOSTAS_COLUNAS, PROPOSTAS_CHAVE, PROPOSTAS_COMPARADAS, PROPOSTAS_ATUALIZADAS
+        )
         conn.commit()
+        propostas_existentes += duplicadas
+        propostas_puladas += sem_cliente
         logging.info(f"Sincronização de Propostas concluída. Inseridas: {propostas_inseridas}, Atualizadas: {propostas_atualizadas}, Existentes (sem mudança): {propostas_existentes}, Puladas: {propostas_puladas}.")
     except Exception as e:
         logging.error(f"Erro na operação com banco de dados (propostas): {e}")
         if conn: conn.rollback()
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
+
+INADIMPLENTES_COLUNAS = [
+    'tenant_id', 'client_id', 'broker_name', 'client_name', 'client_cpf',
+    'business_line', 'product_name', 'competency', 'original_due_date',
+    'current_due_date', 'contribution_value', 'proposal_number',
+    'certificate_number', 'payment_status', 'payment_method', 'delay_days'
+]
+INADIMPLENTES_CHAVE = ['client_id', 'tenant_id', 'proposal_number', 'certificate_number', 'competency']
+INADIMPLENTES_COMPARADAS = ['original_due_date', 'current_due_date', 'contribution_value',
+                            'payment_status', 'payment_method', 'delay_days']
+INADIMPLENTES_ATUALIZADAS = [c for c in INADIMPLENTES_COLUNAS if c not in INADIMPLENTES_CHAVE]
 
 def salvar_inadimplentes_no_banco(inadimplentes_data, corretora_nome, id_cpf_map, db_url):
-    """Salva ou atualiza registros de inadimplência no banco de dados."""
+    """Salva ou atualiza registros de inadimplência no banco de dados, em lote."""
     logging.info("Iniciando sincronização de Pagamentos Pendentes...")
     if not inadimplentes_data:
         logging.info("Nenhum pagamento pendente para sincronizar.")
         return
+
+    linhas = []
+    registros_pulados = 0
+
+    for i, registro in enumerate(inadimplentes_data):
+        if not isinstance(registro, dict):
+            registros_pulados += 1
+            continue
+
+        cpf_cliente = clean_cpf(registro.get('cpf_cliente', ''))
+        if not cpf_cliente:
+            source_client_id = registro.get('id_cliente')
+            if source_client_id:
+                cpf_cliente = id_cpf_map.get(source_client_id)
+
+        if not cpf_cliente:
+            logging.warning(f"(Inadimplentes) Linha {i+1}: Não foi possível encontrar CPF. Pulando.")
+            registros_pulados += 1
+            continue
+
+        try:
+            contribuicao = float(registro.get('contribuicao', 0.0) or 0.0)
+        except (ValueError, TypeError):
+            logging.warning(f"(Inadimplentes) Linha {i+1}: Contribuição inválida '{registro.get('contribuicao')}'. Pulando.")
+            registros_pulados += 1
+            continue
+
+        linhas.append({
+            'linha': i + 1,
+            'cpf': cpf_cliente,
+            'nome_cliente': safe_str(registro.get('nome_cliente', '')),
+            # O atraso é contado a partir do vencimento atual, ou do original se não houver
+            'vencimento_referencia': format_db_date(registro.get('vencimento_atual') or registro.get('vencimento_original')),
+            'tenant_id': TENANT_ID,
+            'broker_name': safe_str(corretora_nome),
+            'client_name': safe_str(registro.get('nome_cliente', '')),
+            'client_cpf': cpf_cliente,
+            'business_line': safe_str(registro.get('linha_negocio', '')),
+            'product_name': safe_str(registro.get('produto', '')),
+            'competency': safe_str(registro.get('competencia', '')),
+            'original_due_date': format_db_date(registro.get('vencimento_original')),
+            'current_due_date': format_db_date(registro.get('vencimento_atual')),
+            'contribution_value': contribuicao,
+            'proposal_number': safe_str(registro.get('numero_proposta', '')),
+            'certificate_number': safe_str(registro.get('numero_certificado', '')),
+            'payment_status': safe_str(registro.get('status_pagamento', '')),
+            'payment_method': safe_str(registro.get('forma_pagamento', ''))
+        })
+
+    if not linhas:
+        logging.info(f"Sincronização de Inadimplentes concluída. Nenhum registro válido. Pulados: {registros_pulados}.")
+        return
+
     conn = get_db_connection()
     if not conn: return
+    staging = "staging_defaulters_detailed"
     try:
         cur = conn.cursor()
-        registros_inseridos = 0
-        registros_atualizados = 0
-        registros_pulados = 0
-        registros_existentes = 0
-        registros_sem_atraso = 0
-
-        for i, registro in enumerate(inadimplentes_data):
-            try:
-                if not isinstance(registro, dict): 
-                    registros_pulados += 1
-                    continue
-                
-                cpf_cliente = clean_cpf(registro.get('cpf_cliente', ''))
-                if not cpf_cliente:
-                    source_client_id = registro.get('id_cliente')
-                    if source_client_id:
-                        cpf_cliente = id_cpf_map.get(source_client_id)
-
-                if not cpf_cliente: 
-                    logging.warning(f"(Inadimplentes) Linha {i+1}: Não foi possível encontrar CPF. Pulando.")
-                    registros_pulados += 1
-                    continue
-                
-                client_id = get_client_id(cur, cpf_cliente, TENANT_ID)
-                if not client_id:
-                    logging.warning(f"(Inadimplentes) Cliente com CPF {cpf_cliente} não encontrado no banco. Pulando.")
-                    registros_pulados += 1
-                    continue
-                
-                delay_days = calculate_delay_days(
-                    registro.get('vencimento_original'),
-                    registro.get('vencimento_atual')
-                )
-
-                if delay_days <= 0:
-                    registros_sem_atraso += 1
-                    continue
-
-                numero_proposta = safe_str(registro.get('numero_proposta', ''))
-                numero_certificado = safe_str(registro.get('numero_certificado', ''))
-                competencia = safe_str(registro.get('competencia', ''))
-                
-                sql_check = """
-                    SELECT id, original_due_date, current_due_date, contribution_value, 
-                           payment_status, payment_method, delay_days
-                    FROM public.defaulters_detailed 
-                    WHERE client_id = %s AND tenant_id = %s AND proposal_number = %s 
-                    AND certificate_number = %s AND competency = %s
-                """
-                cur.execute(sql_check, (client_id, TENANT_ID, numero_proposta, numero_certificado, competencia))
-                existing_record = cur.fetchone()
-                
-                if existing_record:
-                    existing_id = existing_record[0]
-                    existing_original_due = existing_record[1]
-                    existing_current_due = existing_record[2]
-                    existing_contribution = existing_record[3]
-                    existing_payment_status = existing_record[4]
-                    existing_payment_method = existing_record[5]
-                    existing_delay = existing_record[6]
-                    
-                    has_changes = (
-                        existing_original_due != format_db_date(registro.get('vencimento_original')) or
-                        existing_current_due != format_db_date(registro.get('vencimento_atual')) or
-                        existing_contribution != registro.get('contribuicao', 0.0) or
-                        existing_payment_status != safe_str(registro.get('status_pagamento', '')) or
-                        existing_payment_method != safe_str(registro.get('forma_pagamento', '')) or
-                        existing_delay != delay_days
-                    )
-                    
-                    if has_changes:
-                        sql_update = """
-                            UPDATE public.defaulters_detailed SET
-                                broker_name = %s,
-                                client_name = %s,
-                                client_cpf = %s,
-                                business_line = %s,
-                                product_name = %s,
-                                original_due_date = %s,
-                                current_due_date = %s,
-                                contribution_value = %s,
-                                payment_status = %s,
-                                payment_method = %s,
-                                delay_days = %s
-                            WHERE id = %s
-                        """
-                        cur.execute(sql_update, (
-                            safe_str(corretora_nome),
-                            safe_str(registro.get('nome_cliente', '')),
-                            cpf_cliente,
-                            safe_str(registro.get('linha_negocio', '')),
-                            safe_str(registro.get('produto', '')),
-                            format_db_date(registro.get('vencimento_original')),
-                            format_db_date(registro.get('vencimento_atual')),
-                            registro.get('contribuicao', 0.0),
-                            safe_str(registro.get('status_pagamento', '')),
-                            safe_str(registro.get('forma_pagamento', '')),
-                            delay_days,
-                            existing_id
-                        ))
-                        registros_atualizados += 1
-                    else:
-                        registros_existentes += 1
-                    continue
-
-                sql = """
-                    INSERT INTO public.defaulters_detailed (
-                        tenant_id, client_id, broker_name, client_name, client_cpf, 
-                        business_line, product_name, competency, original_due_date, 
-                        current_due_date, contribution_value, proposal_number, 
-                        certificate_number, payment_status, payment_method, delay_days
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                params = (
-                    TENANT_ID, client_id, safe_str(corretora_nome),
-                    safe_str(registro.get('nome_cliente', '')), cpf_cliente,
-                    safe_str(registro.get('linha_negocio', '')), safe_str(registro.get('produto', '')),
-                    competencia, format_db_date(registro.get('vencimento_original')),
-                    format_db_date(registro.get('vencimento_atual')),
-                    registro.get('contribuicao', 0.0), numero_proposta, 
-                    numero_certificado, safe_str(registro.get('status_pagamento', '')), 
-                    safe_str(registro.get('forma_pagamento', '')), delay_days
-                )
-                
-                cur.execute(sql, params)
-                registros_inseridos += 1
-            except Exception as e:
-                logging.error(f"Erro ao processar registro de inadimplência na linha {i+1}: {e}")
-                conn.rollback()
-        
+        criar_tabela_staging(cur, staging, "public.defaulters_detailed", INADIMPLENTES_COLUNAS, extras=['vencimento_referencia date'])
+        copiar_para_staging(
+            cur, staging,
+            ['linha', 'cpf', 'nome_cliente', 'vencimento_referencia'] + [c for c in INADIMPLENTES_COLUNAS if c not in ('client_id', 'delay_days')],
+            linhas
+        )
+        # Inadimplência não cria cliente: CPFs ausentes do banco são pulados
+        _, sem_cliente = resolver_clientes_staging(cur, staging)
+        if sem_cliente:
+            logging.warning(f"(Inadimplentes) {sem_cliente} registros de clientes não encontrados no banco. Pulados.")
+        registros_pulados += sem_cliente
+
+        cur.execute(f"UPDATE {staging} SET delay_days = GREATEST(CURRENT_DATE - vencimento_referencia, 0)")
+        cur.execute(f"DELETE FROM {staging} WHERE COALESCE(delay_days, 0) <= 0")
+        registros_sem_atraso = cur.rowcount
+
+        duplicados = remover_duplicados_staging(cur, staging, INADIMPLENTES_CHAVE)
+        if duplicados:
+            logging.info(f"(Inadimplentes) {duplicados} registros repetidos no arquivo; mantida a última ocorrência.")
+        registros_inseridos, registros_atualizados, registros_existentes = aplicar_upsert_staging(
+            cur, staging, "public.defaulters_detailed", INADIMPLENTES_COLUNAS, INADIMPLENTES_CHAVE,
+            INADIMPLENTES_COMPARADAS, INADIMPLENTES_ATUALIZADAS
+        )
         conn.commit()
+        registros_existentes += duplicados
         logging.info(f"Sincronização de Inadimplentes concluída. Inseridos: {registros_inseridos}, Atualizados: {registros_atualizados}, Existentes (sem mudança): {registros_existentes}, Sem atraso: {registros_sem_atraso}, Pulados: {registros_pulados}.")
-        
+
     except Exception as e:
         logging.error(f"Erro na operação com banco de dados (inadimplentes): {e}")
         if conn: conn.rollback()
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
+
+PRODUTOS_COLUNAS = [
+    'tenant_id', 'client_id', 'broker_name', 'business_line', 'product_type',
+    'proposal_number', 'certificate_number', 'product_status', 'coverage_name',
+    'insured_capital', 'coverage_payment_period', 'due_day', 'last_payment',
+    'next_payment', 'paid_installments_quantity', 'pending_installments_quantity',
+    'payment_frequency'
+]
+PRODUTOS_CHAVE = ['tenant_id', 'client_id', 'proposal_number', 'certificate_number', 'coverage_name']
+PRODUTOS_ATUALIZADAS = [c for c in PRODUTOS_COLUNAS if c not in ('tenant_id', 'client_id', 'proposal_number', 'certificate_number')]
+
+def upsert_produtos_em_lote(linhas, broker_id, comparadas, rotulo):
+    """
+    Aplica uma seção de produtos em products_clients: COPY para a staging,
+    resolução dos clientes, remoção de chaves repetidas e upsert set-based.
+    Retorna (inseridos, atualizados, sem_mudanca, pulados) ou None em caso de erro.
+    """
+    if not linhas:
+        return 0, 0, 0, 0
+    conn = get_db_connection()
+    if not conn: return None
+    staging = "staging_products_clients"
+    try:
+        cur = conn.cursor()
+        criar_tabela_staging(cur, staging, "public.products_clients", PRODUTOS_COLUNAS)
+        copiar_para_staging(cur, staging, ['linha', 'cpf', 'nome_cliente'] + [c for c in PRODUTOS_COLUNAS if c != 'client_id'], linhas)
+        _, sem_cliente = resolver_clientes_staging(cur, staging, broker_id)
+        if sem_cliente:
+            logging.error(f"({rotulo}) {sem_cliente} linhas sem ID de cliente após a criação dos clientes. Puladas.")
+        duplicados = remover_duplicados_staging(cur, staging, PRODUTOS_CHAVE)
+        if duplicados:
+            logging.info(f"({rotulo}) {duplicados} linhas repetidas no arquivo; mantida a última ocorrência de cada chave.")
+        inseridos, atualizados, sem_mudanca = aplicar_upsert_staging(
+            cur, staging, "public.products_clients", PRODUTOS_COLUNAS, PRODUTOS_CHAVE, comparadas, PRODUTOS_ATUALIZADAS
+        )
+        conn.commit()
+        return inseridos, atualizados, sem_mudanca + duplicados, sem_cliente
+    except Exception as e:
+        logging.error(f"Erro fatal na operação com banco de dados (produtos {rotulo.lower()}): {e}")
+        if conn: conn.rollback()
+        return None
+    finally:
+        if conn: release_db_connection(conn)
 
 def salvar_produtos_vida_no_banco(produtos_data, broker_id, corretora_nome, id_cpf_map, db_url):
     """Salva/atualiza uma lista de produtos de Vida no banco de dados."""
@@ -538,185 +672,67 @@ def salvar_produtos_vida_no_banco(produtos_data, broker_id, corretora_nome, id_c
     if not produtos_data:
         logging.info("Nenhum produto Vida para sincronizar.")
         return
-        
-    conn = get_db_connection()
-    if not conn: return
-    
-    try:
-        cur = conn.cursor()
-        produtos_inseridos = 0
-        produtos_atualizados = 0
-        produtos_pulados_dados = 0
-        produtos_cancelados = 0
-        produtos_existentes = 0
 
-        for i, produto in enumerate(produtos_data):
-            try:
-                if not isinstance(produto, dict):
-                    produtos_pulados_dados += 1
-                    continue
+    linhas = []
+    produtos_pulados_dados = 0
+    produtos_cancelados = 0
 
-                situacao_produto = safe_str(produto.get('situacao_produto', '')).upper()
-                if situacao_produto == 'CANCELADO':
-                    produtos_cancelados += 1
-                    continue
+    for i, produto in enumerate(produtos_data):
+        if not isinstance(produto, dict):
+            produtos_pulados_dados += 1
+            continue
 
-                source_client_id = produto.get('id_cliente')
-                cpf_cliente = id_cpf_map.get(source_client_id)
+        situacao_produto = (safe_str(produto.get('situacao_produto', '')) or '').upper()
+        if situacao_produto == 'CANCELADO':
+            produtos_cancelados += 1
+            continue
 
-                if not cpf_cliente:
-                    logging.warning(f"(Vida) Linha {i+1}: Não foi possível encontrar o CPF para o id_cliente '{source_client_id}'. Pulando.")
-                    produtos_pulados_dados += 1
-                    continue
-
-                nome_cliente = 'Cliente não informado'
-                client_id = get_or_create_client_id(cur, cpf_cliente, nome_cliente, broker_id, TENANT_ID)
-                if not client_id:
-                    logging.error(f"(Vida) Linha {i+1}: Não foi possível obter/criar ID do cliente. Pulando.")
-                    produtos_pulados_dados += 1
-                    continue
-                
-                params_data = {
-                    'tenant_id': TENANT_ID,
-                    'client_id': client_id,
-                    'broker_name': safe_str(corretora_nome),
-                    'business_line': safe_str(produto.get('linha_negocio')),
-                    'product_type': safe_str(produto.get('tipo_produto')),
-                    'proposal_number': safe_str(produto.get('numero_proposta')),
-                    'certificate_number': safe_str(produto.get('numero_certificado')),
-                    'product_status': safe_str(produto.get('situacao_produto')),
-                    'coverage_name': safe_str(produto.get('nome_cobertura')),
-                    'insured_capital': produto.get('capital_segurado', 0.0),
-                    'coverage_payment_period': safe_str(produto.get('periodo_pagamento_cobertura')),
-                    'due_day': safe_str(produto.get('dia_vencimento')),
-                    'last_payment': format_db_date(produto.get('ultimo_pagamento')),
-                    'next_payment': format_db_date(produto.get('proximo_pagamento')),
-                    'paid_installments_quantity': safe_str(produto.get('quantidade_parcelas_pagas')),
-                    'pending_installments_quantity': safe_str(produto.get('quantidade_parcelas_pendentes')),
-                    'payment_frequency': safe_str(produto.get('periodicidade_pagamentos'))
-                }
-
-                sql_check = """
-                    SELECT id, product_status, insured_capital, last_payment, next_payment,
-                           paid_installments_quantity, pending_installments_quantity
-                    FROM public.products_clients 
-                    WHERE tenant_id = %s 
-                    AND client_id = %s 
-                    AND proposal_number = %s 
-                    AND certificate_number = %s
-                    AND coverage_name = %s
-                """
-                cur.execute(sql_check, (
-                    params_data['tenant_id'],
-                    params_data['client_id'],
-                    params_data['proposal_number'],
-                    params_data['certificate_number'],
-                    params_data['coverage_name']
-                ))
-                
-                existing_record = cur.fetchone()
-                
-                if existing_record:
-                    existing_id = existing_record[0]
-                    existing_status = existing_record[1]
-                    existing_capital = existing_record[2]
-                    existing_last_payment = existing_record[3]
-                    existing_next_payment = existing_record[4]
-                    existing_paid = existing_record[5]
-                    existing_pending = existing_record[6]
-                    
-                    has_changes = (
-                        existing_status != params_data['product_status'] or
-                        existing_capital != params_data['insured_capital'] or
-                        existing_last_payment != params_data['last_payment'] or
-                        existing_next_payment != params_data['next_payment'] or
-                        existing_paid != params_data['paid_installments_quantity'] or
-                        existing_pending != params_data['pending_installments_quantity']
-                    )
-                    
-                    if has_changes:
-                        sql_update = """
-                            UPDATE public.products_clients SET
-                                broker_name = %s,
-                                business_line = %s,
-                                product_type = %s,
-                                product_status = %s,
-                                coverage_name = %s,
-                                insured_capital = %s,
-                                coverage_payment_period = %s,
-                                due_day = %s,
-                                last_payment = %s,
-                                next_payment = %s,
-                                paid_installments_quantity = %s,
-                                pending_installments_quantity = %s,
-                                payment_frequency = %s
-                            WHERE id = %s
-                        """
-                        cur.execute(sql_update, (
-                            params_data['broker_name'],
-                            params_data['business_line'],
-                            params_data['product_type'],
-                            params_data['product_status'],
-                            params_data['coverage_name'],
-                            params_data['insured_capital'],
-                            params_data['coverage_payment_period'],
-                            params_data['due_day'],
-                            params_data['last_payment'],
-                            params_data['next_payment'],
-                            params_data['paid_installments_quantity'],
-                            params_data['pending_installments_quantity'],
-                            params_data['payment_frequency'],
-                            existing_id
-                        ))
-                        produtos_atualizados += 1
-                    else:
-                        produtos_existentes += 1
-                    continue
-                
-                sql_insert = """
-                    INSERT INTO public.products_clients (
-                        tenant_id, client_id, broker_name, business_line, product_type,
-                        proposal_number, certificate_number, product_status, coverage_name,
-                        insured_capital, coverage_payment_period, due_day, last_payment,
-                        next_payment, paid_installments_quantity, pending_installments_quantity,
-                        payment_frequency
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cur.execute(sql_insert, (
-                    params_data['tenant_id'],
-                    params_data['client_id'],
-                    params_data['broker_name'],
-                    params_data['business_line'],
-                    params_data['product_type'],
-                    params_data['proposal_number'],
-                    params_data['certificate_number'],
-                    params_data['product_status'],
-                    params_data['coverage_name'],
-                    params_data['insured_capital'],
-                    params_data['coverage_payment_period'],
-                    params_data['due_day'],
-                    params_data['last_payment'],
-                    params_data['next_payment'],
-                    params_data['paid_installments_quantity'],
-                    params_data['pending_installments_quantity'],
-                    params_data['payment_frequency']
-                ))
-                produtos_inseridos += 1
+        source_client_id = produto.get('id_cliente')
+        cpf_cliente = id_cpf_map.get(source_client_id)
 
-            except Exception as e:
-                logging.error(f"Erro ao processar registro de produto Vida na linha {i+1}: {e}")
-                conn.rollback()
+        if not cpf_cliente:
+            logging.warning(f"(Vida) Linha {i+1}: Não foi possível encontrar o CPF para o id_cliente '{source_client_id}'. Pulando.")
+            produtos_pulados_dados += 1
+            continue
 
-        conn.commit()
-        logging.info(f"Sincronização de Produtos Vida concluída. Inseridos: {produtos_inseridos}, Atualizados: {produtos_atualizados}, Existentes (sem mudança): {produtos_existentes}, Cancelados (ignorados): {produtos_cancelados}, Pulados por dados: {produtos_pulados_dados}.")
+        try:
+            capital = float(produto.get('capital_segurado', 0.0) or 0.0)
+        except (ValueError, TypeError):
+            logging.warning(f"(Vida) Linha {i+1}: Capital segurado inválido '{produto.get('capital_segurado')}'. Pulando.")
+            produtos_pulados_dados += 1
+            continue
+
+        linhas.append({
+            'linha': i + 1,
+            'cpf': cpf_cliente,
+            'nome_cliente': 'Cliente não informado',
+            'tenant_id': TENANT_ID,
+            'broker_name': safe_str(corretora_nome),
+            'business_line': safe_str(produto.get('linha_negocio')),
+            'product_type': safe_str(produto.get('tipo_produto')),
+            'proposal_number': safe_str(produto.get('numero_proposta')),
+            'certificate_number': safe_str(produto.get('numero_certificado')),
+            'product_status': safe_str(produto.get('situacao_produto')),
+            'coverage_name': safe_str(produto.get('nome_cobertura')),
+            'insured_capital': capital,
+            'coverage_payment_period': safe_str(produto.get('periodo_pagamento_cobertura')),
+            'due_day': safe_str(produto.get('dia_vencimento')),
+            'last_payment': format_db_date(produto.get('ultimo_pagamento')),
+            'next_payment': format_db_date(produto.get('proximo_pagamento')),
+            'paid_installments_quantity': safe_str(produto.get('quantidade_parcelas_pagas')),
+            'pending_installments_quantity': safe_str(produto.get('quantidade_parcelas_pendentes')),
+            'payment_frequency': safe_str(produto.get('periodicidade_pagamentos'))
+        })
+
+    comparadas = ['product_status', 'insured_capital', 'last_payment', 'next_payment',
+                  'paid_installments_quantity', 'pending_installments_quantity']
+    resultado = upsert_produtos_em_lote(linhas, broker_id, comparadas, "Vida")
+    if resultado is None:
+        return
+    produtos_inseridos, produtos_atualizados, produtos_existentes, sem_cliente = resultado
+    produtos_pulados_dados += sem_cliente
+    logging.info(f"Sincronização de Produtos Vida concluída. Inseridos: {produtos_inseridos}, Atualizados: {produtos_atualizados}, Existentes (sem mudança): {produtos_existentes}, Cancelados (ignorados): {produtos_cancelados}, Pulados por dados: {produtos_pulados_dados}.")
 
-    except Exception as e:
-        logging.error(f"Erro fatal na operação com banco de dados (produtos vida): {e}")
-        if conn: conn.rollback()
-    finally:
-        if conn: conn.close()
-        
 def salvar_produtos_previdencia_no_banco(produtos_data, broker_id, corretora_nome, id_cpf_map, db_url):
     """Salva/atualiza uma lista de produtos de Previdência no banco de dados."""
     logging.info("Iniciando sincronização de Produtos Previdência...")
@@ -724,187 +740,64 @@ def salvar_produtos_previdencia_no_banco(produtos_data, broker_id, corretora_nom
         logging.info("Nenhum produto Previdência para sincronizar.")
         return
 
-    conn = get_db_connection()
-    if not conn: return
-    
-    try:
-        cur = conn.cursor()
-        produtos_inseridos = 0
-        produtos_atualizados = 0
-        produtos_pulados_dados = 0
-        produtos_cancelados = 0
-        produtos_existentes = 0
-
-        for i, produto in enumerate(produtos_data):
-            try:
-                if not isinstance(produto, dict):
-                    produtos_pulados_dados += 1
-                    continue
-
-                situacao_produto = safe_str(produto.get('situacao_produto', 'Ativo')).upper()
-                if situacao_produto == 'CANCELADO':
-                    produtos_cancelados += 1
-                    continue
+    linhas = []
+    produtos_pulados_dados = 0
+    produtos_cancelados = 0
 
-                source_client_id = produto.get('id_cliente')
-                cpf_cliente = id_cpf_map.get(source_client_id)
+    for i, produto in enumerate(produtos_data):
+        if not isinstance(produto, dict):
+            produtos_pulados_dados += 1
+            continue
 
-                if not cpf_cliente:
-                    logging.warning(f"(Previdência) Linha {i+1}: Não foi possível encontrar o CPF para o id_cliente '{source_client_id}'. Pulando.")
-                    produtos_pulados_dados += 1
-                    continue
-                
-                nome_cliente = 'Cliente não informado'
-                client_id = get_or_create_client_id(cur, cpf_cliente, nome_cliente, broker_id, TENANT_ID)
-                if not client_id:
-                    logging.error(f"(Previdência) Linha {i+1}: Não foi possível obter/criar ID do cliente. Pulando.")
-                    produtos_pulados_dados += 1
-                    continue
-                
-                reserva_bruta_valor = produto.get('reserva_bruta', 0.0)
-                try:
-                    capital = float(reserva_bruta_valor or 0.0)
-                except (ValueError, TypeError):
-                    capital = 0.0
-                
-                params_data = {
-                    'tenant_id': TENANT_ID,
-                    'client_id': client_id,
-                    'broker_name': safe_str(corretora_nome),
-                    'business_line': safe_str(produto.get('linha_negocio', 'Previdência')),
-                    'product_type': safe_str(produto.get('tipo_produto')),
-                    'proposal_number': safe_str(produto.get('numero_proposta')),
-                    'certificate_number': safe_str(produto.get('numero_certificado', produto.get('numero_proposta'))),
-                    'product_status': safe_str(produto.get('situacao_produto', 'Ativo')),
-                    'coverage_name': safe_str(produto.get('nome_cobertura', 'Plano de Previdência')),
-                    'insured_capital': capital,
-                    'coverage_payment_period': safe_str(produto.get('periodo_pagamento_cobertura')),
-                    'due_day': safe_str(produto.get('dia_vencimento')),
-                    'last_payment': format_db_date(produto.get('ultima_contribuicao')),
-                    'next_payment': None,
-                    'paid_installments_quantity': safe_str(produto.get('quantidade_parcelas_pagas')),
-                    'pending_installments_quantity': safe_str(produto.get('quantidade_parcelas_pendentes')),
-                    'payment_frequency': safe_str(produto.get('periodicidade_pagamentos'))
-                }
-
-                sql_check = """
-                    SELECT id, product_status, insured_capital, last_payment,
-                           paid_installments_quantity, pending_installments_quantity
-                    FROM public.products_clients 
-                    WHERE tenant_id = %s 
-                    AND client_id = %s 
-                    AND proposal_number = %s 
-                    AND certificate_number = %s
-                    AND coverage_name = %s
-                """
-                cur.execute(sql_check, (
-                    params_data['tenant_id'],
-                    params_data['client_id'],
-                    params_data['proposal_number'],
-                    params_data['certificate_number'],
-                    params_data['coverage_name']
-                ))
-                
-                existing_record = cur.fetchone()
-                
-                if existing_record:
-                    existing_id = existing_record[0]
-                    existing_status = existing_record[1]
-                    existing_capital = existing_record[2]
-                    existing_last_payment = existing_record[3]
-                    existing_paid = existing_record[4]
-                    existing_pending = existing_record[5]
-                    
-                    has_changes = (
-                        existing_status != params_data['product_status'] or
-                        existing_capital != params_data['insured_capital'] or
-                        existing_last_payment != params_data['last_payment'] or
-                        existing_paid != params_data['paid_installments_quantity'] or
-                        existing_pending != params_data['pending_installments_quantity']
-                    )
-                    
-                    if has_changes:
-                        sql_update = """
-                            UPDATE public.products_clients SET
-                                broker_name = %s,
-                                business_line = %s,
-                                product_type = %s,
-                                product_status = %s,
-                                coverage_name = %s,
-                                insured_capital = %s,
-                                coverage_payment_period = %s,
-                                due_day = %s,
-                                last_payment = %s,
-                                next_payment = %s,
-                                paid_installments_quantity = %s,
-                                pending_installments_quantity = %s,
-                                payment_frequency = %s
-                            WHERE id = %s
-                        """
-                        cur.execute(sql_update, (
-                            params_data['broker_name'],
-                            params_data['business_line'],
-                            params_data['product_type'],
-                            params_data['product_status'],
-                            params_data['coverage_name'],
-                            params_data['insured_capital'],
-                            params_data['coverage_payment_period'],
-                            params_data['due_day'],
-                            params_data['last_payment'],
-                            params_data['next_payment'],
-                            params_data['paid_installments_quantity'],
-                            params_data['pending_installments_quantity'],
-                            params_data['payment_frequency'],
-                            existing_id
-                        ))
-                        produtos_atualizados += 1
-                    else:
-                        produtos_existentes += 1
-                    continue
+        situacao_produto = (safe_str(produto.get('situacao_produto', 'Ativo')) or '').upper()
+        if situacao_produto == 'CANCELADO':
+            produtos_cancelados += 1
+            continue
 
-                sql_insert = """
-                    INSERT INTO public.products_clients (
-                        tenant_id, client_id, broker_name, business_line, product_type,
-                        proposal_number, certificate_number, product_status, coverage_name,
-                        insured_capital, coverage_payment_period, due_day, last_payment,
-                        next_payment, paid_installments_quantity, pending_installments_quantity,
-                        payment_frequency
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cur.execute(sql_insert, (
-                    params_data['tenant_id'],
-                    params_data['client_id'],
-                    params_data['broker_name'],
-                    params_data['business_line'],
-                    params_data['product_type'],
-                    params_data['proposal_number'],
-                    params_data['certificate_number'],
-                    params_data['product_status'],
-                    params_data['coverage_name'],
-                    params_data['insured_capital'],
-                    params_data['coverage_payment_period'],
-                    params_data['due_day'],
-                    params_data['last_payment'],
-                    params_data['next_payment'],
-                    params_data['paid_installments_quantity'],
-                    params_data['pending_installments_quantity'],
-                    params_data['payment_frequency']
-                ))
-                produtos_inseridos += 1
-            except Exception as e:
-                numero_proposta_erro = produto.get('numero_proposta', 'N/A')
-                logging.error(f"Erro ao processar registro de produto Previdência na linha {i+1} (Proposta: {numero_proposta_erro}): {e}")
-                conn.rollback()
+        source_client_id = produto.get('id_cliente')
+        cpf_cliente = id_cpf_map.get(source_client_id)
 
-        conn.commit()
-        logging.info(f"Sincronização de Produtos Previdência concluída. Inseridos: {produtos_inseridos}, Atualizados: {produtos_atualizados}, Existentes (sem mudança): {produtos_existentes}, Cancelados (ignorados): {produtos_cancelados}, Pulados por dados: {produtos_pulados_dados}.")
+        if not cpf_cliente:
+            logging.warning(f"(Previdência) Linha {i+1}: Não foi possível encontrar o CPF para o id_cliente '{source_client_id}'. Pulando.")
+            produtos_pulados_dados += 1
+            continue
 
-    except Exception as e:
-        logging.error(f"Erro fatal na operação com banco de dados (produtos previdência): {e}")
-        if conn: conn.rollback()
-    finally:
-        if conn: conn.close()
+        reserva_bruta_valor = produto.get('reserva_bruta', 0.0)
+        try:
+            capital = float(reserva_bruta_valor or 0.0)
+        except (ValueError, TypeError):
+            capital = 0.0
+
+        linhas.append({
+            'linha': i + 1,
+            'cpf': cpf_cliente,
+            'nome_cliente': 'Cliente não informado',
+            'tenant_id': TENANT_ID,
+            'broker_name': safe_str(corretora_nome),
+            'business_line': safe_str(produto.get('linha_negocio', 'Previdência')),
+            'product_type': safe_str(produto.get('tipo_produto')),
+            'proposal_number': safe_str(produto.get('numero_proposta')),
+            'certificate_number': safe_str(produto.get('numero_certificado', produto.get('numero_proposta'))),
+            'product_status': safe_str(produto.get('situacao_produto', 'Ativo')),
+            'coverage_name': safe_str(produto.get('nome_cobertura', 'Plano de Previdência')),
+            'insured_capital': capital,
+            'coverage_payment_period': safe_str(produto.get('periodo_pagamento_cobertura')),
+            'due_day': safe_str(produto.get('dia_vencimento')),
+            'last_payment': format_db_date(produto.get('ultima_contribuicao')),
+            'next_payment': None,
+            'paid_installments_quantity': safe_str(produto.get('quantidade_parcelas_pagas')),
+            'pending_installments_quantity': safe_str(produto.get('quantidade_parcelas_pendentes')),
+            'payment_frequency': safe_str(produto.get('periodicidade_pagamentos'))
+        })
+
+    comparadas = ['product_status', 'insured_capital', 'last_payment',
+                  'paid_installments_quantity', 'pending_installments_quantity']
+    resultado = upsert_produtos_em_lote(linhas, broker_id, comparadas, "Previdência")
+    if resultado is None:
+        return
+    produtos_inseridos, produtos_atualizados, produtos_existentes, sem_cliente = resultado
+    produtos_pulados_dados += sem_cliente
+    logging.info(f"Sincronização de Produtos Previdência concluída. Inseridos: {produtos_inseridos}, Atualizados: {produtos_atualizados}, Existentes (sem mudança): {produtos_existentes}, Cancelados (ignorados): {produtos_cancelados}, Pulados por dados: {produtos_pulados_dados}.")
 
 # --- FUNÇÃO PRINCIPAL ---
 def main():
@@ -917,9 +810,9 @@ def main():
     if not os.path.exists(PASTA_PROCESSADOS):
         os.makedirs(PASTA_PROCESSADOS)
     
-    arquivos_para_processar = [f for f in os.listdir(PASTA_DOWNLOAD) if f.endswith("_backup.json")]
+    arquivos_para_processar = [f for f in os.listdir(PASTA_DOWNLOAD) if f.endswith(("_backup.json", "_backup.ndjson"))]
     if not arquivos_para_processar:
-        logging.info("Nenhum novo arquivo .json para sincronizar.")
+        logging.info("Nenhum novo arquivo de backup para sincronizar.")
         return
 
     for filename in arquivos_para_processar:
@@ -929,17 +822,20 @@ def main():
         all_sheets_data = None
         
         try:
-            encodings_to_try = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-            for encoding in encodings_to_try:
-                try:
-                    with open(caminho_arquivo, 'r', encoding=encoding) as f:
-                        all_sheets_data = json.load(f)
-                    logging.info(f"Arquivo lido com sucesso usando encoding: {encoding}")
-                    break
-                except (UnicodeDecodeError, json.JSONDecodeError) as e:
-                    if encoding == encodings_to_try[-1]:
-                        raise
-                    continue
+            if filename.endswith(".ndjson"):
+                all_sheets_data = ler_backup_ndjson(caminho_arquivo)
+            else:
+                encodings_to_try = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
+                for encoding in encodings_to_try:
+                    try:
+                        with open(caminho_arquivo, 'r', encoding=encoding) as f:
+                            all_sheets_data = json.load(f)
+                        logging.info(f"Arquivo lido com sucesso usando encoding: {encoding}")
+                        break
+                    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                        if encoding == encodings_to_try[-1]:
+                            raise
+                        continue
         except Exception as e:
             logging.error(f"Erro CRÍTICO ao ler ou decodificar o arquivo '{filename}': {e}")
             continue
@@ -992,7 +888,7 @@ def main():
                         else:
                              logging.error(f"Broker com nome similar a '{corretora_nome}' não encontrado no banco de dados.")
                     finally:
-                        conn_temp.close()
+                        release_db_connection(conn_temp)
 
             if broker_id:
                 if propostas_data:
@@ -1007,12 +903,16 @@ def main():
                 logging.error(f"Broker ID não obtido para '{corretora_nome}'. Sincronização pulada.")
 
             os.rename(caminho_arquivo, os.path.join(PASTA_PROCESSADOS, filename))
+            caminho_manifesto = caminho_manifesto_ndjson(caminho_arquivo)
+            if filename.endswith(".ndjson") and os.path.exists(caminho_manifesto):
+                os.rename(caminho_manifesto, os.path.join(PASTA_PROCESSADOS, os.path.basename(caminho_manifesto)))
             logging.info(f"Arquivo '{filename}' processado e movido.")
         except Exception as e:
             logging.error(f"Ocorreu um erro grave ao processar o conteúdo do arquivo '{filename}': {e}")
             import traceback
             logging.error(traceback.format_exc())
             
+    close_db_pool()
     logging.info("\n--- SINCRONIZAÇÃO CONCLUÍDA ---")
 
 if __name__ == "__main__":